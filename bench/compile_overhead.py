@@ -0,0 +1,92 @@
+"""
+グラフ・エージェントの構築コストのベンチマーク（ネットワーク不要）
+
+反復ごとに行っていた処理（Excel入力欄特定ワークフローの build_workflow().compile()、
+ReActエージェントの create_react_agent(...)）と、プロセス内で共有するコンパイル済みのもの
+（get_format_app / get_sample_agent）の取得にかかる時間を比較する。
+
+使い方:
+    python bench/compile_overhead.py --iterations 50
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+def measure(func: Callable[[], object], iterations: int) -> Dict[str, float]:
+    """func を iterations 回実行し、1回あたりの所要時間（ミリ秒）を集計する"""
+    durations: List[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": statistics.mean(durations),
+        "p50_ms": statistics.median(durations),
+        "max_ms": max(durations),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="グラフ・エージェントの構築コストのベンチマーク")
+    parser.add_argument("--iterations", type=int, default=50, help="計測回数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    # モデルクライアントの作成にはAPIキーが必要（リクエストは送信しない）
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("RESPONSE_CACHE_MODE", "off")
+
+    from langgraph.prebuilt import create_react_agent
+
+    from agent.excel_format_node import get_format_app
+    from agent.llm_clients import get_chat_model
+    from agent.react_node import (
+        AgentState_custom,
+        Result,
+        analyze_image_structured_tool,
+        get_sample_agent,
+        query_to_human_tool,
+    )
+    from agent.understand_format import build_workflow
+
+    def build_agent():
+        return create_react_agent(
+            model=get_chat_model("gpt-4.1-mini"),
+            tools=[query_to_human_tool, analyze_image_structured_tool],
+            state_schema=AgentState_custom,
+            response_format=Result,
+        )
+
+    # 初回の構築（モジュールの読み込み・共有インスタンスの作成）は計測から除く
+    get_format_app()
+    get_sample_agent()
+
+    results = {
+        "format_workflow_compile": measure(lambda: build_workflow().compile(), args.iterations),
+        "format_workflow_shared": measure(get_format_app, args.iterations),
+        "sample_agent_build": measure(build_agent, args.iterations),
+        "sample_agent_shared": measure(get_sample_agent, args.iterations),
+    }
+    saved_ms = (
+        results["format_workflow_compile"]["mean_ms"] - results["format_workflow_shared"]["mean_ms"]
+        + results["sample_agent_build"]["mean_ms"] - results["sample_agent_shared"]["mean_ms"]
+    )
+
+    if args.json:
+        print(json.dumps({"iterations": args.iterations, "results": results, "saved_ms_per_iteration": saved_ms}, ensure_ascii=False, indent=2))
+        return
+    print(f"計測回数: {args.iterations}")
+    for name, stat in results.items():
+        print(f"{name:28s} 平均: {stat['mean_ms']:8.3f}ms  p50: {stat['p50_ms']:8.3f}ms  最大: {stat['max_ms']:8.3f}ms")
+    print(f"1反復あたりの削減: {saved_ms:.3f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+OpenAI互換のチャット補完エンドポイントのスタンドイン（負荷試験用）
+
+実際のモデルを呼び出さずにグラフ全体のスループットを計測するためのローカルサーバー。
+標準ライブラリのみで動作し、以下を再現する。
+- 応答の遅延（固定 / 一様分布 / 正規分布 / 対数正規分布）
+- エラー（500）・レート制限（429, Retry-After付き）の注入
+- 構造化出力（response_format の json_schema 名ごとの定型応答。未登録のスキーマはスキーマから生成）
+- ReActエージェントへのツール呼び出し（analyze_image_tool）の注入
+- stream=True の場合はSSEで応答
+
+使い方:
+    python bench/fake_openai_server.py --port 8765 --latency lognormal:-0.7,0.5 --rate-limit-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake langgraph dev
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+# 構造化出力の定型応答（キーは response_format.json_schema.name = Pydanticモデルのクラス名）
+CANNED_OUTPUTS: Dict[str, Dict[str, Any]] = {
+    "Result": {
+        "reason": "証跡の日付が2025年であることを確認した。",
+        "support_data": "注文日: 2025-04-01",
+        "result": "OK",
+    },
+    "ExcelFormFields": {
+        "fields": [
+            {"cell_id": "C5", "description": "監査手続き名"},
+            {"cell_id": "C6", "description": "実施日"},
+            {"cell_id": "C7", "description": "実施者"},
+            {"cell_id": "D12", "description": "サンプルごとの結果"},
+        ],
+        "reason": "見出しの右隣の空欄を入力欄と判断した。",
+    },
+    "ValidationResult": {"status": "OK", "issues": None, "suggestions": None},
+    "CollectExcelFormFields": {
+        "add_fields": [{"cell_id": "D13", "description": "サンプルごとの根拠"}],
+        "delete_fields": [{"cell_id": "C7", "description": "実施者"}],
+        "reason": "レビュー結果に基づき修正した。",
+    },
+    "CellValueList": {
+        "items": [
+            {"cell_id": "C5", "value": "2025年のデータか確認"},
+            {"cell_id": "C6", "value": "2025-06-01"},
+            {"cell_id": "D12", "value": "OK"},
+        ]
+    },
+}
+
+NG_VALIDATION = {
+    "status": "修正が必要",
+    "issues": ["根拠欄がハイライトされていない"],
+    "suggestions": ["D13を入力欄に追加する"],
+}
+
+def make_latency(spec: str, rng: Optional[random.Random] = None) -> Callable[[], float]:
+    """
+    遅延の分布を作成する
+
+    Args:
+        spec (str): "fixed:0.5" / "uniform:0.2,1.0" / "normal:0.8,0.2" / "lognormal:-0.7,0.5"（秒）
+        rng (Optional[random.Random]): 乱数生成器（未指定の場合は新しく作成）
+
+    Returns:
+        Callable[[], float]: 遅延秒数を返す関数
+    """
+    rng = rng or random.Random()
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed":
+        return lambda: values[0] if values else 0.0
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"未対応の遅延分布です: {spec}")
+
+def instance_from_schema(schema: Dict[str, Any], defs: Optional[Dict[str, Any]] = None) -> Any:
+    """JSON Schemaを満たす最小限の値を生成する（定型応答が未登録のスキーマ用）"""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return instance_from_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            return instance_from_schema(schema[key][0], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+    if schema_type == "object":
+        return {name: instance_from_schema(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [instance_from_schema(schema.get("items", {}), defs)]
+    if schema_type == "string":
+        return "dummy"
+    if schema_type in ("integer", "number"):
+        return 0
+    if schema_type == "boolean":
+        return False
+    return None
+
+@dataclass
+class FakeServerConfig:
+    """スタンドインサーバーの設定"""
+
+    latency: str = "fixed:0"
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 0.5
+    tool_call_rate: float = 0.0
+    ng_rate: float = 0.0
+    seed: Optional[int] = None
+
+class FakeServerStats:
+    """リクエスト数の集計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+def _has_tool_result(messages: List[Dict[str, Any]]) -> bool:
+    return any(message.get("role") == "tool" for message in messages)
+
+def build_completion(body: Dict[str, Any], config: FakeServerConfig, rng: random.Random) -> Dict[str, Any]:
+    """リクエストに対する chat.completion の応答を作成する"""
+    message: Dict[str, Any] = {"role": "assistant", "content": None}
+    response_format = body.get("response_format") or {}
+    tools = body.get("tools") or []
+    tool_names = [tool.get("function", {}).get("name") for tool in tools]
+
+    if response_format.get("type") == "json_schema":
+        json_schema = response_format["json_schema"]
+        name = json_schema.get("name", "")
+        if name == "ValidationResult" and rng.random() < config.ng_rate:
+            output = NG_VALIDATION
+        elif name in CANNED_OUTPUTS:
+            output = CANNED_OUTPUTS[name]
+        else:
+            output = instance_from_schema(json_schema.get("schema", {}))
+        message["content"] = json.dumps(output, ensure_ascii=False)
+    elif "analyze_image_tool" in tool_names and not _has_tool_result(body.get("messages", [])) and rng.random() < config.tool_call_rate:
+        message["tool_calls"] = [{
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {
+                "name": "analyze_image_tool",
+                "arguments": json.dumps({"image_data_num": 1, "query": "日付を確認してください"}, ensure_ascii=False),
+            },
+        }]
+    else:
+        message["content"] = "手続きを実施しました。証跡の日付は2025年です。"
+
+    prompt_chars = len(json.dumps(body.get("messages", []), ensure_ascii=False))
+    completion_chars = len(json.dumps(message, ensure_ascii=False))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": completion_chars // 4,
+            "total_tokens": (prompt_chars + completion_chars) // 4,
+        },
+    }
+
+def _stream_chunks(completion: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """chat.completion を chat.completion.chunk の列に変換する"""
+    choice = completion["choices"][0]
+    delta: Dict[str, Any] = {"role": "assistant", "content": choice["message"].get("content")}
+    if choice["message"].get("tool_calls"):
+        delta["tool_calls"] = [dict(call, index=idx) for idx, call in enumerate(choice["message"]["tool_calls"])]
+    base = {key: completion[key] for key in ("id", "created", "model")}
+    return [
+        {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": None}]},
+        {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}],
+         "usage": completion["usage"]},
+    ]
+
+def make_handler(config: FakeServerConfig, stats: FakeServerStats):
+    rng = random.Random(config.seed)
+    rng_lock = threading.Lock()
+    latency = make_latency(config.latency, rng)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):  # noqa: A002
+            pass
+
+        def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") in ("/stats", "/v1/stats"):
+                self._send_json(200, stats.snapshot())
+            elif self.path.rstrip("/") in ("/v1/models", "/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "gpt-4.1", "object": "model"}, {"id": "gpt-4.1-mini", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", "0"))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            stats.add("requests")
+            with rng_lock:
+                roll = rng.random()
+                delay = latency()
+                completion = build_completion(body, config, rng)
+
+            if roll < config.rate_limit_rate:
+                stats.add("rate_limited")
+                self._send_json(429, {"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+                                {"Retry-After": str(config.retry_after)})
+                return
+            time.sleep(delay)
+            if roll < config.rate_limit_rate + config.error_rate:
+                stats.add("errors")
+                self._send_json(500, {"error": {"message": "Internal server error (fake)", "type": "server_error"}})
+                return
+
+            schema_name = (body.get("response_format") or {}).get("json_schema", {}).get("name")
+            stats.add(f"schema:{schema_name}" if schema_name else ("tool_calls" if completion["choices"][0]["message"].get("tool_calls") else "text"))
+            if not body.get("stream"):
+                self._send_json(200, completion)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for chunk in _stream_chunks(completion):
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+    return Handler
+
+class FakeOpenAIServer:
+    """
+    スタンドインサーバーをバックグラウンドスレッドで起動する
+
+    Args:
+        config (FakeServerConfig): サーバーの設定
+        host (str): 待ち受けアドレス
+        port (int): 待ち受けポート（0の場合は空いているポート）
+    """
+
+    def __init__(self, config: Optional[FakeServerConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeServerConfig()
+        self.stats = FakeServerStats()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.config, self.stats))
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """サーバー設定のコマンドライン引数を追加する（ドライバーと共通）"""
+    parser.add_argument("--latency", default="lognormal:-0.7,0.5", help="遅延の分布（fixed:s / uniform:a,b / normal:mu,sd / lognormal:mu,sigma）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500エラーを返す割合")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429を返す割合")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="429のRetry-After秒数")
+    parser.add_argument("--tool-call-rate", type=float, default=0.3, help="ReActエージェントにanalyze_image_toolを呼ばせる割合")
+    parser.add_argument("--ng-rate", type=float, default=0.3, help="ValidationResultで「修正が必要」を返す割合")
+    parser.add_argument("--seed", type=int, default=None, help="乱数シード")
+
+def config_from_args(args: argparse.Namespace) -> FakeServerConfig:
+    return FakeServerConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        tool_call_rate=args.tool_call_rate,
+        ng_rate=args.ng_rate,
+        seed=args.seed,
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI互換のスタンドインサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    make_latency(args.latency)  # 分布の指定を起動前に検証する
+    server = FakeOpenAIServer(config_from_args(args), args.host, args.port)
+    print(f"OPENAI_BASE_URL={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats.snapshot(), ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+LangGraphサーバーのエントリーポイント（agent.graph）の読み込み時間のベンチマーク
+
+新しいPythonプロセスで agent.graph を読み込む時間を繰り返し計測し、予算（--budget-ms）を超えた場合や、
+ノードの実行時まで読み込みを遅らせている重い依存パッケージが読み込まれていた場合は終了コード1で終了する。
+
+使い方:
+    python bench/import_time.py --runs 5 --budget-ms 1500
+    python bench/import_time.py --top 15
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# 起動時には読み込まない（最初に使用するノードで読み込む）パッケージ
+DEFERRED_MODULES = [
+    "pandas",
+    "fitz",
+    "openpyxl",
+    "langchain_openai",
+    "openai",
+    "langgraph.prebuilt",
+    "dotenv",
+    "agent.understand_format",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import agent.graph
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed_ms": elapsed * 1000, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+def run_once(module_filter: List[str], importtime: bool = False) -> Tuple[Dict, str]:
+    """新しいプロセスで agent.graph を読み込み、所要時間と読み込まれたパッケージを返す"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_ROOT / "src"), env.get("PYTHONPATH")]))
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", PROBE % (module_filter,)]
+    completed = subprocess.run(command, capture_output=True, text=True, env=env, cwd=str(REPO_ROOT), check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return result, completed.stderr
+
+def top_imports(importtime_output: str, count: int) -> List[Tuple[str, float]]:
+    """-X importtime の出力から、agent.graph が直接読み込むモジュールを読み込み時間（子モジュールを含む）の大きい順に返す"""
+    entries: List[Tuple[int, str, float]] = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # 階層の深さはインデント（2文字ごと）で表され、子モジュールは親より先に出力される
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1000))
+
+    graph_index = next((idx for idx, entry in enumerate(entries) if entry[1] == "agent.graph"), None)
+    if graph_index is None:
+        return []
+    graph_depth = entries[graph_index][0]
+    modules = []
+    for depth, name, cumulative_ms in reversed(entries[:graph_index]):
+        if depth <= graph_depth:
+            break
+        if depth == graph_depth + 1:
+            modules.append((name, cumulative_ms))
+    return sorted(modules, key=lambda item: item[1], reverse=True)[:count]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="agent.graph の読み込み時間のベンチマーク")
+    parser.add_argument("--runs", type=int, default=5, help="計測回数")
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="読み込み時間（中央値）の予算（ミリ秒）")
+    parser.add_argument("--top", type=int, default=10, help="表示する読み込み時間の大きいモジュール数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    durations: List[float] = []
+    loaded: List[str] = []
+    for _ in range(args.runs):
+        result, _ = run_once(DEFERRED_MODULES)
+        durations.append(result["elapsed_ms"])
+        loaded = result["loaded"]
+    _, importtime_output = run_once(DEFERRED_MODULES, importtime=True)
+    top = top_imports(importtime_output, args.top)
+
+    median_ms = statistics.median(durations)
+    ok = median_ms <= args.budget_ms and not loaded
+    summary = {
+        "runs": args.runs,
+        "median_ms": median_ms,
+        "min_ms": min(durations),
+        "max_ms": max(durations),
+        "budget_ms": args.budget_ms,
+        "deferred_modules_loaded": loaded,
+        "top_imports_ms": dict(top),
+        "ok": ok,
+    }
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print(f"agent.graph の読み込み: 中央値 {median_ms:.1f}ms (最小 {min(durations):.1f}ms, 最大 {max(durations):.1f}ms, 予算 {args.budget_ms:.0f}ms)")
+        print("読み込み時間の大きいモジュール:")
+        for name, ms in top:
+            print(f"  {name:40s} {ms:8.1f}ms")
+        if loaded:
+            print(f"起動時に読み込まれた遅延対象のパッケージ: {', '.join(loaded)}")
+        print("OK" if ok else "NG")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+グラフ全体のベンチマーク（スタンドインサーバーを使用してネットワークなしで実行）
+
+fake_openai_server をバックグラウンドで起動し、OPENAI_BASE_URL をそのサーバーに向けた状態で
+graph（graph.py のコンパイル済みグラフ）を同梱のサンプルデータで繰り返し実行する。
+実行ごとの所要時間とサーバーが受け付けたリクエスト数を出力する。
+
+使い方:
+    python bench/run_graph.py --runs 5 --parallel --max-concurrency 4 --latency lognormal:-0.7,0.5
+    python bench/run_graph.py --runs 3 --async --rate-limit-rate 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from fake_openai_server import FakeOpenAIServer, add_server_arguments, config_from_args  # noqa: E402
+
+def build_input(args: argparse.Namespace, output_dir: str) -> Dict[str, Any]:
+    """1回分のグラフ入力を作成する（出力・キャッシュは一時ディレクトリに書き込む）"""
+    excel_file = str(Path(args.excel_file).resolve())
+    return {
+        "procedure": args.procedure,
+        "sample_root": str(Path(args.sample_root).resolve()),
+        "sample_data_path": args.sample_data_path,
+        "parallel_samples": args.parallel,
+        "max_concurrency": args.max_concurrency,
+        "excel_file": excel_file,
+        "format_path": excel_file,
+        "output_dir": output_dir,
+        "excel_capture_backend": args.capture_backend,
+        "excel_max_iterations": args.excel_max_iterations,
+        "excel_format_cache_enabled": args.warm_format_cache,
+        "excel_format_cache_dir": os.path.join(args.work_dir, "format_cache") if args.warm_format_cache else "",
+        "page_cache_dir": os.path.join(args.work_dir, "page_cache"),
+    }
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="スタンドインサーバーを使用したグラフ全体のベンチマーク")
+    parser.add_argument("--runs", type=int, default=3, help="実行回数")
+    parser.add_argument("--parallel", action="store_true", help="サンプルを並列に処理する（parallel_samples）")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="並列処理時の同時実行数")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="graph.ainvoke で実行する")
+    parser.add_argument("--sample-root", default=str(REPO_ROOT / "data" / "sample"))
+    parser.add_argument("--sample-data-path", default="テスト1")
+    parser.add_argument("--excel-file", default=str(REPO_ROOT / "data" / "format" / "サンプルテスト調書フォーマット.xlsx"))
+    parser.add_argument("--procedure", default="2025年のデータか確認してください。")
+    parser.add_argument("--capture-backend", default="native", help="Excelキャプチャのバックエンド（soffice / native）")
+    parser.add_argument("--excel-max-iterations", type=int, default=3)
+    parser.add_argument("--warm-format-cache", action="store_true", help="実行間でExcel入力欄特定結果のキャッシュを共有する")
+    parser.add_argument("--use-response-cache", action="store_true", help="応答キャッシュを有効にする（デフォルトは無効）")
+    parser.add_argument("--base-url", default="", help="起動済みのスタンドインサーバーのURL（未指定の場合は起動する）")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        server = FakeOpenAIServer(config_from_args(args)).start()
+        base_url = server.base_url
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    if args.use_response_cache:
+        os.environ.setdefault("RESPONSE_CACHE_MODE", "readwrite")
+    else:
+        os.environ["RESPONSE_CACHE_MODE"] = "off"
+
+    # 環境変数の設定後にグラフを読み込む
+    from agent.graph import graph
+
+    args.work_dir = tempfile.mkdtemp(prefix="bench_graph_")
+    os.environ.setdefault("ARTIFACT_STORE_DIR", os.path.join(args.work_dir, "artifacts"))
+    durations: List[float] = []
+    failures = 0
+    try:
+        for run in range(args.runs):
+            output_dir = os.path.join(args.work_dir, f"run{run}")
+            os.makedirs(output_dir)
+            graph_input = build_input(args, output_dir)
+            config = {"configurable": {"thread_id": f"bench-{run}"}, "recursion_limit": 100}
+            start = time.perf_counter()
+            try:
+                if args.use_async:
+                    result = asyncio.run(graph.ainvoke(graph_input, config))
+                else:
+                    result = graph.invoke(graph_input, config)
+                elapsed = time.perf_counter() - start
+                samples = result.get("results_count") or 0
+                print(f"run {run + 1}/{args.runs}: {elapsed:.2f}s (samples: {samples})", file=sys.stderr)
+            except Exception as e:
+                elapsed = time.perf_counter() - start
+                failures += 1
+                print(f"run {run + 1}/{args.runs}: 失敗 {elapsed:.2f}s ({e})", file=sys.stderr)
+            durations.append(elapsed)
+    finally:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+        server_stats = server.stats.snapshot() if server else {}
+        if server:
+            server.stop()
+
+    summary = {
+        "runs": args.runs,
+        "failures": failures,
+        "mean_s": statistics.mean(durations) if durations else 0.0,
+        "p50_s": percentile(durations, 50) if durations else 0.0,
+        "p95_s": percentile(durations, 95) if durations else 0.0,
+        "runs_per_min": 60 * len(durations) / sum(durations) if durations and sum(durations) else 0.0,
+        "server": server_stats,
+    }
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+    print(f"実行回数: {summary['runs']} (失敗: {failures})")
+    print(f"平均: {summary['mean_s']:.2f}s  p50: {summary['p50_s']:.2f}s  p95: {summary['p95_s']:.2f}s  スループット: {summary['runs_per_min']:.1f} 回/分")
+    if server_stats:
+        print(f"サーバー: {json.dumps(server_stats, ensure_ascii=False)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+画像などのバイナリを内容のSHA-256ごとに1回だけ保存するアーティファクトストア
+
+エージェントへの入力メッセージには画像のdata URL（base64）ではなく artifact://<SHA-256>?type=<MIMEタイプ> の参照を入れ、
+モデルの呼び出し時（リクエストの作成時）にdata URLへ変換する（agent.llm_clients）。
+State.messages やチェックポイントには短い参照のみが保存されるため、サンプルごとに数MBのbase64を直列化せずに済む。
+応答キャッシュのキーも参照で計算されるため、同じ画像は同じキーになる。
+
+保存先の合計サイズが上限を超えた場合は、最終参照（保存・読み込み）が古いものから disk_cache.evict_lru で削除する
+（上限の EVICT_TARGET_RATIO まで減らす。合計はプロセス内の概算で、削除の際に走査して補正する）。
+中断中の実行のチェックポイントが参照する画像が削除された場合は再開時に ArtifactNotFoundError となるため、
+中断したジョブを長期間保持する場合は上限を大きくする（0 で無制限）。
+
+環境変数:
+    ARTIFACT_STORE_DIR: 保存先のディレクトリ（デフォルト: .cache/artifacts）
+    ARTIFACT_STORE_MAX_BYTES: 保存先の合計バイト数の上限（デフォルト: 2GiB、0以下の場合は無制限）
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import threading
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from agent.disk_cache import cache_size, evict_lru, touch
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_SCHEME = "artifact://"
+
+# 上限を超えた場合に削除後の合計を上限の何割まで減らすか（毎回の保存で走査しないよう余裕を持たせる）
+EVICT_TARGET_RATIO = 0.9
+
+class ArtifactNotFoundError(KeyError):
+    """参照に対応するアーティファクトが保存されていない場合の例外"""
+
+def is_artifact_ref(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(ARTIFACT_SCHEME)
+
+def parse_artifact_ref(ref: str) -> Tuple[str, str]:
+    """参照からSHA-256とMIMEタイプを取得する"""
+    parsed = urlparse(ref)
+    mime_type = parse_qs(parsed.query).get("type", ["application/octet-stream"])[0]
+    return parsed.netloc, mime_type
+
+class ArtifactStore:
+    """
+    内容のSHA-256をキーとするファイルベースのストア
+
+    Args:
+        root (str): 保存先のディレクトリ
+        max_bytes (int): 保存先の合計バイト数の上限（0以下の場合は無制限）
+    """
+
+    def __init__(self, root: str, max_bytes: int = 0):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._size_lock = threading.Lock()
+        # 保存したバイト数を加えた保存先全体の合計（最初の保存で走査して初期化する）
+        self._total_bytes: Optional[int] = None
+
+    def path(self, sha256: str) -> str:
+        # evict_lru はディレクトリ直下のエントリ単位で削除するため、サブディレクトリに分けずに保存する
+        return os.path.join(self.root, sha256)
+
+    def _legacy_path(self, sha256: str) -> str:
+        """以前の保存先（先頭2文字のサブディレクトリ。サブディレクトリごと古い順に削除される）"""
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def _added(self, size: int) -> None:
+        """保存したバイト数を合計に加え、上限を超えた場合のみLRU削除する"""
+        if self.max_bytes <= 0:
+            return
+        root = Path(self.root)
+        with self._size_lock:
+            if self._total_bytes is None:
+                self._total_bytes = cache_size(root)
+            else:
+                self._total_bytes += size
+            if self._total_bytes <= self.max_bytes:
+                return
+            try:
+                evict_lru(root, max_bytes=int(self.max_bytes * EVICT_TARGET_RATIO))
+            except OSError as e:
+                logger.warning(f"アーティファクトストアの整理に失敗しました: {self.root} ({e})")
+            self._total_bytes = cache_size(root)
+
+    def put(self, data: bytes, mime_type: str) -> str:
+        """
+        バイナリを保存し、参照を返す（同じ内容が保存済みの場合は書き込まない）
+
+        Args:
+            data (bytes): 保存する内容
+            mime_type (str): MIMEタイプ（data URLへの変換時に使用）
+
+        Returns:
+            str: artifact:// の参照
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path(sha256)
+        try:
+            # 保存済みの内容も最終参照時刻を更新し、LRU削除の対象から遠ざける
+            os.utime(path, None)
+        except FileNotFoundError:
+            # 書き込み途中のファイルを読み込まないよう、一時ファイル（LRU削除の対象外）に書き込んでからリネームする
+            fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=self.root)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._added(len(data))
+        return f"{ARTIFACT_SCHEME}{sha256}?type={mime_type}"
+
+    def get(self, ref: str) -> bytes:
+        """
+        参照に対応する内容を読み込む
+
+        Raises:
+            ArtifactNotFoundError: 保存されていない場合
+        """
+        sha256, _ = parse_artifact_ref(ref)
+        for path in (self.path(sha256), self._legacy_path(sha256)):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            touch(Path(path))
+            return data
+        raise ArtifactNotFoundError(ref)
+
+    def data_url(self, ref: str) -> str:
+        """参照をdata URLに変換する"""
+        _, mime_type = parse_artifact_ref(ref)
+        return f"data:{mime_type};base64,{base64.b64encode(self.get(ref)).decode('utf-8')}"
+
+    def resolve(self, value: Any) -> Any:
+        """
+        リクエストの内容（dict / list）に含まれる参照をdata URLに変換する（元の値は変更しない）
+
+        Args:
+            value (Any): モデルへのリクエストのメッセージなど
+
+        Returns:
+            Any: 参照をdata URLに置き換えた値
+        """
+        if is_artifact_ref(value):
+            return self.data_url(value)
+        if isinstance(value, dict):
+            return {key: self.resolve(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        return value
+
+_stores: Dict[str, ArtifactStore] = {}
+_stores_lock = threading.Lock()
+
+def get_artifact_store(root: Optional[str] = None) -> ArtifactStore:
+    """
+    保存先ごとに共有するArtifactStoreを取得する（未指定の場合は環境変数またはデフォルトの保存先）
+    """
+    key = os.path.abspath(root or os.getenv("ARTIFACT_STORE_DIR", os.path.join(".cache", "artifacts")))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ArtifactStore(key, int(os.getenv("ARTIFACT_STORE_MAX_BYTES", str(2 * 1024 ** 3))))
+        return _stores[key]
@@ -0,0 +1,493 @@
+"""
+監査ジョブのバッチ実行（プロセス内のワーカープール）
+
+複数のジョブ（テストフォルダ・監査手続き・Excelフォーマット）を1つのバッチとして受け付け、
+ワーカープールで graph を実行する。ジョブごとにサンプル単位の進捗・所要時間を記録し、webapp.py の /batches で参照できる。
+
+- ワーカー数は BATCH_MAX_WORKERS（デフォルト: 2）。1ジョブ内のサンプルの並列実行は parallel_samples / max_concurrency で指定する。
+- ジョブはジョブIDを thread_id として実行する（/metrics/json?run_id=<ジョブID> でノードごとの計測結果を参照できる）。
+- グラフはSQLiteのチェックポインター（agent.checkpointer）付きでコンパイルするため、query_to_human で中断したジョブは応答を渡して再開できる。
+  完了・失敗したジョブのチェックポイントは削除する。
+- バッチ・ジョブの状態は同じSQLiteファイルに保存し、サーバーを再起動しても進捗の参照・中断したジョブの再開ができる。
+  再起動時に実行待ちだったジョブは再投入し、実行中だったジョブは失敗として記録する。
+
+環境変数:
+    BATCH_MAX_WORKERS: 同時に実行するジョブ数（デフォルト: 2）
+    BATCH_MAX_BATCHES: 保持するバッチ数の上限（完了したものから破棄、デフォルト: 50）
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from agent.results_log import get_results_log
+
+logger = logging.getLogger(__name__)
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+INTERRUPTED = "interrupted"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+
+# サンプルを処理するノード（逐次実行 / 並列実行）
+SAMPLE_NODES = ("react_node", "sample_worker_node")
+
+@dataclass
+class SampleProgress:
+    """1サンプル分の進捗"""
+
+    name: str
+    status: str = QUEUED
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": _elapsed(self.started_at, self.finished_at),
+            "result": self.result,
+            "error": self.error,
+        }
+
+@dataclass
+class AuditJob:
+    """1テストフォルダ分の監査ジョブ"""
+
+    job_id: str
+    batch_id: str
+    graph_input: Dict[str, Any]
+    status: str = QUEUED
+    stage: str = ""
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    samples: "OrderedDict[str, SampleProgress]" = field(default_factory=OrderedDict)
+    output_excel_path: str = ""
+    results_log_path: str = ""
+    results_offset: int = 0
+    interrupts: List[Any] = field(default_factory=list)
+    error: Optional[str] = None
+    future: Optional[Future] = None
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return {"configurable": {"thread_id": self.job_id}, "recursion_limit": 1000}
+
+    def to_dict(self, include_samples: bool = True) -> Dict[str, Any]:
+        samples = list(self.samples.values())
+        result = {
+            "job_id": self.job_id,
+            "batch_id": self.batch_id,
+            "sample_data_path": self.graph_input.get("sample_data_path"),
+            "procedure": self.graph_input.get("procedure"),
+            "format_path": self.graph_input.get("format_path"),
+            "status": self.status,
+            "stage": self.stage,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": _elapsed(self.started_at, self.finished_at),
+            "progress": {
+                "samples_total": len(samples),
+                "samples_completed": sum(sample.status == COMPLETED for sample in samples),
+                "samples_failed": sum(sample.status == FAILED for sample in samples),
+                "samples_running": sum(sample.status == RUNNING for sample in samples),
+            },
+            "output_excel_path": self.output_excel_path,
+            "results_log_path": self.results_log_path,
+            "interrupts": self.interrupts,
+            "error": self.error,
+        }
+        if include_samples:
+            result["samples"] = [sample.to_dict() for sample in samples]
+        return result
+
+    def to_record(self, batch_created_at: float) -> Dict[str, Any]:
+        """永続化する状態（future を除くフィールド）"""
+        return {
+            "job_id": self.job_id,
+            "batch_id": self.batch_id,
+            "batch_created_at": batch_created_at,
+            "graph_input": self.graph_input,
+            "status": self.status,
+            "stage": self.stage,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "samples": [asdict(sample) for sample in self.samples.values()],
+            "output_excel_path": self.output_excel_path,
+            "results_log_path": self.results_log_path,
+            "results_offset": self.results_offset,
+            "interrupts": self.interrupts,
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "AuditJob":
+        samples = OrderedDict((sample["name"], SampleProgress(**sample)) for sample in record["samples"])
+        fields = {key: value for key, value in record.items() if key not in ("batch_created_at", "samples")}
+        return cls(samples=samples, **fields)
+
+@dataclass
+class AuditBatch:
+    """1回の投入で受け付けたジョブのまとまり"""
+
+    batch_id: str
+    jobs: "OrderedDict[str, AuditJob]" = field(default_factory=OrderedDict)
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def finished(self) -> bool:
+        return all(job.status in FINISHED_STATUSES for job in self.jobs.values())
+
+    def to_dict(self, include_jobs: bool = True) -> Dict[str, Any]:
+        jobs = [job.to_dict(include_samples=False) for job in self.jobs.values()]
+        status_counts: Dict[str, int] = {}
+        for job in jobs:
+            status_counts[job["status"]] = status_counts.get(job["status"], 0) + 1
+        started = [job["started_at"] for job in jobs if job["started_at"]]
+        finished = [job["finished_at"] for job in jobs if job["finished_at"]]
+        finished_at = max(finished) if self.finished and finished else None
+        result = {
+            "batch_id": self.batch_id,
+            "status": "finished" if self.finished else "running",
+            "created_at": self.created_at,
+            "started_at": min(started) if started else None,
+            "finished_at": finished_at,
+            "elapsed_seconds": _elapsed(min(started) if started else None, finished_at),
+            "progress": {
+                "jobs_total": len(jobs),
+                "jobs": status_counts,
+                "samples_total": sum(job["progress"]["samples_total"] for job in jobs),
+                "samples_completed": sum(job["progress"]["samples_completed"] for job in jobs),
+                "samples_failed": sum(job["progress"]["samples_failed"] for job in jobs),
+            },
+        }
+        if include_jobs:
+            result["jobs"] = jobs
+        return result
+
+def _elapsed(started_at: Optional[float], finished_at: Optional[float]) -> Optional[float]:
+    if started_at is None:
+        return None
+    return round((finished_at or time.time()) - started_at, 3)
+
+class BatchJobManager:
+    """
+    バッチ・ジョブを保持し、ワーカープールで実行する
+
+    Args:
+        max_workers (int): 同時に実行するジョブ数
+        max_batches (int): 保持するバッチ数の上限（完了したバッチから破棄）
+        checkpointer (Optional[SqliteCheckpointSaver]): グラフのチェックポインター
+            （指定した場合はバッチ・ジョブの状態も保存し、作成時に保存済みの状態を読み込む。未指定の場合はメモリのみ）
+    """
+
+    def __init__(self, max_workers: int = 2, max_batches: int = 50, checkpointer=None):
+        self.max_workers = max(1, max_workers)
+        self.max_batches = max_batches
+        self.checkpointer = checkpointer
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="audit-job")
+        self._batches: "OrderedDict[str, AuditBatch]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._graph = None
+        if self.checkpointer is not None:
+            self._restore()
+
+    def _get_graph(self):
+        """チェックポインター付きでコンパイルしたグラフ（中断したジョブの再開に使用）"""
+        with self._lock:
+            if self._graph is None:
+                from agent.checkpointer import get_checkpointer
+                from agent.graph import workflow
+
+                self._graph = workflow.compile(checkpointer=self.checkpointer or get_checkpointer())
+            return self._graph
+
+    def _restore(self) -> None:
+        """保存済みのバッチ・ジョブを読み込む（実行待ちのジョブは再投入し、実行中だったジョブは失敗とする）"""
+        # 再投入したジョブが読み込み中のバッチを参照しないよう、読み込みはロック内で行う
+        with self._lock:
+            for record in self.checkpointer.list_jobs():
+                batch = self._batches.get(record["batch_id"])
+                if batch is None:
+                    batch = self._batches[record["batch_id"]] = AuditBatch(
+                        batch_id=record["batch_id"], created_at=record["batch_created_at"]
+                    )
+                job = AuditJob.from_record(record)
+                batch.jobs[job.job_id] = job
+                if job.status == QUEUED:
+                    job.future = self._executor.submit(self._run_job, job, graph_input=job.graph_input)
+                elif job.status == RUNNING:
+                    job.status = FAILED
+                    job.error = "サーバーの再起動により実行が中断されました"
+                    job.finished_at = time.time()
+                    job.stage = ""
+                    self.checkpointer.delete_thread(job.job_id)
+                    self._save(job)
+        if self._batches:
+            logger.info(f"保存済みのバッチを読み込みました: {len(self._batches)}バッチ")
+
+    def _save(self, job: AuditJob) -> None:
+        """ジョブの状態を保存する（チェックポインター未指定の場合は何もしない）"""
+        if self.checkpointer is None:
+            return
+        batch = self._batches.get(job.batch_id)
+        batch_created_at = batch.created_at if batch is not None else job.created_at
+        try:
+            self.checkpointer.put_job(job.job_id, job.batch_id, job.created_at, job.to_record(batch_created_at))
+        except Exception as e:
+            logger.warning(f"ジョブの状態を保存できませんでした: {job.job_id} ({e})")
+
+    def submit(self, graph_inputs: List[Dict[str, Any]], output_root: str) -> Dict[str, Any]:
+        """
+        ジョブのリストを1つのバッチとして受け付け、ワーカープールに投入する
+
+        Args:
+            graph_inputs (List[Dict[str, Any]]): ジョブごとのグラフ入力（State のフィールド）
+            output_root (str): 出力先のルート（output_dir 未指定のジョブは <output_root>/<バッチID>/<ジョブID> に出力する）
+
+        Returns:
+            Dict[str, Any]: バッチの状態
+        """
+        batch = AuditBatch(batch_id=uuid.uuid4().hex)
+        for graph_input in graph_inputs:
+            job_id = uuid.uuid4().hex
+            graph_input = {"output_dir": os.path.join(output_root, batch.batch_id, job_id), **graph_input}
+            os.makedirs(graph_input["output_dir"], exist_ok=True)
+            job = AuditJob(job_id=job_id, batch_id=batch.batch_id, graph_input=graph_input)
+            for sample_name in self._list_samples(graph_input):
+                job.samples[sample_name] = SampleProgress(sample_name)
+            batch.jobs[job.job_id] = job
+        with self._lock:
+            self._batches[batch.batch_id] = batch
+            self._trim()
+            for job in batch.jobs.values():
+                self._save(job)
+                job.future = self._executor.submit(self._run_job, job, graph_input=job.graph_input)
+        logger.info(f"バッチを受け付けました: {batch.batch_id} ({len(batch.jobs)}ジョブ)")
+        return self.get_batch(batch.batch_id)
+
+    def resume(self, batch_id: str, job_id: str, response: Any) -> Dict[str, Any]:
+        """
+        query_to_human で中断したジョブを、人間の応答を渡して再開する
+
+        Raises:
+            KeyError: ジョブが存在しない場合
+            ValueError: ジョブが中断していない場合
+        """
+        from langgraph.types import Command
+
+        with self._lock:
+            job = self._get_job(batch_id, job_id)
+            if job.status != INTERRUPTED:
+                raise ValueError(f"ジョブは中断していません: {job_id} ({job.status})")
+            job.status = QUEUED
+            job.interrupts = []
+            # query_to_human は HumanResponse のリストを受け取る
+            resume = [{"type": "response", "args": response}]
+            job.future = self._executor.submit(self._run_job, job, graph_input=Command(resume=resume))
+            self._save(job)
+        return job.to_dict()
+
+    def cancel(self, batch_id: str) -> Dict[str, Any]:
+        """バッチのうち、まだ開始していないジョブを取り消す"""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                raise KeyError(batch_id)
+            for job in batch.jobs.values():
+                if job.status == QUEUED and job.future is not None and job.future.cancel():
+                    job.status = CANCELLED
+                    job.finished_at = time.time()
+                    self._save(job)
+                elif job.status == INTERRUPTED:
+                    job.status = CANCELLED
+                    job.finished_at = time.time()
+                    self._delete_checkpoints(job)
+                    self._save(job)
+        return self.get_batch(batch_id)
+
+    def list_batches(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [batch.to_dict(include_jobs=False) for batch in self._batches.values()]
+
+    def get_batch(self, batch_id: str) -> Dict[str, Any]:
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                raise KeyError(batch_id)
+            return batch.to_dict()
+
+    def get_job(self, batch_id: str, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._get_job(batch_id, job_id).to_dict()
+
+    def _get_job(self, batch_id: str, job_id: str) -> AuditJob:
+        batch = self._batches.get(batch_id)
+        if batch is None or job_id not in batch.jobs:
+            raise KeyError(job_id)
+        return batch.jobs[job_id]
+
+    def _trim(self) -> None:
+        """保持するバッチ数が上限を超えた場合、完了したバッチを古いものから破棄する"""
+        if self.max_batches <= 0:
+            return
+        for batch_id in list(self._batches):
+            if len(self._batches) <= self.max_batches:
+                break
+            if self._batches[batch_id].finished:
+                del self._batches[batch_id]
+                if self.checkpointer is not None:
+                    self.checkpointer.delete_batch(batch_id)
+
+    @staticmethod
+    def _list_samples(graph_input: Dict[str, Any]) -> List[str]:
+        """ジョブのサンプルフォルダ名（グラフと同じ os.listdir の順）"""
+        sample_root = graph_input.get("sample_root") or ""
+        sample_data_path = graph_input.get("sample_data_path") or ""
+        if not sample_data_path:
+            return []
+        try:
+            return os.listdir(os.path.join(sample_root, sample_data_path))
+        except OSError:
+            return []
+
+    def _run_job(self, job: AuditJob, graph_input: Any) -> None:
+        """ワーカースレッドでジョブを実行する（グラフのタスク開始・終了のイベントから進捗を記録する）"""
+        graph = self._get_graph()
+        sample_names = list(job.samples)
+        task_samples: Dict[str, str] = {}
+        with self._lock:
+            job.status = RUNNING
+            job.started_at = job.started_at or time.time()
+            self._save(job)
+        try:
+            for mode, event in graph.stream(graph_input, job.config, stream_mode=["updates", "debug"]):
+                with self._lock:
+                    if mode == "updates":
+                        self._apply_update(job, event)
+                    else:
+                        self._apply_task_event(job, event, sample_names, task_samples)
+            with self._lock:
+                if job.status == RUNNING:
+                    job.status = COMPLETED
+        except Exception as e:
+            logger.exception(f"ジョブの実行に失敗しました: {job.job_id}")
+            with self._lock:
+                job.status = FAILED
+                job.error = str(e)
+        finally:
+            with self._lock:
+                if job.status != INTERRUPTED:
+                    job.finished_at = time.time()
+                    job.stage = ""
+                    self._delete_checkpoints(job)
+                self._save(job)
+        logger.info(f"ジョブが終了しました: {job.job_id} ({job.status})")
+
+    def _apply_update(self, job: AuditJob, update: Dict[str, Any]) -> None:
+        if "__interrupt__" in update:
+            job.status = INTERRUPTED
+            job.interrupts = [getattr(item, "value", item) for item in update["__interrupt__"]]
+            for sample in job.samples.values():
+                if sample.status == RUNNING:
+                    sample.status = INTERRUPTED
+            return
+        for node_update in update.values():
+            if isinstance(node_update, dict) and node_update.get("output_excel_path"):
+                job.output_excel_path = node_update["output_excel_path"]
+
+    def _apply_task_event(
+        self,
+        job: AuditJob,
+        event: Dict[str, Any],
+        sample_names: List[str],
+        task_samples: Dict[str, str],
+    ) -> None:
+        payload = event.get("payload") or {}
+        name = payload.get("name")
+        if event.get("type") == "task":
+            job.stage = name or job.stage
+            if name not in SAMPLE_NODES:
+                return
+            task_input = payload.get("input")
+            if name == "sample_worker_node":
+                sample_name = task_input.get("sample_data") if isinstance(task_input, dict) else None
+            else:
+                # 逐次実行では iteration_count 番目（0始まり）のサンプルを処理する
+                iteration = getattr(task_input, "iteration_count", None)
+                sample_name = sample_names[iteration] if iteration is not None and iteration < len(sample_names) else None
+            sample = job.samples.get(sample_name) if sample_name else None
+            if sample is not None:
+                task_samples[payload.get("id")] = sample_name
+                sample.status = RUNNING
+                sample.started_at = time.time()
+                sample.finished_at = None
+                sample.error = None
+        elif event.get("type") == "task_result":
+            sample = job.samples.get(task_samples.pop(payload.get("id"), None) or "")
+            if sample is None:
+                return
+            sample.finished_at = time.time()
+            if payload.get("error"):
+                sample.status = FAILED
+                sample.error = str(payload["error"])
+                self._save(job)
+                return
+            sample.status = COMPLETED
+            for channel, value in payload.get("result") or []:
+                if channel == "results_log_path" and value:
+                    job.results_log_path = value
+            self._read_results(job)
+            self._save(job)
+
+    def _read_results(self, job: AuditJob) -> None:
+        """判定結果ログに追記された結果を読み込み、サンプルごとの判定結果に反映する"""
+        if not job.results_log_path:
+            return
+        entries, job.results_offset = get_results_log(job.results_log_path).read_from(job.results_offset)
+        for entry in entries:
+            sample = job.samples.get(entry.get("sample") or "")
+            if sample is not None:
+                sample.result = entry.get("result")
+
+    def _delete_checkpoints(self, job: AuditJob) -> None:
+        if self._graph is not None and self._graph.checkpointer is not None:
+            self._graph.checkpointer.delete_thread(job.job_id)
+        elif self.checkpointer is not None:
+            self.checkpointer.delete_thread(job.job_id)
+
+_manager: Optional[BatchJobManager] = None
+_manager_lock = threading.Lock()
+
+def get_batch_manager() -> BatchJobManager:
+    """
+    プロセス全体で共有するBatchJobManagerを取得する
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            from agent.checkpointer import get_checkpointer
+
+            _manager = BatchJobManager(
+                max_workers=int(os.getenv("BATCH_MAX_WORKERS", "2")),
+                max_batches=int(os.getenv("BATCH_MAX_BATCHES", "50")),
+                checkpointer=get_checkpointer(),
+            )
+        return _manager
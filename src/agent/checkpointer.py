@@ -0,0 +1,401 @@
+"""
+SQLiteのチェックポインター（チャネルの値を内容のSHA-256ごとに1回だけ保存）
+
+query_to_human で中断した実行を再開するためのチェックポイントをファイルに保存する。
+チェックポイントごとに全てのチャネルの値を保存せず、そのステップで更新されたチャネル（new_versions）の値のみを書き込み、
+値の実体は直列化した内容のSHA-256をキーとして1回だけ保存する（同じ証跡・メッセージを含む値は実行をまたいで共有される）。
+中断中の実行はメモリに保持されず、サーバーを再起動しても thread_id を指定して再開できる。
+バッチジョブ（agent.batch_jobs）の一覧・進捗も同じファイルに保存し、再起動後に thread_id とジョブを対応付ける。
+
+環境変数:
+    CHECKPOINT_DB_PATH: SQLiteファイルのパス（デフォルト: .cache/checkpoints.sqlite）
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.types import TASKS, ChannelProtocol
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = [
+    # 値の実体（直列化した内容のSHA-256ごとに1行）
+    "CREATE TABLE IF NOT EXISTS blobs ("
+    " sha256 TEXT PRIMARY KEY,"
+    " type TEXT NOT NULL,"
+    " data BLOB NOT NULL)",
+    # チャネルのバージョンごとの値（更新されたチャネルのみ書き込む）
+    "CREATE TABLE IF NOT EXISTS channel_values ("
+    " thread_id TEXT NOT NULL,"
+    " checkpoint_ns TEXT NOT NULL,"
+    " channel TEXT NOT NULL,"
+    " version TEXT NOT NULL,"
+    " sha256 TEXT,"
+    " PRIMARY KEY (thread_id, checkpoint_ns, channel, version))",
+    "CREATE TABLE IF NOT EXISTS checkpoints ("
+    " thread_id TEXT NOT NULL,"
+    " checkpoint_ns TEXT NOT NULL,"
+    " checkpoint_id TEXT NOT NULL,"
+    " parent_checkpoint_id TEXT,"
+    " type TEXT NOT NULL,"
+    " checkpoint BLOB NOT NULL,"
+    " metadata_type TEXT NOT NULL,"
+    " metadata BLOB NOT NULL,"
+    " PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))",
+    "CREATE TABLE IF NOT EXISTS writes ("
+    " thread_id TEXT NOT NULL,"
+    " checkpoint_ns TEXT NOT NULL,"
+    " checkpoint_id TEXT NOT NULL,"
+    " task_id TEXT NOT NULL,"
+    " idx INTEGER NOT NULL,"
+    " channel TEXT NOT NULL,"
+    " sha256 TEXT NOT NULL,"
+    " task_path TEXT NOT NULL,"
+    " PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))",
+    # バッチジョブの記録（job_id がチェックポイントの thread_id。record はジョブの状態のJSON）
+    "CREATE TABLE IF NOT EXISTS batch_jobs ("
+    " job_id TEXT PRIMARY KEY,"
+    " batch_id TEXT NOT NULL,"
+    " created_at REAL NOT NULL,"
+    " record TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_channel_values_sha256 ON channel_values (sha256)",
+    "CREATE INDEX IF NOT EXISTS idx_writes_sha256 ON writes (sha256)",
+    "CREATE INDEX IF NOT EXISTS idx_batch_jobs_batch_id ON batch_jobs (batch_id)",
+]
+
+class SqliteCheckpointSaver(BaseCheckpointSaver[str]):
+    """
+    チャネルの値を重複排除して保存するSQLiteのチェックポインター
+
+    Args:
+        path (str): SQLiteファイルのパス
+        serde (Optional[SerializerProtocol]): シリアライザー（未指定の場合はLangGraphのデフォルト）
+    """
+
+    def __init__(self, path: str, *, serde: Optional[SerializerProtocol] = None):
+        super().__init__(serde=serde)
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+
+    def _put_blob(self, value: Any) -> str:
+        """値を直列化して保存し、SHA-256を返す（同じ内容が保存済みの場合は書き込まない）"""
+        type_, data = self.serde.dumps_typed(value)
+        sha256 = hashlib.sha256(type_.encode("utf-8") + b"\0" + data).hexdigest()
+        self._conn.execute("INSERT OR IGNORE INTO blobs (sha256, type, data) VALUES (?, ?, ?)", (sha256, type_, data))
+        return sha256
+
+    def _load_blob(self, sha256: str) -> Any:
+        row = self._conn.execute("SELECT type, data FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return self.serde.loads_typed((row[0], row[1]))
+
+    def _load_channel_values(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> Dict[str, Any]:
+        channel_values: Dict[str, Any] = {}
+        for channel, version in versions.items():
+            row = self._conn.execute(
+                "SELECT sha256 FROM channel_values WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            # 値のないチャネル（空）は sha256 が NULL
+            if row is not None and row[0] is not None:
+                channel_values[channel] = self._load_blob(row[0])
+        return channel_values
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[Tuple[str, str, Any, str, int]]:
+        rows = self._conn.execute(
+            "SELECT task_id, channel, sha256, task_path, idx FROM writes"
+            " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return [(task_id, channel, self._load_blob(sha256), task_path, idx) for task_id, channel, sha256, task_path, idx in rows]
+
+    def _to_tuple(self, thread_id: str, checkpoint_ns: str, row: Tuple) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint_data, metadata_type, metadata_data = row
+        checkpoint: Checkpoint = self.serde.loads_typed((type_, checkpoint_data))
+        if parent_checkpoint_id:
+            # 親のチェックポイントで実行された Send（TASKS への書き込み）を復元する
+            sends = sorted(
+                (write for write in self._load_writes(thread_id, checkpoint_ns, parent_checkpoint_id) if write[1] == TASKS),
+                key=lambda write: (write[3], write[0], write[4]),
+            )
+        else:
+            sends = []
+        writes = self._load_writes(thread_id, checkpoint_ns, checkpoint_id)
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={
+                **checkpoint,
+                "channel_values": self._load_channel_values(thread_id, checkpoint_ns, checkpoint["channel_versions"]),
+                "pending_sends": [write[2] for write in sends],
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata_data)),
+            pending_writes=[(task_id, channel, value) for task_id, channel, value, _, _ in writes],
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+                if parent_checkpoint_id
+                else None
+            ),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+                    " ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            if row is None:
+                return None
+            checkpoint_tuple = self._to_tuple(thread_id, checkpoint_ns, row)
+        if checkpoint_id:
+            # 指定された config（親の checkpoint_id などを含む）をそのまま返す
+            return checkpoint_tuple._replace(config=config)
+        return checkpoint_tuple
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata FROM checkpoints"
+        conditions: List[str] = []
+        params: List[Any] = []
+        if config:
+            conditions.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                conditions.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            params.append(before_checkpoint_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY checkpoint_id DESC"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            with self._lock:
+                checkpoint_tuple = self._to_tuple(thread_id, checkpoint_ns, tuple(row))
+            # メタデータでの絞り込み
+            if filter and not all(checkpoint_tuple.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        checkpoint = checkpoint.copy()
+        checkpoint.pop("pending_sends", None)
+        values: Dict[str, Any] = checkpoint.pop("channel_values")
+        type_, checkpoint_data = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                # このステップで更新されたチャネルのみ書き込む（他のチャネルは以前のバージョンを参照する）
+                for channel, version in new_versions.items():
+                    sha256 = self._put_blob(values[channel]) if channel in values else None
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO channel_values (thread_id, checkpoint_ns, channel, version, sha256) VALUES (?, ?, ?, ?, ?)",
+                        (thread_id, checkpoint_ns, channel, str(version), sha256),
+                    )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints"
+                    " (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        thread_id,
+                        checkpoint_ns,
+                        checkpoint["id"],
+                        config["configurable"].get("checkpoint_id"),
+                        type_,
+                        checkpoint_data,
+                        metadata_type,
+                        metadata_data,
+                    ),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for idx, (channel, value) in enumerate(writes):
+                    idx = WRITES_IDX_MAP.get(channel, idx)
+                    # 通常の書き込みは最初のものを残し、特殊な書き込み（エラー・中断など）は上書きする
+                    verb = "INSERT OR IGNORE" if idx >= 0 else "INSERT OR REPLACE"
+                    self._conn.execute(
+                        f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, sha256, task_path)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, self._put_blob(value), task_path),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete_thread(self, thread_id: str) -> None:
+        """スレッドのチェックポイント・書き込みを削除し、どこからも参照されなくなった値の実体を削除する"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for table in ("checkpoints", "channel_values", "writes"):
+                    self._conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+                self._conn.execute(
+                    "DELETE FROM blobs WHERE sha256 NOT IN (SELECT sha256 FROM channel_values WHERE sha256 IS NOT NULL)"
+                    " AND sha256 NOT IN (SELECT sha256 FROM writes)"
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def put_job(self, job_id: str, batch_id: str, created_at: float, record: Dict[str, Any]) -> None:
+        """バッチジョブの状態を保存する（job_id ごとに上書き）"""
+        data = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO batch_jobs (job_id, batch_id, created_at, record) VALUES (?, ?, ?, ?)",
+                (job_id, batch_id, created_at, data),
+            )
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """保存したバッチジョブの状態（バッチ・ジョブの作成順）"""
+        with self._lock:
+            rows = self._conn.execute("SELECT record FROM batch_jobs ORDER BY created_at, rowid").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete_batch(self, batch_id: str) -> None:
+        """バッチのジョブの記録を削除する"""
+        with self._lock:
+            self._conn.execute("DELETE FROM batch_jobs WHERE batch_id = ?", (batch_id,))
+
+    def usage(self) -> Dict[str, int]:
+        """チェックポイント数・値の実体の数と合計バイト数"""
+        with self._lock:
+            checkpoints = self._conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+            blobs, blob_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()
+        return {"checkpoints": checkpoints, "blobs": blobs, "blob_bytes": blob_bytes}
+
+    # SQLiteへの読み書きはイベントループを止めないようスレッドで行う
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: ChannelProtocol) -> str:
+        # InMemorySaver と同じ形式（先頭が単調増加する番号の文字列）
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+_checkpointer: Optional[SqliteCheckpointSaver] = None
+_checkpointer_lock = threading.Lock()
+
+def get_checkpointer() -> SqliteCheckpointSaver:
+    """
+    プロセス全体で共有するSQLiteのチェックポインターを取得する
+    """
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            _checkpointer = SqliteCheckpointSaver(os.getenv("CHECKPOINT_DB_PATH", os.path.join(".cache", "checkpoints.sqlite")))
+        return _checkpointer
@@ -0,0 +1,135 @@
+"""
+ディスクキャッシュの共通処理（ハッシュ計算・LRU削除）
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    ファイル内容のSHA-256ハッシュを計算する関数
+
+    Args:
+        path (str): ファイルパス
+        chunk_size (int): 読み込み単位のバイト数
+
+    Returns:
+        str: 16進数表記のハッシュ値
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def touch(path: Path) -> None:
+    """
+    キャッシュエントリの最終アクセス時刻を更新する関数（LRU判定に使用）
+    """
+    try:
+        os.utime(path, None)
+    except OSError as e:
+        logger.warning(f"キャッシュエントリのアクセス時刻更新に失敗: {path} ({e})")
+
+def entry_size(path: Path) -> int:
+    """
+    キャッシュエントリ（ファイルまたはディレクトリ）のバイト数を返す関数
+
+    Raises:
+        FileNotFoundError: エントリが削除されていた場合（ディレクトリ内で削除されたファイルは数えない）
+    """
+    if not path.is_dir():
+        return path.stat().st_size
+    total = 0
+    for p in path.rglob("*"):
+        try:
+            if p.is_file():
+                total += p.stat().st_size
+        except FileNotFoundError:
+            # 他のスレッド・プロセスが削除中のファイル
+            continue
+    return total
+
+def cache_size(cache_dir: Path) -> int:
+    """
+    キャッシュディレクトリ直下のエントリ（書き込み途中の一時エントリを除く）の合計バイト数を返す関数
+    """
+    if not cache_dir.exists():
+        return 0
+    total = 0
+    for entry in cache_dir.iterdir():
+        if entry.name.startswith("."):
+            continue
+        try:
+            total += entry_size(entry)
+        except FileNotFoundError:
+            continue
+    return total
+
+def evict_lru(
+    cache_dir: Path,
+    max_bytes: int = 0,
+    max_entries: int = 0,
+    keep: Optional[Iterable[Path]] = None,
+) -> int:
+    """
+    キャッシュディレクトリ直下のエントリを最終アクセス時刻の古い順に削除し、上限内に収める関数
+
+    Args:
+        cache_dir (Path): キャッシュディレクトリ
+        max_bytes (int): 合計バイト数の上限（0以下の場合は無制限）
+        max_entries (int): エントリ数の上限（0以下の場合は無制限）
+        keep (Optional[Iterable[Path]]): 削除対象から除外するエントリ
+
+    Returns:
+        int: 削除したエントリ数
+    """
+    if not cache_dir.exists():
+        return 0
+    keep_set = {Path(p) for p in (keep or [])}
+    entries = []
+    for entry in cache_dir.iterdir():
+        # 書き込み途中の一時エントリは対象外
+        if entry.name.startswith("."):
+            continue
+        try:
+            entries.append((entry.stat().st_mtime, entry, entry_size(entry)))
+        except FileNotFoundError:
+            # 走査中に他のスレッド・プロセスが削除したエントリ
+            continue
+    entries.sort(key=lambda item: item[0])
+
+    total_bytes = sum(size for _, _, size in entries)
+    total_entries = len(entries)
+    removed = 0
+    for _, entry, size in entries:
+        over_bytes = max_bytes > 0 and total_bytes > max_bytes
+        over_entries = max_entries > 0 and total_entries > max_entries
+        if not (over_bytes or over_entries):
+            break
+        if entry in keep_set:
+            continue
+        try:
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+        except FileNotFoundError:
+            # 他のスレッド・プロセスが先に削除した場合は、削除済みとして扱う
+            total_bytes -= size
+            total_entries -= 1
+            continue
+        except OSError as e:
+            logger.warning(f"キャッシュエントリの削除に失敗: {entry} ({e})")
+            continue
+        total_bytes -= size
+        total_entries -= 1
+        removed += 1
+        logger.info(f"キャッシュエントリを削除しました (LRU): {entry}")
+    return removed
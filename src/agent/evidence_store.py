@@ -0,0 +1,232 @@
+"""
+コンテンツアドレス方式の証跡ストア（SHA-256による重複排除とSQLiteのインデックス）
+
+アップロードされたファイルの実体は内容のSHA-256ごとに1つだけ blobs/<先頭2文字>/<ハッシュ> に保存し、
+サンプルフォルダ（data/sample 配下）にはその実体へのハードリンクを作成する。
+同じテンプレートのPDFを複数のサンプルフォルダにアップロードしても、ディスク上の実体は1つになる。
+サンプルフォルダのパスは従来どおり通常のファイルとして読み込めるため、読み込み側の変更は不要。
+ハードリンクを作成できないファイルシステムでは実体をコピーする（重複排除はされない）。
+ハードリンクは実体と inode を共有するため、サンプルフォルダのファイルはその場で書き換えないこと
+（アップロードは一時名のリンクからのリネームで置き換えるため、同じ内容の他のサンプルのファイルは変わらない）。
+どのサンプルフォルダからも参照されなくなった実体は collect_garbage で削除する
+（アップロードを中止して元に戻した場合と、/list-folders/?refresh=true でインデックスを作り直した場合に実行する）。
+
+アップロード時にインデックス（パス・フォルダ・サイズ・ハッシュ）を更新し、フォルダ・ファイルの一覧は
+ディレクトリを走査せずにインデックスから返す。インデックスがない場合は初回に1回だけ既存のファイルを走査して作成する。
+
+環境変数:
+    EVIDENCE_STORE_DIR: ストアのディレクトリ（デフォルト: サンプルフォルダのルートと同じ階層の .evidence_store）
+"""
+
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from agent.disk_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+class EvidenceStore:
+    """
+    サンプルフォルダのルートごとの証跡ストア
+
+    Args:
+        root (str): サンプルフォルダのルート（アップロード先）
+        store_dir (Optional[str]): 実体・インデックスの保存先（未指定の場合は環境変数またはルートと同じ階層の .evidence_store）
+    """
+
+    def __init__(self, root: str, store_dir: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.store_dir = os.path.abspath(
+            store_dir or os.getenv("EVIDENCE_STORE_DIR") or os.path.join(os.path.dirname(self.root), ".evidence_store")
+        )
+        self.blobs_dir = os.path.join(self.store_dir, "blobs")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._blob_lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.store_dir, "index.sqlite"), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " folder TEXT NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_folder ON files (folder)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if self._conn.execute("SELECT value FROM meta WHERE key = 'indexed_at'").fetchone() is None:
+            self.rebuild_index()
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blobs_dir, sha256[:2], sha256)
+
+    def _relpath(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+
+    def _index(self, path: str, sha256: str, size: int) -> None:
+        rel_path = self._relpath(path)
+        folder = rel_path.split("/", 1)[0] if "/" in rel_path else ""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, folder, sha256, size, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (rel_path, folder, sha256, size, time.time()),
+            )
+
+    def put(self, source_path: str, sha256: str, size: int, dest_path: str) -> bool:
+        """
+        書き込み済みのファイルを実体として登録し、保存先にリンクする（source_path は移動または削除される）
+
+        Args:
+            source_path (str): 書き込み済みの一時ファイル
+            sha256 (str): ファイル内容のSHA-256
+            size (int): ファイルサイズ
+            dest_path (str): サンプルフォルダ内の保存先
+
+        Returns:
+            bool: 同じ内容の実体が既に保存されていた場合はTrue
+        """
+        blob_path = self.blob_path(sha256)
+        # 既存のファイルを置き換える場合も、リンクを一時名で作成してからリネームする
+        link_path = f"{dest_path}.{uuid.uuid4().hex[:8]}.link"
+        # 同じ内容のファイルが同時にアップロードされた場合も実体が1つになるよう、確認と登録はロック内で行う
+        # （リンクの作成までロック内で行い、collect_garbage がリンク前の実体を削除しないようにする）
+        with self._blob_lock:
+            duplicate = os.path.exists(blob_path)
+            if duplicate:
+                os.remove(source_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                # 同じファイルシステム上ではリネーム、異なる場合はコピーになる
+                shutil.move(source_path, blob_path)
+            try:
+                os.link(blob_path, link_path)
+            except OSError:
+                shutil.copyfile(blob_path, link_path)
+        try:
+            os.replace(link_path, dest_path)
+        except BaseException:
+            os.remove(link_path)
+            raise
+        self._index(dest_path, sha256, size)
+        return duplicate
+
+    def remove(self, dest_path: str) -> None:
+        """サンプルフォルダのファイルを削除し、インデックスから除く（実体は collect_garbage で削除する）"""
+        try:
+            os.remove(dest_path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (self._relpath(dest_path),))
+
+    def restore(self, dest_path: str, backup_path: str) -> None:
+        """アップロード前に退避したファイルを保存先に戻し、インデックスも戻す（アップロードを中止した場合に使用）"""
+        os.replace(backup_path, dest_path)
+        self._index(dest_path, file_sha256(dest_path), os.path.getsize(dest_path))
+
+    def list_folders(self) -> List[str]:
+        """ファイルを含むサンプルフォルダ（ルート直下のディレクトリ）の一覧"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT folder FROM files WHERE folder != '' ORDER BY folder").fetchall()
+        return [row[0] for row in rows]
+
+    def list_files(self, folder: Optional[str] = None) -> List[Dict]:
+        """
+        ファイルの一覧（path: ルートからの相対パス, size, sha256）
+
+        Args:
+            folder (Optional[str]): サンプルフォルダ名（未指定の場合は全ファイル）
+        """
+        with self._lock:
+            if folder is None:
+                rows = self._conn.execute("SELECT path, size, sha256 FROM files ORDER BY path").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT path, size, sha256 FROM files WHERE folder = ? ORDER BY path", (folder,)
+                ).fetchall()
+        return [{"path": path, "size": size, "sha256": sha256} for path, size, sha256 in rows]
+
+    def usage(self) -> Dict[str, int]:
+        """ファイル数・サンプルフォルダ上の合計サイズ・重複排除後の実体の合計サイズ"""
+        with self._lock:
+            files, logical_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+            stored_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT sha256, MAX(size) AS size FROM files GROUP BY sha256)"
+            ).fetchone()[0]
+        return {"files": files, "logical_bytes": logical_bytes, "stored_bytes": stored_bytes}
+
+    def rebuild_index(self) -> int:
+        """
+        サンプルフォルダを走査してインデックスを作り直す（手動で追加・削除されたファイルを反映する場合に使用）
+
+        Returns:
+            int: インデックスに登録したファイル数
+        """
+        entries = []
+        if os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if filename.endswith((".part", ".link", ".bak")):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    rel_path = self._relpath(path)
+                    folder = rel_path.split("/", 1)[0] if "/" in rel_path else ""
+                    entries.append((rel_path, folder, file_sha256(path), os.path.getsize(path), time.time()))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM files")
+                self._conn.executemany(
+                    "INSERT INTO files (path, folder, sha256, size, updated_at) VALUES (?, ?, ?, ?, ?)", entries
+                )
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('indexed_at', ?)", (str(time.time()),))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info(f"証跡ストアのインデックスを作成しました: {self.root} ({len(entries)}ファイル)")
+        return len(entries)
+
+    def collect_garbage(self) -> int:
+        """
+        どのサンプルフォルダからも参照されていない実体を削除する
+
+        Returns:
+            int: 削除した実体の数
+        """
+        with self._lock:
+            referenced = {row[0] for row in self._conn.execute("SELECT DISTINCT sha256 FROM files")}
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.blobs_dir):
+            for sha256 in filenames:
+                blob_path = os.path.join(dirpath, sha256)
+                with self._blob_lock:
+                    # ハードリンクが残っている実体（リンク数2以上）は削除しない
+                    if sha256 in referenced or os.stat(blob_path).st_nlink > 1:
+                        continue
+                    os.remove(blob_path)
+                removed += 1
+        if removed:
+            logger.info(f"参照されていない証跡の実体を削除しました: {removed}件")
+        return removed
+
+_stores: Dict[str, EvidenceStore] = {}
+_stores_lock = threading.Lock()
+
+def get_evidence_store(root: str) -> EvidenceStore:
+    """
+    サンプルフォルダのルートごとに共有するEvidenceStoreを取得する
+    """
+    key = os.path.abspath(root)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EvidenceStore(key)
+        return _stores[key]
@@ -0,0 +1,494 @@
+"""
+Excelキャプチャのバックエンド
+
+- soffice: 常駐sofficeワーカーでブック全体をPNGに変換する（従来の方式）
+- soffice_sheets: シートごとにsofficeで変換する（複数のワーカーで並列に変換し、全シートを確実に取得する）
+- native: openpyxlのデータからPyMuPDFでワークシートを直接描画する（外部プロセス不要）
+
+どちらも同じインターフェース（CaptureBackend.capture）で {シート名: PNGパス} を返す。
+nativeで失敗した場合はsofficeにフォールバックする。
+"""
+
+import datetime
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Protocol, Tuple
+
+import fitz
+import openpyxl
+from openpyxl.styles.colors import COLOR_INDEX
+from openpyxl.utils import range_boundaries
+
+from agent.metrics import timed_stage
+from agent.office_renderer import convert_to_png, get_office_pool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPTURE_BACKEND = "soffice"
+
+class CaptureBackend(Protocol):
+    """Excelキャプチャのバックエンドのインターフェース"""
+
+    name: str
+    # sheet_names で指定したシートのみを描画するか（False の場合は指定しても全シートを描画する）
+    renders_per_sheet: bool
+
+    def capture(self, excel_path: str, captures_dir: Path, sheet_names: Optional[List[str]] = None) -> Dict[str, str]:
+        """
+        Excelファイルのシートをキャプチャする
+
+        Args:
+            excel_path (str): Excelファイルのパス
+            captures_dir (Path): キャプチャの出力ディレクトリ
+            sheet_names (Optional[List[str]]): キャプチャするシート名（未指定の場合は全シート）
+
+        Returns:
+            Dict[str, str]: {シート名: PNGパス}（シート順）
+        """
+        ...
+
+class SofficeCaptureBackend:
+    """sofficeでブック全体をPNGに変換するバックエンド（sheet_names を指定しても全シートを変換し、結果を絞り込むのみ）"""
+
+    name = "soffice"
+    renders_per_sheet = False
+
+    def capture(self, excel_path: str, captures_dir: Path, sheet_names: Optional[List[str]] = None) -> Dict[str, str]:
+        workbook_for_names = openpyxl.load_workbook(excel_path, read_only=True)
+        workbook_sheet_names = list(workbook_for_names.sheetnames)
+        workbook_for_names.close()
+        with timed_stage("soffice"):
+            convert_to_png(excel_path, str(captures_dir))
+
+        # 生成されたPNGファイルのパスを取得
+        excel_basename = os.path.splitext(os.path.basename(excel_path))[0]
+        captures: Dict[str, str] = {}
+
+        if len(workbook_sheet_names) == 1:
+            # シートが1枚の場合
+            # soffice がシート名を付与する場合も考慮 (例: excel_basename_Sheet1.png)
+            candidates = [
+                captures_dir / f"{excel_basename}.png",
+                captures_dir / f"{excel_basename}_{workbook_sheet_names[0]}.png",
+                captures_dir / f"{excel_basename}_sheet1.png", # 1ベースのインデックス
+                captures_dir / f"{excel_basename}_sheet0.png", # 0ベースのインデックス
+            ]
+            for capture_path in candidates:
+                if capture_path.exists():
+                    captures[workbook_sheet_names[0]] = str(capture_path)
+                    logger.info(f"単一シートのキャプチャファイルを発見: {capture_path}")
+                    break
+            else:
+                logger.error(f"単一シートのキャプチャファイルが見つかりません。試行したパターン: {', '.join(map(str, candidates))}")
+        else:
+            # シートが複数枚の場合
+            for sheet_idx, sheet_name in enumerate(workbook_sheet_names, 1):
+                # LibreOfficeが出力する可能性のあるファイル名パターン
+                candidates = [
+                    captures_dir / f"{excel_basename}_sheet{sheet_idx}.png", # <basename>_sheet<N>.png (Nは1から始まる)
+                    captures_dir / f"{excel_basename}-{sheet_idx}.png", # <basename>-<N>.png (Nは1から始まる)
+                    captures_dir / f"{excel_basename}_{sheet_name}.png", # <basename>_<シート名>.png
+                ]
+                for capture_path in candidates:
+                    if capture_path.exists():
+                        captures[sheet_name] = str(capture_path)
+                        logger.info(f"シート '{sheet_name}' のキャプチャファイルを発見: {capture_path}")
+                        break
+                else:
+                    logger.warning(f"シート '{sheet_name}' (インデックス {sheet_idx}) のキャプチャファイルが見つかりません。試行したパターン: {', '.join(map(str, candidates))}")
+
+        missing = [name for name in workbook_sheet_names if name not in captures]
+        if missing:
+            # sofficeは複数シートでもアクティブなシートのみを <basename>.png に出力するため、
+            # <basename>*.png に一致するファイルを見つかっていないシートにシート順で割り当てる
+            found = set(captures.values())
+            fallback = [str(path) for path in sorted(captures_dir.glob(f"{excel_basename}*.png")) if str(path) not in found]
+            for sheet_name, capture_path in zip(missing, fallback):
+                captures[sheet_name] = capture_path
+                logger.info(f"シート '{sheet_name}' のキャプチャとして {capture_path} を使用します")
+            captures = {name: captures[name] for name in workbook_sheet_names if name in captures}
+        if not captures:
+            raise RuntimeError(f"キャプチャファイルが見つかりません: {excel_path} (captures_dir: {captures_dir})")
+
+        if sheet_names is not None:
+            captures = {name: path for name, path in captures.items() if name in sheet_names}
+        return captures
+
+def _sheet_capture_name(excel_basename: str, sheet_idx: int, sheet_count: int) -> str:
+    """キャプチャのファイル名（拡張子なし）。単一シート: <basename>, 複数シート: <basename>_sheet<N>（Nは1から始まるシート番号）"""
+    return excel_basename if sheet_count == 1 else f"{excel_basename}_sheet{sheet_idx}"
+
+class SofficePerSheetCaptureBackend:
+    """
+    シートごとにsofficeでPNGに変換するバックエンド
+
+    sofficeのPNG出力はアクティブなシートのみのため、対象シート以外を非表示にしたコピーをシートごとに作成し、
+    sofficeワーカーのプールに同時に投入する（ワーカー数は OFFICE_POOL_SIZE）。
+    他のシートは削除せず非表示にするため、シート間の参照を含む数式もそのまま計算される。
+    """
+
+    name = "soffice_sheets"
+    renders_per_sheet = True
+
+    def capture(self, excel_path: str, captures_dir: Path, sheet_names: Optional[List[str]] = None) -> Dict[str, str]:
+        workbook = openpyxl.load_workbook(excel_path)
+        excel_basename = os.path.splitext(os.path.basename(excel_path))[0]
+        sheet_count = len(workbook.worksheets)
+        work_dir = Path(tempfile.mkdtemp(prefix="capture_sheets_"))
+        pool = get_office_pool()
+        futures = {}
+        try:
+            with timed_stage("soffice"):
+                for sheet_idx, sheet in enumerate(workbook.worksheets, 1):
+                    if sheet_names is not None and sheet.title not in sheet_names:
+                        continue
+                    # 対象シートのみを表示・アクティブにしたコピーを保存し、保存できたものから変換を開始する
+                    for other in workbook.worksheets:
+                        other.sheet_state = "visible" if other is sheet else "hidden"
+                        other.sheet_view.tabSelected = other is sheet
+                    workbook.active = sheet_idx - 1
+                    sheet_path = work_dir / f"{_sheet_capture_name(excel_basename, sheet_idx, sheet_count)}.xlsx"
+                    workbook.save(sheet_path)
+                    futures[sheet.title] = pool.submit(str(sheet_path), str(captures_dir))
+
+                # シート順に結果を取得する（変換は完了した順に並行して進む）
+                captures: Dict[str, str] = {}
+                for sheet_title, future in futures.items():
+                    try:
+                        capture_path = future.result()
+                    except Exception as e:
+                        logger.warning(f"シート '{sheet_title}' のキャプチャに失敗しました: {e}")
+                        continue
+                    if Path(capture_path).exists():
+                        captures[sheet_title] = capture_path
+                        logger.info(f"シート '{sheet_title}' のキャプチャファイルを作成しました: {capture_path}")
+                    else:
+                        logger.warning(f"シート '{sheet_title}' のキャプチャファイルが見つかりません: {capture_path}")
+        finally:
+            for future in futures.values():
+                future.cancel()
+            workbook.close()
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if futures and not captures:
+            raise RuntimeError(f"全シートのキャプチャに失敗しました: {excel_path}")
+        return captures
+
+# 描画の単位はポイント（1px = 0.75pt）
+_PX_TO_PT = 0.75
+_DEFAULT_COLUMN_WIDTH = 8.43
+_DEFAULT_ROW_HEIGHT = 15.0
+_CELL_PADDING = 2.0
+_BORDER_WIDTHS = {
+    "hair": 0.25,
+    "thin": 0.5,
+    "dotted": 0.5,
+    "dashed": 0.5,
+    "dashDot": 0.5,
+    "dashDotDot": 0.5,
+    "medium": 1.0,
+    "mediumDashed": 1.0,
+    "mediumDashDot": 1.0,
+    "mediumDashDotDot": 1.0,
+    "slantDashDot": 1.0,
+    "double": 1.5,
+    "thick": 1.5,
+}
+_GRIDLINE_COLOR = (0.85, 0.85, 0.85)
+
+def _column_width_pt(width: float) -> float:
+    """Excelの列幅（文字数）をポイントに変換する"""
+    return (width * 7 + 5) * _PX_TO_PT
+
+def _to_rgb(color) -> Optional[Tuple[float, float, float]]:
+    """openpyxlのColorをPyMuPDFのRGB（0〜1）に変換する（テーマ色は解決できないためNone）"""
+    if color is None:
+        return None
+    rgb = None
+    if color.type == "rgb" and isinstance(color.rgb, str):
+        rgb = color.rgb
+    elif color.type == "indexed" and color.indexed is not None and color.indexed < len(COLOR_INDEX):
+        rgb = COLOR_INDEX[color.indexed]
+    if not rgb or len(rgb) < 6:
+        return None
+    rgb = rgb[-6:]
+    try:
+        return tuple(int(rgb[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    except ValueError:
+        return None
+
+def _format_value(value) -> str:
+    """セルの値を表示用の文字列に変換する"""
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y/%m/%d") if value.time() == datetime.time(0) else value.strftime("%Y/%m/%d %H:%M")
+    if isinstance(value, datetime.date):
+        return value.strftime("%Y/%m/%d")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class NativeCaptureBackend:
+    """openpyxlのデータからPyMuPDFでワークシートを描画するバックエンド"""
+
+    name = "native"
+    renders_per_sheet = True
+
+    def __init__(self, dpi: int = 96, fontname: str = "japan"):
+        self.dpi = dpi
+        self.fontname = fontname
+        self._font = fitz.Font(fontname)
+
+    def capture(self, excel_path: str, captures_dir: Path, sheet_names: Optional[List[str]] = None) -> Dict[str, str]:
+        workbook = openpyxl.load_workbook(excel_path)
+        excel_basename = os.path.splitext(os.path.basename(excel_path))[0]
+        captures: Dict[str, str] = {}
+        for sheet_idx, sheet in enumerate(workbook.worksheets, 1):
+            if sheet_names is not None and sheet.title not in sheet_names:
+                continue
+            # ファイル名はsofficeの出力パターンに合わせる（単一シート: <basename>.png, 複数シート: <basename>_sheet<N>.png）
+            capture_path = captures_dir / f"{_sheet_capture_name(excel_basename, sheet_idx, len(workbook.worksheets))}.png"
+            with timed_stage("native_render"):
+                self.render_sheet(sheet, capture_path)
+            captures[sheet.title] = str(capture_path)
+            logger.info(f"シート '{sheet.title}' を描画しました: {capture_path}")
+        return captures
+
+    def _capture_range(self, sheet) -> Tuple[int, int, int, int]:
+        """描画範囲（印刷範囲が設定されていれば印刷範囲、なければ使用範囲）を返す"""
+        area = None
+        if sheet.print_area:
+            # 複数範囲の場合は最初の範囲を使用（例: "'Sheet1'!$A$1:$F$20"）
+            area = sheet.print_area.split(",")[0].split("!")[-1].replace("$", "")
+        if not area:
+            area = sheet.calculate_dimension()
+        if ":" not in area:
+            area = f"{area}:{area}"
+        min_col, min_row, max_col, max_row = range_boundaries(area)
+        return min_col, min_row, max_col, max_row
+
+    def render_sheet(self, sheet, output_path: Path) -> None:
+        """
+        ワークシートをPNGとして描画する（列幅・行高・結合セル・背景色・罫線・値）
+        """
+        min_col, min_row, max_col, max_row = self._capture_range(sheet)
+
+        # 列幅・行高（ポイント）
+        default_width = sheet.sheet_format.defaultColWidth or sheet.sheet_format.baseColWidth or _DEFAULT_COLUMN_WIDTH
+        column_widths = {col: _column_width_pt(default_width) for col in range(min_col, max_col + 1)}
+        for dimension in sheet.column_dimensions.values():
+            if dimension.min is None or dimension.max is None:
+                continue
+            for col in range(max(dimension.min, min_col), min(dimension.max, max_col) + 1):
+                if dimension.hidden:
+                    column_widths[col] = 0.0
+                elif dimension.width:
+                    column_widths[col] = _column_width_pt(dimension.width)
+        default_height = sheet.sheet_format.defaultRowHeight or _DEFAULT_ROW_HEIGHT
+        row_heights = {}
+        for row in range(min_row, max_row + 1):
+            dimension = sheet.row_dimensions.get(row)
+            if dimension is not None and dimension.hidden:
+                row_heights[row] = 0.0
+            elif dimension is not None and dimension.height:
+                row_heights[row] = float(dimension.height)
+            else:
+                row_heights[row] = float(default_height)
+
+        # 各列・各行の開始位置
+        col_x = {}
+        x = 0.0
+        for col in range(min_col, max_col + 1):
+            col_x[col] = x
+            x += column_widths[col]
+        page_width = max(x, 1.0)
+        row_y = {}
+        y = 0.0
+        for row in range(min_row, max_row + 1):
+            row_y[row] = y
+            y += row_heights[row]
+        page_height = max(y, 1.0)
+
+        def cell_rect(c1: int, r1: int, c2: int, r2: int) -> fitz.Rect:
+            c2 = min(c2, max_col)
+            r2 = min(r2, max_row)
+            return fitz.Rect(col_x[c1], row_y[r1], col_x[c2] + column_widths[c2], row_y[r2] + row_heights[r2])
+
+        # 結合セル: 左上セル -> 範囲, それ以外のセルは描画をスキップ
+        merged_origin: Dict[Tuple[int, int], Tuple[int, int, int, int]] = {}
+        merged_hidden = set()
+        for merged in sheet.merged_cells.ranges:
+            if merged.max_col < min_col or merged.min_col > max_col or merged.max_row < min_row or merged.min_row > max_row:
+                continue
+            merged_origin[(merged.min_row, merged.min_col)] = (merged.min_col, merged.min_row, merged.max_col, merged.max_row)
+            for row in range(merged.min_row, merged.max_row + 1):
+                for col in range(merged.min_col, merged.max_col + 1):
+                    if (row, col) != (merged.min_row, merged.min_col):
+                        merged_hidden.add((row, col))
+
+        doc = fitz.open()
+        try:
+            page = doc.new_page(width=page_width, height=page_height)
+
+            # 枠線（グリッド線）
+            shape = page.new_shape()
+            for col in range(min_col, max_col + 2):
+                gx = col_x[col] if col <= max_col else page_width
+                shape.draw_line((gx, 0), (gx, page_height))
+            for row in range(min_row, max_row + 2):
+                gy = row_y[row] if row <= max_row else page_height
+                shape.draw_line((0, gy), (page_width, gy))
+            shape.finish(color=_GRIDLINE_COLOR, width=0.25)
+            shape.commit()
+
+            texts = []
+            for row in sheet.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col):
+                for cell in row:
+                    if (cell.row, cell.column) in merged_hidden:
+                        continue
+                    if (cell.row, cell.column) in merged_origin:
+                        rect = cell_rect(*merged_origin[(cell.row, cell.column)])
+                    else:
+                        rect = cell_rect(cell.column, cell.row, cell.column, cell.row)
+                    if rect.is_empty:
+                        continue
+
+                    # 背景色
+                    if cell.fill is not None and cell.fill.fill_type == "solid":
+                        fill_rgb = _to_rgb(cell.fill.fgColor)
+                        if fill_rgb is not None:
+                            page.draw_rect(rect, color=None, fill=fill_rgb, width=0)
+
+                    # 罫線
+                    border = cell.border
+                    if border is not None:
+                        for side, start, end in (
+                            (border.top, rect.tl, rect.tr),
+                            (border.bottom, rect.bl, rect.br),
+                            (border.left, rect.tl, rect.bl),
+                            (border.right, rect.tr, rect.br),
+                        ):
+                            if side is not None and side.style:
+                                page.draw_line(start, end, color=_to_rgb(side.color) or (0, 0, 0), width=_BORDER_WIDTHS.get(side.style, 0.5))
+
+                    if cell.value is not None and str(cell.value) != "":
+                        texts.append((cell, rect))
+
+            # 値（背景・罫線の上に描画）
+            # 左寄せの文字列はExcelと同様に右隣の空セルまではみ出して表示し、それ以上は切り詰める
+            occupied = {(cell.row, cell.column) for cell, _ in texts} | merged_hidden
+            for cell, rect in texts:
+                overflow_x1 = rect.x1
+                if (cell.row, cell.column) not in merged_origin:
+                    col = cell.column + 1
+                    while col <= max_col and (cell.row, col) not in occupied:
+                        overflow_x1 += column_widths[col]
+                        col += 1
+                self._draw_value(page, cell, rect, overflow_x1)
+
+            pix = page.get_pixmap(dpi=self.dpi)
+            pix.save(str(output_path))
+        finally:
+            doc.close()
+
+    def _fit_text(self, text: str, fontsize: float, max_width: float) -> str:
+        """指定幅に収まるように文字列を切り詰める"""
+        while text and self._font.text_length(text, fontsize) > max_width:
+            text = text[:-1]
+        return text
+
+    def _draw_value(self, page, cell, rect: fitz.Rect, overflow_x1: float) -> None:
+        """セルの値を配置に合わせて描画する"""
+        font = cell.font
+        fontsize = float(font.sz) if font is not None and font.sz else 11.0
+        fontsize = min(fontsize, max(rect.height - 2, 4.0))
+        color = (_to_rgb(font.color) if font is not None else None) or (0, 0, 0)
+        horizontal = cell.alignment.horizontal if cell.alignment is not None else None
+        vertical = cell.alignment.vertical if cell.alignment is not None else None
+        if horizontal is None and isinstance(cell.value, (int, float)) and not isinstance(cell.value, bool):
+            horizontal = "right"
+
+        lines = _format_value(cell.value).splitlines() or [""]
+        line_height = fontsize * 1.2
+        block_height = line_height * len(lines)
+        if vertical == "top":
+            baseline = rect.y0 + fontsize
+        elif vertical == "center":
+            baseline = rect.y0 + (rect.height - block_height) / 2 + fontsize
+        else:
+            baseline = rect.y1 - block_height + fontsize - _CELL_PADDING / 2
+
+        # 描画と文字幅の計算で同じフォントを使用する
+        writer = fitz.TextWriter(page.rect, color=color)
+        for line in lines:
+            if horizontal in ("center", "centerContinuous", "right"):
+                line = self._fit_text(line, fontsize, rect.width - _CELL_PADDING * 2)
+            else:
+                line = self._fit_text(line, fontsize, overflow_x1 - rect.x0 - _CELL_PADDING * 2)
+            text_width = self._font.text_length(line, fontsize)
+            if horizontal in ("center", "centerContinuous"):
+                x = rect.x0 + (rect.width - text_width) / 2
+            elif horizontal == "right":
+                x = rect.x1 - text_width - _CELL_PADDING
+            else:
+                x = rect.x0 + _CELL_PADDING
+            if line:
+                writer.append((x, baseline), line, font=self._font, fontsize=fontsize)
+            baseline += line_height
+        writer.write_text(page)
+
+_BACKENDS = {
+    "soffice": SofficeCaptureBackend,
+    "soffice_sheets": SofficePerSheetCaptureBackend,
+    "native": NativeCaptureBackend,
+}
+
+def get_capture_backend(name: Optional[str] = None) -> CaptureBackend:
+    """
+    キャプチャバックエンドを取得する
+
+    Args:
+        name (Optional[str]): バックエンド名（soffice / soffice_sheets / native）。未指定の場合は環境変数 EXCEL_CAPTURE_BACKEND またはsoffice
+
+    Returns:
+        CaptureBackend: キャプチャバックエンド
+    """
+    name = name or os.getenv("EXCEL_CAPTURE_BACKEND", DEFAULT_CAPTURE_BACKEND)
+    if name not in _BACKENDS:
+        raise ValueError(f"未対応のキャプチャバックエンドです: {name}")
+    return _BACKENDS[name]()
+
+def renders_per_sheet(name: Optional[str] = None) -> bool:
+    """バックエンドが指定したシートのみを描画するか（差分の再キャプチャで描画量が減るか）"""
+    name = name or os.getenv("EXCEL_CAPTURE_BACKEND", DEFAULT_CAPTURE_BACKEND)
+    if name not in _BACKENDS:
+        raise ValueError(f"未対応のキャプチャバックエンドです: {name}")
+    return _BACKENDS[name].renders_per_sheet
+
+def capture_workbook(
+    excel_path: str,
+    captures_dir: Path,
+    backend: Optional[str] = None,
+    sheet_names: Optional[List[str]] = None,
+) -> Dict[str, str]:
+    """
+    指定したバックエンドでExcelのシートをキャプチャする（native失敗時はsofficeにフォールバック）
+
+    Args:
+        excel_path (str): Excelファイルのパス
+        captures_dir (Path): キャプチャの出力ディレクトリ
+        backend (Optional[str]): バックエンド名（soffice / soffice_sheets / native）
+        sheet_names (Optional[List[str]]): キャプチャするシート名（未指定の場合は全シート）
+
+    Returns:
+        Dict[str, str]: {シート名: PNGパス}
+    """
+    capture_backend = get_capture_backend(backend)
+    try:
+        return capture_backend.capture(excel_path, captures_dir, sheet_names)
+    except Exception as e:
+        if capture_backend.name.startswith("soffice"):
+            raise
+        logger.warning(f"{capture_backend.name} バックエンドでのキャプチャに失敗したため、sofficeで再試行します: {e}")
+        return SofficeCaptureBackend().capture(excel_path, captures_dir, sheet_names)
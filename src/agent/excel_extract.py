@@ -0,0 +1,139 @@
+"""
+Excelテンプレートのテキスト抽出エンジン（1回の読み込みでテキスト化とキャプチャ用コピーを作成）
+
+ブックは1回だけ読み込み、以下を行う。
+- 空でないセルのみを行優先で走査し、Markdownのテーブルを1行ずつファイルへ書き出す（文字列の連結は行わない）
+- 書式（太字・背景色）はスタイルID（fontId, fillId）ごとに1回だけ判定してメモ化する
+- 同じブックに印刷範囲を設定してキャプチャ用のコピーを保存する（セルの値・書式は変更しないため抽出結果に影響しない）
+
+制限: キャプチャ用のコピーの保存には書き込み可能なブック（read_only=False）が必要なため、ブック全体をメモリに読み込む。
+ピーク時のメモリはブックのセル数に比例し、上限は設けていない（出力を1行ずつ書き出すことで減るのは出力文字列の分のみ）。
+read_only=True で抽出してからコピー用に読み込み直しても、ピークは書き込み可能なブックの読み込みで決まるため行っていない。
+"""
+
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, TextIO, Tuple, Union
+
+import openpyxl
+from openpyxl.utils import get_column_letter
+from openpyxl.workbook.workbook import Workbook
+from openpyxl.worksheet.worksheet import Worksheet
+
+from agent.metrics import timed_stage
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ExtractionResult:
+    """テキスト抽出の結果"""
+
+    text_file: str
+    capture_file: Optional[str] = None
+    sheet_names: List[str] = field(default_factory=list)
+    cell_count: int = 0
+
+class _FormatCache:
+    """スタイルID（fontId, fillId）ごとに書式の説明文字列をメモ化する"""
+
+    def __init__(self, workbook: Workbook):
+        self._fonts = workbook._fonts
+        self._fills = workbook._fills
+        self._memo: Dict[Tuple[int, int], str] = {}
+
+    def describe(self, cell) -> str:
+        style = cell._style
+        key = (style.fontId, style.fillId) if style is not None else (0, 0)
+        format_str = self._memo.get(key)
+        if format_str is None:
+            format_str = self._describe(*key)
+            self._memo[key] = format_str
+        return format_str
+
+    def _describe(self, font_id: int, fill_id: int) -> str:
+        format_info = []
+        if self._fonts[font_id].bold:
+            format_info.append("太字")
+        fill = self._fills[fill_id]
+        # GradientFill には fill_type がないため、単色塗りつぶしのみ対象
+        if getattr(fill, "fill_type", None) == "solid":
+            fill_color = fill.start_color.index
+            if fill_color != "00000000":  # デフォルト色でない場合
+                format_info.append(f"背景色:{fill_color}")
+        return ", ".join(format_info) if format_info else "-"
+
+def _write_sheet(sheet: Worksheet, out: TextIO, formats: _FormatCache) -> int:
+    """1シート分のMarkdownを書き出し、出力したセル数を返す"""
+    out.write(f"## シート名: {sheet.title}\n")
+
+    # 結合セル情報の抽出
+    merged_ranges = sheet.merged_cells.ranges
+    if merged_ranges:
+        out.write("### 結合セル情報:\n")
+        for cell_range in merged_ranges:
+            out.write(f"- {cell_range}\n")
+
+    # セルデータの抽出
+    out.write("### セルデータ:\n")
+    out.write("| セル | 値 | 書式 |\n")
+    out.write("|-----|----|--------|\n")
+
+    # iter_rows() は使用範囲内の空セルまで生成するため、実在するセルのみを行優先の順に走査する
+    cell_count = 0
+    for (row, column), cell in sorted(sheet._cells.items()):
+        if cell.value is None:
+            continue
+        out.write(f"| {get_column_letter(column)}{row} | {cell.value} | {formats.describe(cell)} |\n")
+        cell_count += 1
+    return cell_count
+
+def _set_print_areas(workbook: Workbook) -> None:
+    """各シートの印刷範囲を使用範囲に設定する（LibreOfficeでのキャプチャ用）"""
+    for sheet in workbook.worksheets:
+        try:
+            dimension = sheet.calculate_dimension()
+            if dimension:
+                sheet.print_area = dimension
+                # LibreOffice が印刷範囲を確実に認識するよう fitToPage を有効化
+                sheet.page_setup.fitToPage = True
+                logger.info(f"シート '{sheet.title}' の印刷範囲を {dimension} に設定しました")
+        except Exception as e_dim:
+            logger.warning(f"シート '{sheet.title}' の印刷範囲設定エラー: {e_dim}")
+
+def extract_workbook(
+    excel_file: Union[str, Path],
+    text_file: Union[str, Path],
+    capture_file: Optional[Union[str, Path]] = None,
+) -> ExtractionResult:
+    """
+    Excelファイルを1回だけ読み込み、Markdown形式のテキストとキャプチャ用のコピーを作成する
+    （ブック全体をメモリに読み込むため、メモリ使用量はブックのサイズに比例する）
+
+    Args:
+        excel_file (Union[str, Path]): Excelファイルのパス
+        text_file (Union[str, Path]): 抽出テキスト（Markdown）の出力先
+        capture_file (Optional[Union[str, Path]]): 印刷範囲を設定したキャプチャ用コピーの出力先（未指定の場合は作成しない）
+
+    Returns:
+        ExtractionResult: 抽出結果
+    """
+    with timed_stage("excel_load"):
+        workbook = openpyxl.load_workbook(excel_file)
+    result = ExtractionResult(text_file=str(text_file), sheet_names=list(workbook.sheetnames))
+    formats = _FormatCache(workbook)
+
+    with open(text_file, "w", encoding="utf-8") as out:
+        for sheet in workbook.worksheets:
+            result.cell_count += _write_sheet(sheet, out, formats)
+    logger.info(f"Excelテキスト抽出完了: {text_file} ({result.cell_count}セル)")
+
+    if capture_file is not None:
+        _set_print_areas(workbook)
+        with timed_stage("excel_save"):
+            workbook.save(capture_file)
+        result.capture_file = str(capture_file)
+        logger.info(f"印刷範囲設定済みのExcelを一時ファイル '{capture_file}' に保存しました。")
+
+    workbook.close()
+    return result
@@ -1,12 +1,84 @@
+import logging
+import os
+import threading
+import uuid
 from agent.state import State
-from agent.understand_format import build_workflow, ExcelFormFields, ValidationResult
+from agent.metrics import timed_node
+from agent.format_cache import make_cache_key, load_format_result, store_format_result, invalidate_format_result
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+_format_app = None
+_format_app_lock = threading.Lock()
+
+def get_format_app():
+    """
+    コンパイル済みのExcel入力欄特定ワークフローを取得する（プロセス内で1回だけコンパイルして共有）
+    """
+    global _format_app
+    with _format_app_lock:
+        if _format_app is None:
+            # 子グラフ（openpyxl・PyMuPDFを使用）は最初の実行時に読み込む
+            from agent.understand_format import build_workflow
+
+            _format_app = build_workflow().compile()
+        return _format_app
+
+def get_format_cache_dir(state: State) -> str:
+    """
+    Excel入力欄特定結果のキャッシュディレクトリを取得する（未指定の場合は出力ディレクトリ配下）
+    """
+    if state.excel_format_cache_dir:
+        return state.excel_format_cache_dir
+    base_dir = state.output_dir if state.output_dir and str(state.output_dir).strip() else str(Path(state.excel_file).parent)
+    return os.path.join(base_dir, "format_cache")
+
+def get_format_output_dir(state: State) -> str:
+    """
+    Excel入力欄特定結果の出力ディレクトリ（子グラフと同じ format_data）を取得する
+    """
+    base_dir = state.output_dir if state.output_dir and str(state.output_dir).strip() else str(Path(state.excel_file).parent)
+    return os.path.join(base_dir, "format_data")
+
+@timed_node()
 def run_excel_format_workflow_node(state: State) -> dict:
     """
     StateからExcelファイルパス・出力先・反復回数を取得し、Excel入力欄特定ワークフローを実行。
     結果（最終JSONや構造化データ）をStateに格納して返す。
+    同じ内容のテンプレートの結果がキャッシュにある場合はワークフローを実行せずに返す。
     """
+    cache_dir = ""
+    cache_key = ""
+    if state.excel_format_cache_enabled and os.path.exists(state.excel_file):
+        cache_dir = get_format_cache_dir(state)
+        capture_backend = state.excel_capture_backend or os.getenv("EXCEL_CAPTURE_BACKEND", "soffice")
+        cache_key = make_cache_key(
+            state.excel_file,
+            capture_backend,
+            state.excel_format_model,
+            state.excel_max_iterations,
+            state.excel_validation_mode,
+        )
+        if state.excel_format_cache_refresh:
+            invalidate_format_result(cache_dir, cache_key)
+        # キャッシュは他の実行と共有するため、結果ファイルはこの実行の出力ディレクトリにコピーして使用する
+        cached = load_format_result(cache_dir, cache_key, get_format_output_dir(state))
+        if cached:
+            logger.info(f"Excel入力欄特定結果をキャッシュから取得しました: {cache_key}")
+            return {
+                "excel_format_result": cached["estimated_fields"],
+                "excel_format_json_path": cached["final_json"],
+                "highlighted_captures": cached["highlighted_captures"]
+            }
+
+    app = get_format_app()
+    from agent.highlight_session import close_highlight_session
+    from agent.understand_format import ExcelFormFields, ValidationResult
+
+    # ハイライトセッション（イテレーション間で保持するハイライト済みブック）はこの実行が所有し、終了時に必ず破棄する
+    highlight_session_id = uuid.uuid4().hex
+
     # 子グラフの初期状態を作成
     initial_state = {
         "excel_file": state.excel_file,
@@ -24,15 +96,32 @@ def run_excel_format_workflow_node(state: State) -> dict:
         "validation_status": "OK",
         "final_json": "",
         "status": "進行中",
-        "error_message": ""
+        "error_message": "",
+        "capture_backend": state.excel_capture_backend,
+        "model": state.excel_format_model,
+        "highlight_session": highlight_session_id,
+        "validation_mode": state.excel_validation_mode
     }
-    # 子グラフを構築・実行
-    workflow = build_workflow()
-    app = workflow.compile()
-    result = app.invoke(initial_state)
+    # 子グラフを実行
+    try:
+        result = app.invoke(initial_state)
+    finally:
+        close_highlight_session(highlight_session_id)
+
+    # 正常に完了した結果のみキャッシュに保存
+    if cache_key and result.get("status") == "完了" and result.get("final_json"):
+        store_format_result(
+            cache_dir,
+            cache_key,
+            result["final_json"],
+            result.get("highlighted_captures", []),
+            max_bytes=state.excel_format_cache_max_bytes,
+            max_entries=state.excel_format_cache_max_entries,
+        )
+
     # Stateに結果を格納して返す
     return {
         "excel_format_result": result.get("estimated_fields", {}),
         "excel_format_json_path": result.get("final_json", ""),
         "highlighted_captures": result.get("highlighted_captures", "")
-    } 
\ No newline at end of file
+    } 
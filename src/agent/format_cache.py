@@ -0,0 +1,183 @@
+"""
+Excel入力欄特定ワークフローの結果キャッシュ（テンプレート内容のハッシュと、キャプチャバックエンド・モデル・反復回数・検証方法をキーとする）
+
+キャッシュは複数の実行（バッチジョブ）で共有し、LRUで削除されるため、
+取得した結果は実行ごとの出力ディレクトリにコピーしてから使用する。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from agent.disk_cache import evict_lru, file_sha256, touch
+
+logger = logging.getLogger(__name__)
+
+# understand_format のプロンプトや処理内容を変更した場合はこの値を更新し、既存キャッシュを無効化する
+PIPELINE_VERSION = "1"
+
+MANIFEST_FILE = "manifest.json"
+FINAL_JSON_FILE = "final_form_definition.json"
+FINAL_STRUCTURED_FILE = "final_structured_form_definition.json"
+CAPTURES_DIR = "captures"
+
+def make_cache_key(
+    excel_file: str,
+    capture_backend: str,
+    model: str,
+    max_iterations: int,
+    validation_mode: str,
+) -> str:
+    """
+    テンプレートファイルの内容・結果に影響する設定・パイプラインバージョンからキャッシュキーを生成する関数
+
+    Args:
+        excel_file (str): Excelテンプレートのパス
+        capture_backend (str): Excelキャプチャのバックエンド名
+        model (str): ワークフローで使用するモデル名
+        max_iterations (int): ワークフローの最大反復回数
+        validation_mode (str): 複数シートの検証方法
+
+    Returns:
+        str: キャッシュキー
+    """
+    seed = f"{file_sha256(excel_file)}:{PIPELINE_VERSION}:{capture_backend}:{model}:{max_iterations}:{validation_mode}"
+    return hashlib.sha256(seed.encode("utf-8")).hexdigest()
+
+def load_format_result(cache_dir: str, key: str, dest_dir: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    キャッシュからワークフローの最終結果を読み込む関数
+
+    Args:
+        cache_dir (str): キャッシュディレクトリ
+        key (str): キャッシュキー
+        dest_dir (Optional[str]): 結果ファイルのコピー先（指定した場合、返すパスはコピー先のファイル）
+
+    Returns:
+        Optional[Dict[str, Any]]: estimated_fields, final_json, final_structured_json, highlighted_captures
+        （キャッシュが存在しない場合はNone）
+    """
+    entry_dir = Path(cache_dir) / key
+    manifest_path = entry_dir / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        final_json = entry_dir / FINAL_JSON_FILE
+        with open(final_json, "r", encoding="utf-8") as f:
+            estimated_fields = json.load(f)
+        highlighted_captures = [str(entry_dir / CAPTURES_DIR / name) for name in manifest.get("captures", [])]
+        if not all(os.path.exists(path) for path in highlighted_captures):
+            logger.warning(f"キャッシュのキャプチャファイルが欠損しているため無効とします: {entry_dir}")
+            return None
+        result = {
+            "estimated_fields": estimated_fields,
+            "final_json": str(final_json),
+            "final_structured_json": str(entry_dir / FINAL_STRUCTURED_FILE),
+            "highlighted_captures": highlighted_captures,
+        }
+        if dest_dir:
+            # エントリは他の実行のLRU削除で消える可能性があるため、後続のノードが読む前にコピーする
+            result = _copy_result(result, Path(dest_dir))
+    except (OSError, ValueError) as e:
+        logger.warning(f"キャッシュの読み込みに失敗しました: {entry_dir} ({e})")
+        return None
+
+    touch(entry_dir)
+    return result
+
+def _copy_result(result: Dict[str, Any], dest_dir: Path) -> Dict[str, Any]:
+    """
+    キャッシュの結果ファイルをコピー先に複製し、パスをコピー先に置き換えた結果を返す関数
+    """
+    (dest_dir / CAPTURES_DIR).mkdir(parents=True, exist_ok=True)
+    final_json = dest_dir / FINAL_JSON_FILE
+    shutil.copy2(result["final_json"], final_json)
+    final_structured_json = dest_dir / FINAL_STRUCTURED_FILE
+    if os.path.exists(result["final_structured_json"]):
+        shutil.copy2(result["final_structured_json"], final_structured_json)
+    highlighted_captures = []
+    for capture_path in result["highlighted_captures"]:
+        copied = dest_dir / CAPTURES_DIR / f"cached_{Path(capture_path).name}"
+        shutil.copy2(capture_path, copied)
+        highlighted_captures.append(str(copied))
+    return {
+        **result,
+        "final_json": str(final_json),
+        "final_structured_json": str(final_structured_json),
+        "highlighted_captures": highlighted_captures,
+    }
+
+def store_format_result(
+    cache_dir: str,
+    key: str,
+    final_json: str,
+    highlighted_captures: List[str],
+    max_bytes: int = 0,
+    max_entries: int = 0,
+) -> Optional[Dict[str, Any]]:
+    """
+    ワークフローの最終結果をキャッシュに保存し、上限を超えた古いエントリを削除する関数
+
+    Args:
+        cache_dir (str): キャッシュディレクトリ
+        key (str): キャッシュキー
+        final_json (str): 最終JSON（final_form_definition.json）のパス
+        highlighted_captures (List[str]): ハイライト済みExcelのキャプチャ画像パス
+        max_bytes (int): キャッシュ全体の合計バイト数の上限（0以下の場合は無制限）
+        max_entries (int): キャッシュのエントリ数の上限（0以下の場合は無制限）
+
+    Returns:
+        Optional[Dict[str, Any]]: 保存したキャッシュの内容（load_format_result と同じ形式）
+    """
+    cache_root = Path(cache_dir)
+    cache_root.mkdir(parents=True, exist_ok=True)
+    entry_dir = cache_root / key
+    structured_json = Path(final_json).parent / FINAL_STRUCTURED_FILE
+
+    # 書き込み途中のエントリが読まれないよう、一時ディレクトリに作成してから置き換える
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{key[:8]}_", dir=cache_root))
+    try:
+        shutil.copy2(final_json, tmp_dir / FINAL_JSON_FILE)
+        if structured_json.exists():
+            shutil.copy2(structured_json, tmp_dir / FINAL_STRUCTURED_FILE)
+        (tmp_dir / CAPTURES_DIR).mkdir()
+        capture_names = []
+        for idx, capture_path in enumerate(highlighted_captures, 1):
+            name = f"capture_{idx}{Path(capture_path).suffix}"
+            shutil.copy2(capture_path, tmp_dir / CAPTURES_DIR / name)
+            capture_names.append(name)
+        with open(tmp_dir / MANIFEST_FILE, "w", encoding="utf-8") as f:
+            json.dump({"pipeline_version": PIPELINE_VERSION, "captures": capture_names}, f, ensure_ascii=False, indent=2)
+
+        if entry_dir.exists():
+            shutil.rmtree(entry_dir)
+        os.replace(tmp_dir, entry_dir)
+    except OSError as e:
+        logger.warning(f"キャッシュの保存に失敗しました: {entry_dir} ({e})")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+
+    logger.info(f"Excel入力欄特定結果をキャッシュに保存しました: {entry_dir}")
+    try:
+        evict_lru(cache_root, max_bytes=max_bytes, max_entries=max_entries, keep=[entry_dir])
+    except OSError as e:
+        # キャッシュの整理に失敗しても、ワークフローの結果は保存済みのため処理を続ける
+        logger.warning(f"キャッシュの整理に失敗しました: {cache_root} ({e})")
+    return load_format_result(cache_dir, key)
+
+def invalidate_format_result(cache_dir: str, key: str) -> None:
+    """
+    指定したキーのキャッシュを削除する関数
+    """
+    entry_dir = Path(cache_dir) / key
+    if entry_dir.exists():
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        logger.info(f"キャッシュを無効化しました: {entry_dir}")
@@ -1,5 +1,3 @@
-import sys
-import langgraph.prebuilt
 import logging
 
 logging.basicConfig(
@@ -12,9 +10,23 @@ logging.basicConfig(
 
 """Module for defining the agent's workflow graph and human interaction nodes."""
 
+import os
+import uuid
+from typing import List, Union
 from langgraph.graph import StateGraph, END
+from langgraph.types import Send
 from agent.state import State
-from agent.react_node import react_node
+from langchain_core.runnables import RunnableLambda
+from agent.react_node import (
+    react_node,
+    areact_node,
+    sample_worker_node,
+    asample_worker_node,
+    SampleTask,
+    get_sample_root,
+    get_page_cache_dir,
+    get_results_log_path,
+)
 from agent.update_format_node import update_format_node
 from agent.excel_format_node import run_excel_format_workflow_node
 
@@ -22,7 +34,13 @@ from agent.excel_format_node import run_excel_format_workflow_node
 workflow = StateGraph(State)
 
 # Add the node to the graph. This node will interrupt when it is invoked.
-workflow.add_node("react_node", react_node)
+# The sample nodes run with ainvoke when the graph is executed asynchronously (e.g. on the LangGraph server)
+workflow.add_node("react_node", RunnableLambda(react_node, afunc=areact_node, name="react_node"))
+workflow.add_node(
+    "sample_worker_node",
+    RunnableLambda(sample_worker_node, afunc=asample_worker_node, name="sample_worker_node"),
+    input=SampleTask,
+)
 workflow.add_node("update_format_node", update_format_node)
 workflow.add_node("run_excel_format_workflow_node", run_excel_format_workflow_node)
 
@@ -34,8 +52,43 @@ def should_continue(state: State) -> str:
     else:
         return "continue"
 
-# Set the entrypoint as `react_node`
-workflow.add_edge("__start__", "react_node")
+# Define the routing function for the entrypoint
+def route_samples(state: State) -> Union[str, List[Send]]:
+    """Dispatches each sample folder as its own branch in parallel mode, otherwise starts the sequential loop."""
+    if not (state.parallel_samples and state.sample_data_path):
+        return "react_node"
+    sample_folders = os.listdir(get_sample_root(state))
+    if not sample_folders:
+        return "run_excel_format_workflow_node"
+    page_cache_dir = get_page_cache_dir(state)
+    results_log_path = get_results_log_path(state)
+    # 同時実行数の上限は実行ごとに適用する（同時に実行中の他の実行・バッチジョブとは共有しない）
+    run_key = uuid.uuid4().hex
+    return [
+        Send("sample_worker_node", {
+            "sample_root": state.sample_root,
+            "sample_data_path": state.sample_data_path,
+            "sample_data": sample_data,
+            "iter_id": iter_id,
+            "procedure": state.procedure,
+            "run_key": run_key,
+            "max_concurrency": state.max_concurrency,
+            "page_cache_dir": page_cache_dir,
+            "page_cache_max_bytes": state.page_cache_max_bytes,
+            "sample_memory_limit_bytes": state.sample_memory_limit_bytes,
+            "pdf_evidence_mode": state.pdf_evidence_mode,
+            "pdf_top_k_pages": state.pdf_top_k_pages,
+            "results_log_path": results_log_path,
+        })
+        for iter_id, sample_data in enumerate(sample_folders, 1)
+    ]
+
+# Set the entrypoint: sequential `react_node` loop or parallel fan-out
+workflow.add_conditional_edges(
+    "__start__",
+    route_samples,
+    ["react_node", "sample_worker_node", "run_excel_format_workflow_node"]
+)
 # Add the conditional edge
 workflow.add_conditional_edges(
     "react_node",
@@ -46,6 +99,9 @@ workflow.add_conditional_edges(
     }
 )
 
+# Merge the parallel branches (each branch appends its result to the results log)
+workflow.add_edge("sample_worker_node", "run_excel_format_workflow_node")
+
 # Add edge from run_excel_format_workflow_node to update_format_node
 workflow.add_edge("run_excel_format_workflow_node", "update_format_node")
 
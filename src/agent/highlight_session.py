@@ -0,0 +1,217 @@
+"""
+入力欄ハイライトのセッション（修正イテレーション間でハイライト済みブックを保持）
+
+修正のたびに元のExcelを読み込み直して全セルを書き換えるのではなく、
+前回のハイライト状態との差分（追加・削除されたセル）だけをブックに反映する。
+差分があったシートのみを再キャプチャ対象とし、それ以外のシートは前回のキャプチャを再利用する。
+再キャプチャの描画量が減るのはシートごとに描画するバックエンド（soffice_sheets / native）のみで、
+soffice はブック全体を変換するため、再キャプチャでは全シートの画像を更新する。
+
+セッションはワークフローの実行（excel_format_node）が所有し、実行の終了時（エラー・中断を含む）に破棄する。
+ノードは use_highlight_session の中でセッションを使用し、使用中のセッションは上限を超えても破棄しない。
+"""
+
+import copy
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import openpyxl
+from openpyxl.cell.cell import MergedCell
+from openpyxl.styles import PatternFill
+from openpyxl.utils.cell import coordinate_to_tuple
+
+logger = logging.getLogger(__name__)
+
+# 同時に保持するセッション数の上限（終了処理されなかったセッションは、使用中でないものを古い順に破棄）
+MAX_SESSIONS = 8
+
+
+def is_valid_cell_address(cell_addr: str) -> bool:
+    """ハイライト対象として扱うセルアドレスか（例: A1, B12）"""
+    return len(cell_addr) >= 2 and cell_addr[0].isalpha() and cell_addr[1:].isdigit()
+
+
+class HighlightSession:
+    """
+    ハイライト済みブックと、シートごとのハイライト済みセル・キャプチャを保持するクラス
+
+    Args:
+        excel_file (Union[str, Path]): 元のExcelファイルのパス
+    """
+
+    def __init__(self, excel_file: Union[str, Path]):
+        self.excel_file = str(excel_file)
+        self.workbook = openpyxl.load_workbook(excel_file)
+        self.highlighted: Dict[str, Set[str]] = {name: set() for name in self.workbook.sheetnames}
+        # (シート名, セルアドレス) -> (元の値, 元のスタイル, 元々セルが存在したか)
+        self._originals: Dict[Tuple[str, str], Tuple[Any, Any, bool]] = {}
+        self.captures: Dict[str, str] = {}
+        self.pending_sheets: List[str] = list(self.workbook.sheetnames)
+        self.highlighted_excel: Optional[str] = None
+        # use_highlight_session で使用中のノード数（_sessions_lock で保護）
+        self._users = 0
+        self.highlight_fill = PatternFill(
+            start_color="FFFF00",
+            end_color="FFFF00",
+            fill_type="solid"
+        )
+
+    def _highlight(self, sheet, cell_addr: str) -> None:
+        existed = coordinate_to_tuple(cell_addr) in sheet._cells
+        cell = sheet[cell_addr]
+        if isinstance(cell, MergedCell):
+            # 結合セルの左上以外のセルは値を設定できないため、書き換える前にスキップする
+            raise ValueError("結合セルの左上以外のセルは値を設定できません")
+        original_value = cell.value # 元の値を取得
+        self._originals[(sheet.title, cell_addr)] = (original_value, copy.copy(cell._style), existed)
+        cell.fill = self.highlight_fill
+        if original_value is not None and str(original_value).strip() != "":
+            cell.value = f"{cell_addr}:{original_value}" # セルアドレスと元の値を連結
+        else:
+            cell.value = cell_addr # 元の値が空ならセルアドレスのみ設定
+
+    def _restore(self, sheet, cell_addr: str) -> None:
+        original_value, original_style, existed = self._originals.pop((sheet.title, cell_addr))
+        cell = sheet[cell_addr]
+        if not existed:
+            # ハイライトのために作成したセルは削除し、使用範囲（印刷範囲）も元に戻す
+            del sheet._cells[(cell.row, cell.column)]
+            return
+        cell.value = original_value
+        cell._style = original_style
+
+    def apply(self, cell_addrs: Iterable[str]) -> List[str]:
+        """
+        ハイライト対象のセルを反映し、変更があったシート名を返す（前回との差分のみ書き換える）
+
+        Args:
+            cell_addrs (Iterable[str]): ハイライトするセルアドレス（全シート共通）
+
+        Returns:
+            List[str]: 再キャプチャが必要なシート名（シート順）
+        """
+        target = {cell_addr for cell_addr in cell_addrs if is_valid_cell_address(cell_addr)}
+        changed_sheets = []
+        for sheet in self.workbook.worksheets:
+            current = self.highlighted[sheet.title]
+            to_remove = current - target
+            to_add = target - current
+            for cell_addr in to_remove:
+                self._restore(sheet, cell_addr)
+                current.discard(cell_addr)
+            for cell_addr in sorted(to_add):
+                try:
+                    self._highlight(sheet, cell_addr)
+                    current.add(cell_addr)
+                except Exception as cell_error:
+                    logger.warning(f"セル {cell_addr} のハイライトまたは値設定中にエラー: {str(cell_error)}")
+                    # 途中まで書き換えたセルは元に戻す
+                    if (sheet.title, cell_addr) in self._originals:
+                        self._restore(sheet, cell_addr)
+            if to_remove or (current & to_add):
+                changed_sheets.append(sheet.title)
+        # 前回のキャプチャが未取得のシートも再キャプチャ対象に残す
+        self.pending_sheets = [
+            name for name in self.workbook.sheetnames
+            if name in changed_sheets or name in self.pending_sheets
+        ]
+        return changed_sheets
+
+    def save(self, path: Union[str, Path]) -> None:
+        """印刷範囲を設定してハイライト済みブックを保存する"""
+        for sheet in self.workbook.worksheets:
+            try:
+                dimension = sheet.calculate_dimension()
+                if dimension:
+                    sheet.print_area = dimension
+                    sheet.page_setup.fitToPage = True
+            except Exception as e_dim:
+                logger.warning(f"ハイライト済みシート '{sheet.title}' の印刷範囲設定エラー: {e_dim}")
+        self.workbook.save(path)
+        self.highlighted_excel = str(path)
+
+    def update_captures(self, capture_map: Dict[str, str]) -> None:
+        """再キャプチャしたシートの画像を反映する"""
+        self.captures.update(capture_map)
+        self.pending_sheets = [name for name in self.pending_sheets if name not in capture_map]
+
+    def ordered_captures(self) -> List[str]:
+        """シート順のキャプチャ画像パス"""
+        return [self.captures[name] for name in self.workbook.sheetnames if name in self.captures]
+
+    def close(self) -> None:
+        """ブックを閉じる"""
+        self.workbook.close()
+
+
+_sessions: "OrderedDict[str, HighlightSession]" = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def _evict_idle_sessions() -> List[HighlightSession]:
+    """上限を超えたセッションのうち、使用中でないものを古い順に登録から除く（_sessions_lock 内で呼び出す）"""
+    evicted = []
+    for session_id in list(_sessions):
+        if len(_sessions) <= MAX_SESSIONS:
+            break
+        if _sessions[session_id]._users == 0:
+            evicted.append(_sessions.pop(session_id))
+    return evicted
+
+
+@contextmanager
+def use_highlight_session(
+    session_id: Optional[str],
+    excel_file: Optional[Union[str, Path]] = None,
+) -> Iterator[Tuple[Optional[str], Optional[HighlightSession]]]:
+    """
+    ハイライトセッションを使用中にして取得するコンテキストマネージャー（使用中は破棄されない）
+
+    Args:
+        session_id (Optional[str]): セッションID（未指定の場合は新しいIDで作成する）
+        excel_file (Optional[Union[str, Path]]): セッションが存在しない場合に作成する元のExcelファイル
+            （未指定の場合は作成せず、セッションとして None を返す）
+
+    Yields:
+        Tuple[Optional[str], Optional[HighlightSession]]: セッションIDとセッション
+    """
+    with _sessions_lock:
+        session = _sessions.get(session_id) if session_id else None
+        if session is not None:
+            _sessions.move_to_end(session_id)
+            session._users += 1
+    if session is None and excel_file is not None:
+        session = HighlightSession(excel_file)
+        session_id = session_id or uuid.uuid4().hex
+        with _sessions_lock:
+            session._users += 1
+            _sessions[session_id] = session
+            evicted = _evict_idle_sessions()
+        for stale in evicted:
+            stale.close()
+    try:
+        yield session_id, session
+    finally:
+        if session is not None:
+            with _sessions_lock:
+                session._users -= 1
+                # 使用中に破棄を要求された（登録から除かれた）セッションは、最後の使用者が閉じる
+                closing = session._users == 0 and _sessions.get(session_id) is not session
+            if closing:
+                session.close()
+
+
+def close_highlight_session(session_id: Optional[str]) -> None:
+    """ハイライトセッションを破棄する（使用中の場合は使用の終了時に閉じる）"""
+    if not session_id:
+        return
+    with _sessions_lock:
+        session = _sessions.pop(session_id, None)
+        closing = session is not None and session._users == 0
+    if closing:
+        session.close()
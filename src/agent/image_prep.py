@@ -0,0 +1,219 @@
+"""
+モデルに送信する画像の前処理（余白の切り取り・縮小・再圧縮）
+
+Excelのキャプチャや証跡のPDFページはフルサイズのPNGのままだとリクエストが大きくなり、
+モデルの応答時間も長くなるため、送信前に以下を行う。
+- 周囲の白い余白を切り取る（シートの使用範囲・ページ内容の外側）
+- 用途ごとの上限サイズ（長辺のピクセル数）まで縮小する
+- 用途ごとの形式（PNG / JPEG）・品質で再圧縮する
+
+環境変数:
+    IMAGE_PREP_ENABLED: 前処理を行うか（デフォルト: true）
+    IMAGE_PREP_FORMAT: 全用途の出力形式を上書きする（png / jpeg）
+    IMAGE_PREP_QUALITY: JPEGの品質を上書きする（1-100）
+    IMAGE_PREP_MAX_SIDE: 全用途の長辺の上限ピクセル数を上書きする
+"""
+
+import base64
+import logging
+import os
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Dict, Literal, Optional, Tuple
+
+from agent.metrics import record_image, timed_stage
+
+if TYPE_CHECKING:
+    # PyMuPDFは読み込みに時間がかかるため、最初に画像を前処理する時点で読み込む
+    import fitz
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class ImageProfile:
+    """用途ごとの前処理の設定"""
+
+    max_side: int
+    format: Literal["png", "jpeg"] = "png"
+    quality: int = 85
+    crop: bool = True
+    margin: int = 8
+
+# Excelのキャプチャは文字と罫線が中心のためPNG、証跡（スキャン・写真）はJPEGの方が小さくなる
+PROFILES: Dict[str, ImageProfile] = {
+    "form": ImageProfile(max_side=2000, format="png"),
+    "evidence": ImageProfile(max_side=1600, format="jpeg", quality=80),
+}
+
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg"}
+
+# 前処理後の1ピクセルあたりのバイト数の概算（スキャン・写真を含む証跡を想定した大きめの値）
+_BYTES_PER_PIXEL = {"png": 1.0, "jpeg": 0.25}
+
+@dataclass
+class PreparedImage:
+    """前処理済みの画像"""
+
+    data: bytes
+    format: Literal["png", "jpeg"]
+    width: int
+    height: int
+    original_bytes: int
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES[self.format]
+
+    def to_base64(self) -> str:
+        with timed_stage("base64"):
+            return base64.b64encode(self.data).decode("utf-8")
+
+    def data_url(self) -> str:
+        """image_url に指定するdata URL"""
+        return f"data:{self.mime_type};base64,{self.to_base64()}"
+
+def _enabled() -> bool:
+    return os.getenv("IMAGE_PREP_ENABLED", "true").lower() not in ("0", "false", "no")
+
+def get_profile(name: str) -> ImageProfile:
+    """用途名に対応する設定を取得する（環境変数による上書きを反映）"""
+    profile = PROFILES[name]
+    overrides = {}
+    if os.getenv("IMAGE_PREP_FORMAT"):
+        overrides["format"] = "jpeg" if os.getenv("IMAGE_PREP_FORMAT").lower() in ("jpg", "jpeg") else "png"
+    if os.getenv("IMAGE_PREP_QUALITY"):
+        overrides["quality"] = int(os.getenv("IMAGE_PREP_QUALITY"))
+    if os.getenv("IMAGE_PREP_MAX_SIDE"):
+        overrides["max_side"] = int(os.getenv("IMAGE_PREP_MAX_SIDE"))
+    return replace(profile, **overrides) if overrides else profile
+
+def estimate_prepared_bytes(width: float, height: float, profile: str = "evidence") -> int:
+    """
+    画像を描画・前処理せずに、前処理後のサイズを概算する（余白の切り取りは考慮しない）
+
+    Args:
+        width (float): 画像の幅（ピクセル）
+        height (float): 画像の高さ（ピクセル）
+        profile (str): 用途名
+
+    Returns:
+        int: 前処理後のバイト数の概算
+    """
+    settings = get_profile(profile)
+    image_format = settings.format
+    longest = max(width, height)
+    if not _enabled():
+        image_format = "png"
+    elif settings.max_side and longest > settings.max_side:
+        scale = settings.max_side / longest
+        width, height = width * scale, height * scale
+    return int(width * height * _BYTES_PER_PIXEL[image_format])
+
+def _content_bbox(pix: "fitz.Pixmap") -> Optional[Tuple[int, int, int, int]]:
+    """白（0xff）以外の画素を含む範囲 (x0, y0, x1, y1) を返す（全面が白の場合はNone）"""
+    samples = pix.samples
+    stride = pix.stride
+    row_bytes = pix.width * pix.n
+    top = None
+    bottom = 0
+    left = row_bytes
+    right = 0
+    for y in range(pix.height):
+        row = samples[y * stride:y * stride + row_bytes]
+        stripped_left = len(row) - len(row.lstrip(b"\xff"))
+        if stripped_left == row_bytes:
+            continue
+        if top is None:
+            top = y
+        bottom = y
+        left = min(left, stripped_left)
+        right = max(right, len(row.rstrip(b"\xff")))
+    if top is None:
+        return None
+    return left // pix.n, top, (right + pix.n - 1) // pix.n, bottom + 1
+
+def _crop(pix: "fitz.Pixmap", margin: int) -> "fitz.Pixmap":
+    """周囲の白い余白を切り取る（margin ピクセルの余白は残す）"""
+    import fitz
+
+    bbox = _content_bbox(pix)
+    if bbox is None:
+        return pix
+    x0, y0, x1, y1 = bbox
+    x0, y0 = max(x0 - margin, 0), max(y0 - margin, 0)
+    x1, y1 = min(x1 + margin, pix.width), min(y1 + margin, pix.height)
+    if (x0, y0, x1, y1) == (0, 0, pix.width, pix.height):
+        return pix
+    samples = pix.samples
+    stride = pix.stride
+    cropped = b"".join(
+        samples[y * stride + x0 * pix.n:y * stride + x1 * pix.n] for y in range(y0, y1)
+    )
+    return fitz.Pixmap(fitz.csRGB, x1 - x0, y1 - y0, cropped, False)
+
+def prepare_image(image_bytes: bytes, profile: str = "evidence", label: str = "") -> PreparedImage:
+    """
+    モデルに送信する画像を前処理する
+
+    Args:
+        image_bytes (bytes): 画像のバイト列（PNG / JPEGなど）
+        profile (str): 用途名（"form": Excelのキャプチャ, "evidence": 証跡の画像・PDFページ）
+        label (str): ログ出力用の名前（未指定の場合は用途名）
+
+    Returns:
+        PreparedImage: 前処理済みの画像
+    """
+    with timed_stage("image_prep"):
+        image = _prepare_image(image_bytes, get_profile(profile), label or profile)
+    record_image(image.original_bytes, len(image.data))
+    return image
+
+def _prepare_image(image_bytes: bytes, settings: ImageProfile, label: str) -> PreparedImage:
+    import fitz
+
+    try:
+        pix = fitz.Pixmap(image_bytes)
+    except Exception as e:
+        # 読み込めない形式の場合は元の画像をそのまま送信する
+        logger.warning(f"画像の前処理をスキップしました: {label} ({e})")
+        return PreparedImage(image_bytes, settings.format, 0, 0, len(image_bytes))
+    original_size = (pix.width, pix.height)
+    if not _enabled():
+        image_format = "jpeg" if image_bytes[:3] == b"\xff\xd8\xff" else "png"
+        return PreparedImage(image_bytes, image_format, pix.width, pix.height, len(image_bytes))
+
+    # 透過・グレースケール・CMYKなどはRGBに揃える
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace is None or pix.colorspace.n != 3:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+
+    if settings.crop:
+        pix = _crop(pix, settings.margin)
+
+    longest = max(pix.width, pix.height)
+    if settings.max_side and longest > settings.max_side:
+        scale = settings.max_side / longest
+        pix = fitz.Pixmap(pix, max(1, round(pix.width * scale)), max(1, round(pix.height * scale)), None)
+
+    if settings.format == "jpeg":
+        data = pix.tobytes("jpeg", jpg_quality=settings.quality)
+    else:
+        data = pix.tobytes("png")
+
+    if len(data) >= len(image_bytes) and (pix.width, pix.height) == original_size:
+        # 切り取り・縮小がなく再圧縮で大きくなる場合は元の画像を使用する
+        image_format = "jpeg" if image_bytes[:3] == b"\xff\xd8\xff" else "png"
+        data, settings = image_bytes, replace(settings, format=image_format)
+
+    logger.info(
+        f"画像前処理: {label} {original_size[0]}x{original_size[1]} {len(image_bytes)}B"
+        f" -> {pix.width}x{pix.height} {len(data)}B ({settings.format})"
+    )
+    return PreparedImage(data, settings.format, pix.width, pix.height, len(image_bytes))
+
+def prepare_image_file(image_path: str, profile: str = "evidence") -> PreparedImage:
+    """
+    画像ファイルを読み込んで前処理する
+    """
+    with open(image_path, "rb") as f:
+        return prepare_image(f.read(), profile, os.path.basename(image_path))
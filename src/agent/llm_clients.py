@@ -0,0 +1,149 @@
+"""
+プロセス全体で共有するモデルクライアント
+
+ChatOpenAIをモデル・パラメータごとに1つだけ生成し、HTTPクライアント（コネクションプール）も共有する。
+呼び出しごとにクライアントを生成すると毎回新しい接続が張られるため、同時実行時は keep-alive 接続を再利用する。
+非同期のコネクションプールは作成したイベントループに紐づくため、イベントループごとに作成する。
+応答キャッシュ（agent.response_cache）が有効な場合は全てのモデルに設定する。
+メッセージに含まれる artifact:// の参照（agent.artifact_store）は、リクエストの作成時にdata URLへ変換する。
+
+環境変数:
+    LLM_MAX_CONNECTIONS: HTTPコネクションプールの最大接続数（デフォルト: 100）
+    LLM_MAX_KEEPALIVE_CONNECTIONS: keep-alive で保持する接続数（デフォルト: 20）
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from agent.artifact_store import get_artifact_store
+from agent.metrics import record_llm_request, token_usage_callback
+from agent.response_cache import get_response_cache
+
+if TYPE_CHECKING:
+    # langchain_openai（openai SDK）は読み込みに時間がかかるため、最初のモデル作成時に読み込む
+    from langchain_openai import ChatOpenAI
+
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+_models: Dict[Tuple[str, Optional[float]], "ChatOpenAI"] = {}
+_chat_model_class: Optional[type] = None
+_lock = threading.Lock()
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20")),
+    )
+
+class _LoopLocalAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    実行中のイベントループごとにコネクションプールを持つトランスポート
+
+    ChatOpenAIは作成時の httpx.AsyncClient を使い続けるため、asyncio.run を繰り返す場合（バッチジョブ・ベンチマークなど）に
+    最初のループの接続を共有すると、閉じたループの接続でリクエストが失敗し、SDKの再試行で遅延する。
+    """
+
+    def __init__(self) -> None:
+        self._transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport]" = weakref.WeakKeyDictionary()
+        self._transports_lock = threading.Lock()
+
+    def _get_transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._transports_lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = httpx.AsyncHTTPTransport(limits=_limits())
+                self._transports[loop] = transport
+            return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._get_transport().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        # 他のループの接続はそのループでしか閉じられないため、実行中のループのプールのみ閉じる
+        with self._transports_lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+def get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    共有のHTTPクライアント（同期・非同期）を取得する
+    """
+    global _http_client, _http_async_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=_limits(), timeout=httpx.Timeout(600.0, connect=10.0))
+        if _http_async_client is None:
+            _http_async_client = httpx.AsyncClient(transport=_LoopLocalAsyncTransport(), timeout=httpx.Timeout(600.0, connect=10.0))
+        return _http_client, _http_async_client
+
+def _data_url_sizes(value: Any) -> List[int]:
+    """リクエストに含まれる画像のdata URLごとのバイト数（base64デコード後）を返す"""
+    if isinstance(value, str):
+        if value.startswith("data:image/") and ";base64," in value:
+            encoded = value.split(",", 1)[1]
+            return [len(encoded) * 3 // 4 - encoded[-2:].count("=")]
+        return []
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [size for item in value for size in _data_url_sizes(item)]
+    return []
+
+def _get_chat_model_class() -> type:
+    """
+    artifact:// の参照をリクエストの作成時にdata URLへ変換するChatOpenAIのサブクラスを取得する
+    """
+    global _chat_model_class
+    if _chat_model_class is None:
+        from langchain_openai import ChatOpenAI
+
+        class ArtifactChatOpenAI(ChatOpenAI):
+            def _get_request_payload(self, input_, *, stop=None, **kwargs):
+                payload = super()._get_request_payload(input_, stop=stop, **kwargs)
+                # Chat Completions API は messages、Responses API は input にメッセージが入る
+                store = get_artifact_store()
+                for key in ("messages", "input"):
+                    if key in payload:
+                        payload[key] = store.resolve(payload[key])
+                # リクエストの作成は応答キャッシュにヒットしなかった呼び出しのみで行われるため、ここで送信量を記録する
+                record_llm_request(_data_url_sizes([payload.get("messages"), payload.get("input")]))
+                return payload
+
+        _chat_model_class = ArtifactChatOpenAI
+    return _chat_model_class
+
+def get_chat_model(model: str, temperature: Optional[float] = None) -> "ChatOpenAI":
+    """
+    共有のChatOpenAIを取得する（モデル名・temperatureごとに1インスタンス）
+
+    Args:
+        model (str): モデル名
+        temperature (Optional[float]): temperature（未指定の場合はモデルのデフォルト）
+
+    Returns:
+        ChatOpenAI: 共有のモデルクライアント
+    """
+    key = (model, temperature)
+    with _lock:
+        if key in _models:
+            return _models[key]
+    http_client, http_async_client = get_http_clients()
+    kwargs = {
+        "model": model,
+        "http_client": http_client,
+        "http_async_client": http_async_client,
+        "cache": get_response_cache(),
+        "callbacks": [token_usage_callback],
+    }
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    chat_model = _get_chat_model_class()(**kwargs)
+    with _lock:
+        return _models.setdefault(key, chat_model)
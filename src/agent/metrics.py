@@ -0,0 +1,258 @@
+"""
+実行ごとの計測（ノードの所要時間・画像サイズ・トークン数・外部処理の所要時間）
+
+ノード関数に timed_node を付けると、実行時間を実行単位（LangGraphの run_id / thread_id）ごとに集計する。
+ノード内で行われる処理（画像前処理・モデル呼び出し・soffice / PyMuPDF による描画）も、
+同じ実行単位に記録される。集計結果は webapp.py の /metrics でJSON・Prometheusテキスト形式で取得できる。
+"""
+
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# 保持する実行単位の上限（古いものから破棄）
+MAX_RUNS = 100
+
+DEFAULT_RUN_ID = "default"
+
+# 応答キャッシュ（agent.response_cache）から返した生成結果の generation_info に設定するキー
+RESPONSE_CACHE_HIT_KEY = "response_cache_hit"
+
+_current_run: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("agent_metrics_run", default=None)
+
+@dataclass
+class TimerStat:
+    """所要時間の集計（回数・合計・最大）"""
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+@dataclass
+class RunMetrics:
+    """1実行分の計測結果"""
+
+    run_id: str
+    started_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    # (種別, 名前) -> 所要時間。種別は "node"（ノード）または "stage"（soffice・PDF描画などの処理）
+    timers: Dict[Tuple[str, str], TimerStat] = field(default_factory=dict)
+    counters: Dict[str, float] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "updated_at": self.updated_at,
+            "nodes": {},
+            "stages": {},
+            "counters": dict(self.counters),
+        }
+        for (kind, name), stat in self.timers.items():
+            result["nodes" if kind == "node" else "stages"][name] = {
+                "count": stat.count,
+                "total_seconds": round(stat.total, 6),
+                "max_seconds": round(stat.max, 6),
+            }
+        return result
+
+class MetricsRegistry:
+    """実行単位ごとの計測結果を保持するレジストリ"""
+
+    def __init__(self, max_runs: int = MAX_RUNS):
+        self.max_runs = max_runs
+        self._runs: "OrderedDict[str, RunMetrics]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _run(self, run_id: Optional[str]) -> RunMetrics:
+        run_id = run_id or current_run_id()
+        run = self._runs.get(run_id)
+        if run is None:
+            run = self._runs[run_id] = RunMetrics(run_id)
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+        else:
+            self._runs.move_to_end(run_id)
+        run.updated_at = time.time()
+        return run
+
+    def record_timing(self, kind: str, name: str, seconds: float, run_id: Optional[str] = None) -> None:
+        with self._lock:
+            run = self._run(run_id)
+            run.timers.setdefault((kind, name), TimerStat()).add(seconds)
+
+    def increment(self, name: str, value: float = 1, run_id: Optional[str] = None) -> None:
+        with self._lock:
+            run = self._run(run_id)
+            run.counters[name] = run.counters.get(name, 0) + value
+
+    def snapshot(self, run_id: Optional[str] = None) -> Dict[str, Any]:
+        """計測結果を辞書で返す（run_id を指定した場合はその実行のみ）"""
+        with self._lock:
+            if run_id is not None:
+                run = self._runs.get(run_id)
+                return run.to_dict() if run else {}
+            return {"runs": [run.to_dict() for run in self._runs.values()]}
+
+    def to_prometheus(self) -> str:
+        """計測結果をPrometheusのテキスト形式で返す"""
+        with self._lock:
+            runs = list(self._runs.values())
+        lines: List[str] = []
+        families = [
+            ("agent_node_duration_seconds", "node", "Wall time spent in graph nodes."),
+            ("agent_stage_duration_seconds", "stage", "Wall time spent in rendering and preprocessing stages."),
+        ]
+        for metric, kind, help_text in families:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} summary")
+            for run in runs:
+                for (timer_kind, name), stat in run.timers.items():
+                    if timer_kind != kind:
+                        continue
+                    labels = f'run_id="{_escape(run.run_id)}",{kind}="{_escape(name)}"'
+                    lines.append(f"{metric}_count{{{labels}}} {stat.count}")
+                    lines.append(f"{metric}_sum{{{labels}}} {stat.total:.6f}")
+        counter_names = sorted({name for run in runs for name in run.counters})
+        for name in counter_names:
+            metric = f"agent_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for run in runs:
+                if name in run.counters:
+                    lines.append(f'{metric}{{run_id="{_escape(run.run_id)}"}} {run.counters[name]:g}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._runs.clear()
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+registry = MetricsRegistry()
+
+def _run_id_from_config() -> Optional[str]:
+    try:
+        from langgraph.config import get_config
+        config = get_config()
+    except RuntimeError:
+        # グラフの実行中でない場合
+        return None
+    # 呼び出し時に指定した run_id（設定の最上位）を優先し、未指定の場合は thread_id で集計する
+    run_id = config.get("run_id") or (config.get("configurable") or {}).get("thread_id")
+    return str(run_id) if run_id else None
+
+def current_run_id() -> str:
+    """現在の実行単位のID（ノードの外では default）"""
+    return _current_run.get() or _run_id_from_config() or DEFAULT_RUN_ID
+
+def timed_node(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """
+    ノード関数の実行時間を記録するデコレーター（同期・非同期関数に対応）
+
+    Args:
+        name (Optional[str]): 記録するノード名（未指定の場合は関数名）
+    """
+
+    def decorator(func: Callable) -> Callable:
+        node_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                token = _current_run.set(current_run_id())
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    registry.record_timing("node", node_name, time.perf_counter() - start)
+                    _current_run.reset(token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _current_run.set(current_run_id())
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.record_timing("node", node_name, time.perf_counter() - start)
+                _current_run.reset(token)
+        return wrapper
+
+    return decorator
+
+@contextmanager
+def timed_stage(name: str) -> Iterator[None]:
+    """soffice・PDF描画などの処理の所要時間を記録するコンテキストマネージャー"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.record_timing("stage", name, time.perf_counter() - start)
+
+def record_image(original_bytes: int, prepared_bytes: int) -> None:
+    """前処理した画像のサイズ（前処理前・後）を記録する（送信したかどうかは record_llm_request で記録する）"""
+    registry.increment("images_prepared")
+    registry.increment("image_bytes_original", original_bytes)
+    registry.increment("image_bytes_prepared", prepared_bytes)
+
+def record_llm_request(image_bytes: List[int]) -> None:
+    """
+    モデルへのリクエスト（応答キャッシュにヒットせず実際に送信した呼び出し）と、リクエストに含めた画像のサイズを記録する
+
+    Args:
+        image_bytes (List[int]): リクエストに含めた画像ごとのバイト数（base64デコード後）
+    """
+    registry.increment("llm_calls")
+    if image_bytes:
+        registry.increment("images_sent", len(image_bytes))
+        registry.increment("image_bytes_sent", sum(image_bytes))
+
+def record_pdf_page(modality: str, text_bytes: int, text_tokens: int, image_tokens: int) -> None:
+    """PDFページの送信方法（テキスト / 画像）と、テキストで送信した場合の削減量（概算）を記録する"""
+    registry.increment(f"pdf_pages_{modality}")
+    if modality == "text":
+        registry.increment("pdf_text_bytes", text_bytes)
+        registry.increment("pdf_text_tokens_est", text_tokens)
+        registry.increment("pdf_image_tokens_avoided_est", image_tokens)
+
+def record_pdf_selection(page_count: int, selected_count: int) -> None:
+    """PDFのページ数と、監査手続きとの関連度で最初のメッセージに含めたページ数を記録する"""
+    registry.increment("pdf_pages_indexed", page_count)
+    registry.increment("pdf_pages_selected", selected_count)
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    モデル呼び出しのトークン数を記録するコールバック
+
+    応答キャッシュから返した結果はトークンを消費していないため、件数（llm_cache_hits）のみ記録する。
+    呼び出し回数はリクエストの作成時に record_llm_request で記録する。
+    """
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                if (generation.generation_info or {}).get(RESPONSE_CACHE_HIT_KEY):
+                    registry.increment("llm_cache_hits")
+                    continue
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    registry.increment("llm_prompt_tokens", usage.get("input_tokens", 0))
+                    registry.increment("llm_completion_tokens", usage.get("output_tokens", 0))
+
+token_usage_callback = TokenUsageCallback()
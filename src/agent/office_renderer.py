@@ -0,0 +1,320 @@
+"""
+常駐型LibreOfficeレンダリングサービス（sofficeプロセスのプール）
+
+sofficeをジョブごとに起動すると毎回数秒のコールドスタートが発生するため、
+ヘッドレスのsofficeをワーカーとして常駐させ、ローカルのパイプ（UNO）経由で変換ジョブを受け付ける。
+UNOのPythonバインディング（python3-uno・LibreOffice同梱のPython）が利用できない環境（通常のvenvなど）では、
+ジョブごとに soffice --convert-to を実行するCLI変換にフォールバックする。
+この場合はジョブごとにsofficeが起動するため、コールドスタートの削減効果はない
+（ワーカーごとの専用プロファイルにより、並列実行時のプロファイルの競合を避けるのみ）。
+
+環境変数:
+    SOFFICE_PATH: sofficeの実行ファイル（デフォルト: soffice）
+    OFFICE_POOL_SIZE: ワーカー数（デフォルト: 2）
+    OFFICE_JOB_TIMEOUT: 1ジョブあたりのタイムアウト秒数（デフォルト: 120）
+    OFFICE_START_TIMEOUT: ワーカー起動待ちのタイムアウト秒数（デフォルト: 60）
+"""
+
+import atexit
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    _UNO_AVAILABLE = True
+except ImportError:
+    _UNO_AVAILABLE = False
+
+class OfficeRenderError(RuntimeError):
+    """sofficeによる変換に失敗した場合の例外"""
+
+def _props(**kwargs) -> tuple:
+    """UNOのPropertyValueのタプルを作成する"""
+    values = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        values.append(prop)
+    return tuple(values)
+
+class OfficeWorker:
+    """
+    1つのヘッドレスsofficeプロセスを保持するワーカー
+    """
+
+    def __init__(self, worker_id: int, soffice_path: str, start_timeout: float):
+        self.worker_id = worker_id
+        self.soffice_path = soffice_path
+        self.start_timeout = start_timeout
+        self.profile_dir = Path(tempfile.mkdtemp(prefix=f"office_worker_{worker_id}_"))
+        self.pipe_name = f"agent_office_{os.getpid()}_{worker_id}_{uuid.uuid4().hex[:8]}"
+        self.process: Optional[subprocess.Popen] = None
+        self.desktop = None
+
+    @property
+    def profile_url(self) -> str:
+        return self.profile_dir.resolve().as_uri()
+
+    def start(self) -> None:
+        """sofficeを起動し、UNO接続を確立する（UNOが利用できない場合は何もしない）"""
+        if not _UNO_AVAILABLE:
+            return
+        command = [
+            self.soffice_path,
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--norestore",
+            "--nodefault",
+            f"-env:UserInstallation={self.profile_url}",
+            f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext",
+        ]
+        logger.info(f"sofficeワーカー {self.worker_id} を起動します")
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        local_ctx = uno.getComponentContext()
+        resolver = local_ctx.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_ctx)
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            try:
+                ctx = resolver.resolve(f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext")
+                self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+                logger.info(f"sofficeワーカー {self.worker_id} の接続が完了しました")
+                return
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise OfficeRenderError(f"sofficeワーカー {self.worker_id} の起動に失敗しました")
+                time.sleep(0.2)
+
+    def stop(self) -> None:
+        """sofficeプロセスを終了する"""
+        self.desktop = None
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"sofficeワーカー {self.worker_id} の終了待ちがタイムアウトしました")
+        self.process = None
+
+    def restart(self) -> None:
+        """sofficeを再起動する"""
+        logger.warning(f"sofficeワーカー {self.worker_id} を再起動します")
+        self.stop()
+        self.start()
+
+    def close(self) -> None:
+        """ワーカーを破棄し、プロファイルを削除する"""
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def is_healthy(self, timeout: float = 5.0) -> bool:
+        """ヘルスチェック: プロセスが生存し、UNO呼び出しに応答するか（CLI変換では常駐プロセスがないため常にTrue）"""
+        if not _UNO_AVAILABLE:
+            return True
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self._call_with_timeout(lambda: self.desktop.getFrames(), timeout)
+            return True
+        except Exception:
+            return False
+
+    def _call_with_timeout(self, func, timeout: float):
+        """
+        UNO呼び出しをタイムアウト付きで実行する
+
+        ハングした場合はsofficeプロセスを終了してTimeoutErrorを送出する。
+        プロセスの終了でUNOブリッジが切断され、呼び出し中のスレッドも例外で終了する。
+        """
+        result: dict = {}
+
+        def target():
+            try:
+                result["value"] = func()
+            except Exception as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            self.stop()
+            thread.join(10)
+            if thread.is_alive():
+                logger.error(f"sofficeワーカー {self.worker_id} のUNO呼び出しがプロセスの終了後も戻りません")
+            raise TimeoutError(f"sofficeワーカー {self.worker_id} が {timeout} 秒以内に応答しませんでした")
+        if "error" in result:
+            raise result["error"]
+        return result.get("value")
+
+    def convert_to_png(self, input_path: str, outdir: str, timeout: float) -> str:
+        """
+        ファイルをPNGに変換する（出力ファイル名は soffice --convert-to png と同じ <basename>.png）
+
+        Returns:
+            str: 出力したPNGファイルのパス
+        """
+        output_path = Path(outdir) / f"{Path(input_path).stem}.png"
+        if not _UNO_AVAILABLE:
+            command = [
+                self.soffice_path,
+                "--headless",
+                f"-env:UserInstallation={self.profile_url}",
+                "--convert-to",
+                "png",
+                str(input_path),
+                "--outdir",
+                str(outdir),
+            ]
+            logger.info(f"実行コマンド: {' '.join(command)}")
+            try:
+                subprocess.run(command, check=True, timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except subprocess.TimeoutExpired:
+                raise TimeoutError(f"sofficeの変換が {timeout} 秒以内に完了しませんでした: {input_path}")
+            except subprocess.CalledProcessError as e:
+                raise OfficeRenderError(f"sofficeの変換に失敗しました: {input_path} ({e})")
+            return str(output_path)
+
+        def convert():
+            doc = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(os.path.abspath(input_path)), "_blank", 0, _props(Hidden=True, ReadOnly=True)
+            )
+            try:
+                doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(output_path)), _props(FilterName="calc_png_Export"))
+            finally:
+                doc.close(True)
+
+        self._call_with_timeout(convert, timeout)
+        return str(output_path)
+
+class _Job:
+    def __init__(self, input_path: str, outdir: str, timeout: float):
+        self.input_path = input_path
+        self.outdir = outdir
+        self.timeout = timeout
+        self.future: Future = Future()
+
+class OfficeRenderPool:
+    """
+    sofficeワーカーのプール。ジョブはキューに積まれ、空いているワーカーが順に処理する。
+    """
+
+    def __init__(self, size: int = 2, job_timeout: float = 120.0, soffice_path: str = "soffice", start_timeout: float = 60.0):
+        self.size = max(1, size)
+        self.job_timeout = job_timeout
+        self.soffice_path = soffice_path
+        self.start_timeout = start_timeout
+        self._jobs: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self._threads = []
+        self._workers = []
+        self._closed = False
+        for worker_id in range(self.size):
+            worker = OfficeWorker(worker_id, soffice_path, start_timeout)
+            thread = threading.Thread(target=self._run_worker, args=(worker,), name=f"office-worker-{worker_id}", daemon=True)
+            self._workers.append(worker)
+            self._threads.append(thread)
+            thread.start()
+        mode = "UNO" if _UNO_AVAILABLE else "CLI"
+        logger.info(f"sofficeレンダリングプールを開始しました (ワーカー数: {self.size}, モード: {mode})")
+        if not _UNO_AVAILABLE:
+            logger.warning("UNOが利用できないため、ジョブごとにsofficeを起動して変換します（常駐プロセスによる高速化は無効）")
+
+    def _run_worker(self, worker: OfficeWorker) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                if not worker.is_healthy():
+                    worker.restart()
+                job.future.set_result(worker.convert_to_png(job.input_path, job.outdir, job.timeout))
+            except TimeoutError as e:
+                # ハングしたプロセスは終了済み。次のジョブの前に再起動する
+                logger.error(str(e))
+                job.future.set_exception(e)
+            except Exception as e:
+                job.future.set_exception(e)
+        worker.close()
+
+    def submit(self, input_path: str, outdir: str, timeout: Optional[float] = None) -> Future:
+        """
+        変換ジョブをキューに追加する
+
+        Returns:
+            Future: 完了すると出力PNGのパスを返すFuture
+        """
+        if self._closed:
+            raise OfficeRenderError("sofficeレンダリングプールは終了しています")
+        job = _Job(input_path, outdir, timeout or self.job_timeout)
+        self._jobs.put(job)
+        return job.future
+
+    def convert_to_png(self, input_path: str, outdir: str, timeout: Optional[float] = None) -> str:
+        """
+        ファイルをPNGに変換し、完了まで待機する
+
+        Returns:
+            str: 出力したPNGファイルのパス
+        """
+        return self.submit(input_path, outdir, timeout).result()
+
+    def shutdown(self) -> None:
+        """全ワーカーを終了する"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join(timeout=10)
+
+_pool: Optional[OfficeRenderPool] = None
+_pool_lock = threading.Lock()
+
+def get_office_pool() -> OfficeRenderPool:
+    """
+    プロセス全体で共有するsofficeレンダリングプールを取得する
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OfficeRenderPool(
+                size=int(os.getenv("OFFICE_POOL_SIZE", "2")),
+                job_timeout=float(os.getenv("OFFICE_JOB_TIMEOUT", "120")),
+                soffice_path=os.getenv("SOFFICE_PATH", "soffice"),
+                start_timeout=float(os.getenv("OFFICE_START_TIMEOUT", "60")),
+            )
+            atexit.register(_pool.shutdown)
+        return _pool
+
+def convert_to_png(input_path: str, outdir: str, timeout: Optional[float] = None) -> str:
+    """
+    共有プールを使用してファイルをPNGに変換する
+
+    Args:
+        input_path (str): 変換元ファイルのパス
+        outdir (str): 出力ディレクトリ
+        timeout (Optional[float]): ジョブのタイムアウト秒数（未指定の場合はプールの設定値）
+
+    Returns:
+        str: 出力したPNGファイルのパス
+    """
+    return get_office_pool().convert_to_png(input_path, outdir, timeout)
@@ -0,0 +1,205 @@
+"""
+PDFページの画像化結果のディスクキャッシュ（LRU）
+
+キーはファイル内容のハッシュ・ページ番号・描画パラメータ。
+キャッシュは並列実行のサンプル・バッチジョブで共有するため、読み込む直前に他のワーカーが削除した場合は描画し直す。
+LRU削除は書き込んだバイト数の累計が上限を超えた場合のみ行い、上限の EVICT_TARGET_RATIO まで減らす
+（累計はプロセス内の概算で、削除の際に走査して補正する）。
+全ページのテキストレイヤーもPDFごとに1ファイルでキャッシュするため、同じ証跡を再監査する場合はPyMuPDFでPDFを開かずに済む。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from agent.disk_cache import cache_size, evict_lru, file_sha256, touch
+from agent.metrics import timed_stage
+from agent.pdf_text import PageText, extract_page_text
+
+logger = logging.getLogger(__name__)
+
+# 上限を超えた場合に削除後の合計を上限の何割まで減らすか（毎回の書き込みで走査しないよう余裕を持たせる）
+EVICT_TARGET_RATIO = 0.9
+
+class PageRenderCache:
+    """
+    PDFページのPNG画像をディスクにキャッシュするクラス
+
+    Args:
+        cache_dir (str): キャッシュディレクトリ
+        max_bytes (int): キャッシュ全体の合計バイト数の上限（0以下の場合は無制限）
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 0):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._hash_memo: Dict[Tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+        self._size_lock = threading.Lock()
+        # 書き込んだバイト数を加えたキャッシュ全体の合計（最初の書き込みで走査して初期化する）
+        self._total_bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hits: int = 0, misses: int = 0) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def _added(self, size: int) -> None:
+        """書き込んだバイト数を合計に加え、上限を超えた場合のみLRU削除する"""
+        if self.max_bytes <= 0:
+            return
+        with self._size_lock:
+            if self._total_bytes is None:
+                self._total_bytes = cache_size(self.cache_dir)
+            else:
+                self._total_bytes += size
+            if self._total_bytes <= self.max_bytes:
+                return
+            try:
+                evict_lru(self.cache_dir, max_bytes=int(self.max_bytes * EVICT_TARGET_RATIO))
+            except OSError as e:
+                logger.warning(f"PDFページキャッシュの整理に失敗しました: {self.cache_dir} ({e})")
+            self._total_bytes = cache_size(self.cache_dir)
+
+    def _file_hash(self, pdf_path: str) -> str:
+        """ファイル内容のハッシュを返す（パス・サイズ・更新時刻が同じ場合は再計算しない）"""
+        stat = os.stat(pdf_path)
+        memo_key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if memo_key in self._hash_memo:
+                return self._hash_memo[memo_key]
+        digest = file_sha256(pdf_path)
+        with self._lock:
+            self._hash_memo[memo_key] = digest
+        return digest
+
+    def _page_path(self, file_hash: str, page_index: int, dpi: Optional[int]) -> Path:
+        params = f"{file_hash}:{page_index}:dpi={dpi or 'default'}:png"
+        return self.cache_dir / f"{hashlib.sha256(params.encode('utf-8')).hexdigest()}.png"
+
+    def _text_path(self, file_hash: str) -> Path:
+        params = f"{file_hash}:text"
+        return self.cache_dir / f"{hashlib.sha256(params.encode('utf-8')).hexdigest()}.text.json"
+
+    def _write_atomic(self, path: Path, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def render_page(self, pdf_path: str, page_index: int, dpi: Optional[int] = None) -> bytes:
+        """
+        PDFの1ページをPNGバイト列で返す（キャッシュにない場合のみPyMuPDFで描画）
+        """
+        page_path = self._page_path(self._file_hash(pdf_path), page_index, dpi)
+        try:
+            image_bytes = page_path.read_bytes()
+        except OSError:
+            # キャッシュにない（または他のワーカーが削除した）場合は描画する
+            pass
+        else:
+            touch(page_path)
+            self._count(hits=1)
+            return image_bytes
+        image_bytes = _render_page(pdf_path, page_index, dpi)
+        self._write_atomic(page_path, image_bytes)
+        self._count(misses=1)
+        self._added(len(image_bytes))
+        return image_bytes
+
+    def page_texts(self, pdf_path: str) -> List[PageText]:
+        """
+        PDFの全ページのテキストレイヤーを返す（キャッシュにない場合はPDFを1回だけ開いて抽出）
+        """
+        text_path = self._text_path(self._file_hash(pdf_path))
+        try:
+            with open(text_path, "r", encoding="utf-8") as f:
+                page_texts = [PageText.from_dict(item) for item in json.load(f)]
+        except FileNotFoundError:
+            # キャッシュにない（または他のワーカーが削除した）場合は抽出する
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning(f"PDFテキストのキャッシュを読み込めないため再抽出します: {pdf_path}")
+        else:
+            touch(text_path)
+            self._count(hits=len(page_texts))
+            return page_texts
+
+        page_texts = _extract_texts(pdf_path)
+        data = json.dumps([page_text.to_dict() for page_text in page_texts], ensure_ascii=False).encode("utf-8")
+        self._write_atomic(text_path, data)
+        self._count(misses=len(page_texts))
+        self._added(len(data))
+        return page_texts
+
+def _open_pdf(pdf_path: str):
+    """PyMuPDFでPDFを開く（PyMuPDFは読み込みに時間がかかるため、最初に使用する時点で読み込む）"""
+    import fitz
+
+    return fitz.open(pdf_path)
+
+def _render_page(pdf_path: str, page_index: int, dpi: Optional[int] = None) -> bytes:
+    """PyMuPDFでPDFの1ページをPNGバイト列に変換する"""
+    with timed_stage("pdf_render"):
+        doc = _open_pdf(pdf_path)
+        try:
+            pix = doc[page_index].get_pixmap(dpi=dpi) if dpi else doc[page_index].get_pixmap()
+            return pix.tobytes("png")
+        finally:
+            doc.close()
+
+def _extract_texts(pdf_path: str) -> List[PageText]:
+    """PyMuPDFでPDFの全ページのテキストレイヤーを抽出する"""
+    with timed_stage("pdf_text"):
+        doc = _open_pdf(pdf_path)
+        try:
+            return [extract_page_text(page) for page in doc]
+        finally:
+            doc.close()
+
+_caches: Dict[Tuple[str, int], PageRenderCache] = {}
+_caches_lock = threading.Lock()
+
+def get_page_cache(cache_dir: str, max_bytes: int = 0) -> PageRenderCache:
+    """
+    キャッシュディレクトリごとに共有するPageRenderCacheを取得する
+    """
+    key = (os.path.abspath(cache_dir), max_bytes)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = PageRenderCache(cache_dir, max_bytes)
+        return _caches[key]
+
+def render_pdf_page(
+    pdf_path: str,
+    page_index: int,
+    cache: Optional[PageRenderCache] = None,
+    dpi: Optional[int] = None,
+) -> bytes:
+    """
+    PDFの1ページをPNGバイト列に変換する（キャッシュが指定されていればキャッシュを使用）
+    """
+    if cache is not None:
+        return cache.render_page(pdf_path, page_index, dpi)
+    return _render_page(pdf_path, page_index, dpi)
+
+def pdf_page_texts(pdf_path: str, cache: Optional[PageRenderCache] = None) -> List[PageText]:
+    """
+    PDFの全ページのテキストレイヤーを抽出する（キャッシュが指定されていればキャッシュを使用）
+    """
+    if cache is not None:
+        return cache.page_texts(pdf_path)
+    return _extract_texts(pdf_path)
@@ -0,0 +1,86 @@
+"""
+監査手続きとの関連度によるPDFページの選択
+
+PDFのテキストレイヤーをページ単位で索引化し（英数字は単語、日本語などは文字bigram）、
+監査手続きの文をクエリとしてBM25で各ページのスコアを計算する。スコアの上位のページのみを最初のメッセージに含め、
+残りのページは analyze_image_tool で必要になった時点で参照する。外部の検索エンジン・埋め込みモデルは使用しない。
+"""
+
+import math
+import re
+from collections import Counter
+from typing import List, Sequence
+
+# 英数字の単語、またはそれ以外の文字（日本語など）の並び（記号・空白で区切る）
+_WORD_PATTERN = re.compile(r"[a-z0-9]+|[^\W_a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    テキストを索引語に分割する（英数字は単語、それ以外の文字の並びは2文字ずつ）
+    """
+    tokens: List[str] = []
+    for run in _WORD_PATTERN.findall(text.lower()):
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class PageIndex:
+    """
+    ページのテキストのBM25索引
+
+    Args:
+        texts (Sequence[str]): ページごとのテキスト
+        k1 (float): 語の出現回数の飽和度
+        b (float): 文書長の正規化の強さ
+    """
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.pages = [Counter(tokenize(text)) for text in texts]
+        self.lengths = [sum(page.values()) for page in self.pages]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.document_frequency: Counter = Counter()
+        for page in self.pages:
+            self.document_frequency.update(page.keys())
+
+    def scores(self, query: str) -> List[float]:
+        """クエリに対するページごとのスコア（テキストのないページは0）"""
+        terms = set(tokenize(query))
+        count = len(self.pages)
+        results: List[float] = []
+        for page, length in zip(self.pages, self.lengths):
+            score = 0.0
+            for term in terms:
+                tf = page.get(term, 0)
+                if not tf:
+                    continue
+                df = self.document_frequency[term]
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                norm = 1 - self.b + self.b * (length / self.avg_length if self.avg_length else 0.0)
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+            results.append(score)
+        return results
+
+def select_pages(texts: Sequence[str], query: str, top_k: int) -> List[int]:
+    """
+    クエリとの関連度が高いページを選択する
+
+    先頭ページ（表題・日付・当事者などが記載されることが多い）は常に含め、残りをスコアの高い順に選ぶ。
+    スコアが同じ場合（クエリが空・テキストレイヤーがない場合を含む）はページ順に選ぶ。
+
+    Args:
+        texts (Sequence[str]): ページごとのテキスト
+        query (str): 監査手続き
+        top_k (int): 選択するページ数（0以下の場合は全ページ）
+
+    Returns:
+        List[int]: 選択したページ番号（0始まり、ページ順）
+    """
+    if top_k <= 0 or len(texts) <= top_k:
+        return list(range(len(texts)))
+    scores = PageIndex(texts).scores(query) if query else [0.0] * len(texts)
+    ranked = sorted(range(1, len(texts)), key=lambda idx: (-scores[idx], idx))
+    return sorted([0, *ranked[:top_k - 1]])
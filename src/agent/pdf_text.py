@@ -0,0 +1,161 @@
+"""
+PDFページの送信方法（テキスト / 画像）の選択
+
+PDFのページごとにPyMuPDFのテキストレイヤー（ブロック単位のレイアウト順）を抽出し、
+テキストが十分に取得できるページはテキストとしてメッセージに含め、スキャン画像のページやテキストの少ないページのみ画像で送信する。
+テキストとして送信したページも analyze_image_tool で画像として参照できる。
+
+環境変数:
+    PDF_TEXT_MIN_CHARS: テキストとして送信するページの最小文字数（空白を除く、デフォルト: 40）
+    PDF_TEXT_MAX_IMAGE_COVERAGE: テキストとして送信するページの画像の面積の割合の上限（デフォルト: 0.5）
+    PDF_TEXT_MAX_GARBLED_RATIO: テキストとして送信するページの文字化け（置換文字・私用領域の文字）の割合の上限（デフォルト: 0.05）
+    PDF_RENDER_GLYPH_PX: 画像で送信するページの文字の高さの目安（ピクセル、デフォルト: 14）
+    PDF_RENDER_SCAN_DPI: テキストレイヤーのないページ（スキャン画像）の描画解像度（デフォルト: 150）
+    PDF_RENDER_MAX_DPI: 描画解像度の上限（デフォルト: 200）
+"""
+
+import math
+import os
+import statistics
+from dataclasses import dataclass
+from typing import Any, Dict, Literal, Optional, Tuple
+
+# PyMuPDFの get_pixmap() のデフォルトの解像度
+BASE_DPI = 72
+
+@dataclass
+class PageText:
+    """PDF1ページ分のテキストレイヤー"""
+
+    text: str
+    width: float
+    height: float
+    image_coverage: float
+    font_size: float = 0.0
+
+    @property
+    def chars(self) -> int:
+        return sum(not ch.isspace() for ch in self.text)
+
+    @property
+    def garbled_ratio(self) -> float:
+        chars = [ch for ch in self.text if not ch.isspace()]
+        if not chars:
+            return 0.0
+        garbled = sum(ch == "\ufffd" or 0xE000 <= ord(ch) <= 0xF8FF for ch in chars)
+        return garbled / len(chars)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "text": self.text,
+            "width": self.width,
+            "height": self.height,
+            "image_coverage": self.image_coverage,
+            "font_size": self.font_size,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PageText":
+        return cls(
+            text=data["text"],
+            width=data["width"],
+            height=data["height"],
+            image_coverage=data["image_coverage"],
+            font_size=data.get("font_size", 0.0),
+        )
+
+def extract_page_text(page: Any) -> PageText:
+    """
+    PyMuPDFのページからテキストをレイアウト順（ブロック単位）に抽出する
+
+    Args:
+        page (fitz.Page): PDFのページ
+
+    Returns:
+        PageText: テキストと、ページ上の画像の面積の割合・文字サイズ（中央値）
+    """
+    # テキストブロック（block_type == 0）を上から順に並べる
+    blocks = [block[4].strip() for block in page.get_text("blocks", sort=True) if block[6] == 0]
+    rect = page.rect
+    page_area = rect.width * rect.height
+    image_area = 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        x0, y0, x1, y1 = max(x0, rect.x0), max(y0, rect.y0), min(x1, rect.x1), min(y1, rect.y1)
+        image_area += max(x1 - x0, 0) * max(y1 - y0, 0)
+    coverage = min(image_area / page_area, 1.0) if page_area > 0 else 0.0
+    sizes = [
+        span["size"]
+        for block in page.get_text("dict")["blocks"]
+        for line in block.get("lines", [])
+        for span in line["spans"]
+        if span["text"].strip()
+    ]
+    return PageText(
+        text="\n".join(block for block in blocks if block),
+        width=rect.width,
+        height=rect.height,
+        image_coverage=coverage,
+        font_size=statistics.median(sizes) if sizes else 0.0,
+    )
+
+def select_modality(page_text: PageText, mode: str = "auto") -> Tuple[Literal["text", "image"], str]:
+    """
+    ページをテキスト・画像のどちらで送信するか決定する
+
+    Args:
+        page_text (PageText): ページのテキストレイヤー
+        mode (str): auto（テキストレイヤーの品質で判定） / image（常に画像） / text（テキストがあれば常にテキスト）
+
+    Returns:
+        Tuple[Literal["text", "image"], str]: 送信方法と判定理由
+    """
+    if mode == "image":
+        return "image", "画像モード"
+    if page_text.chars == 0:
+        return "image", "テキストレイヤーなし"
+    if mode == "text":
+        return "text", "テキストモード"
+    min_chars = int(os.getenv("PDF_TEXT_MIN_CHARS", "40"))
+    if page_text.chars < min_chars:
+        return "image", f"テキストが少ない（{page_text.chars}文字）"
+    if page_text.garbled_ratio > float(os.getenv("PDF_TEXT_MAX_GARBLED_RATIO", "0.05")):
+        return "image", f"文字化け（{page_text.garbled_ratio:.0%}）"
+    if page_text.image_coverage > float(os.getenv("PDF_TEXT_MAX_IMAGE_COVERAGE", "0.5")):
+        return "image", f"画像の割合が大きい（{page_text.image_coverage:.0%}）"
+    return "text", "テキストレイヤーあり"
+
+def pick_dpi(page_text: PageText) -> Optional[int]:
+    """
+    ページを画像で送信する場合の描画解像度を決定する（文字の小さいページ・スキャン画像は高い解像度で描画する）
+
+    Returns:
+        Optional[int]: 描画解像度（デフォルトの解像度で十分な場合はNone）
+    """
+    max_dpi = int(os.getenv("PDF_RENDER_MAX_DPI", "200"))
+    if page_text.chars == 0 or page_text.font_size <= 0:
+        dpi = int(os.getenv("PDF_RENDER_SCAN_DPI", "150"))
+    else:
+        # 文字サイズ（ポイント）が目安のピクセル数で描画される解像度
+        dpi = round(BASE_DPI * float(os.getenv("PDF_RENDER_GLYPH_PX", "14")) / page_text.font_size)
+    dpi = min(dpi, max_dpi)
+    return dpi if dpi > BASE_DPI else None
+
+def estimate_image_tokens(width: float, height: float, max_side: int = 1600, dpi: Optional[int] = None) -> int:
+    """
+    画像1枚の入力トークン数の概算（OpenAIの detail=high の計算方法: 512pxタイルごとに170 + 85）
+    """
+    if width <= 0 or height <= 0:
+        return 0
+    width, height = width * (dpi or BASE_DPI) / BASE_DPI, height * (dpi or BASE_DPI) / BASE_DPI
+    # 前処理で長辺を max_side に縮小し、APIで2048px以内・短辺768pxに縮小される
+    scale = min(1.0, max_side / max(width, height), 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def estimate_text_tokens(text: str) -> int:
+    """テキストの入力トークン数の概算（ASCIIは4文字で1トークン、それ以外は1文字1トークン）"""
+    ascii_chars = sum(ch.isascii() for ch in text)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
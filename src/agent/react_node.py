@@ -1,27 +1,27 @@
-from langgraph.prebuilt import create_react_agent
 from pydantic import BaseModel, Field
 from agent.state import State
-from langchain_core.runnables import RunnableConfig
-from typing import Any, Dict, Sequence, TypedDict, Union
+from langchain_core.runnables import RunnableConfig, ensure_config
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple, TypedDict, Union
 from langgraph.types import Command
 from langchain_core.messages import ToolMessage, HumanMessage, BaseMessage
-import langchain
-from langchain_community.tools import tool
-from langchain_openai import ChatOpenAI
-
-from langgraph.prebuilt.interrupt import (
-    ActionRequest,
-    HumanInterrupt,
-    HumanInterruptConfig,
-    HumanResponse,
-)
+from langchain_core.tools import StructuredTool
+
 from langgraph.types import interrupt
-import httpx
+import asyncio
 import base64
 import os
-import fitz
 import logging
+import threading
+import weakref
 
+from agent.artifact_store import get_artifact_store
+from agent.image_prep import PreparedImage
+from agent.llm_clients import get_chat_model
+from agent.metrics import timed_node
+from agent.page_cache import PageRenderCache, get_page_cache
+from agent.results_log import get_results_log, new_results_log_path
+from agent.sample_loader import SampleEvidence, describe_images, load_sample_evidence
 from langgraph.graph.message import add_messages
 from langgraph.managed import IsLastStep, RemainingSteps
 from typing_extensions import Annotated
@@ -55,6 +55,9 @@ def query_to_human(query: str, purpose: str) -> str:
     return:
         str: 問い合わせ結果
     """
+    # langgraph.prebuilt はReActエージェントの実装ごと読み込まれるため、使用時に読み込む
+    from langgraph.prebuilt.interrupt import ActionRequest, HumanInterrupt, HumanInterruptConfig, HumanResponse
+
     action_request = ActionRequest(
         action="Confirm Message",
         args={"message": query},
@@ -88,6 +91,12 @@ def query_to_human(query: str, purpose: str) -> str:
     
     return message
 
+async def aquery_to_human(query: str, purpose: str) -> str:
+    """query_to_human の非同期版（interrupt は実行中のグラフのコンテキストで処理される）"""
+    return query_to_human(query, purpose)
+
+query_to_human_tool = StructuredTool.from_function(func=query_to_human, coroutine=aquery_to_human)
+
 def get_base64_from_image(image_path: str) -> str:
     """
     画像ファイルを読み込み、base64エンコードされた文字列を返す関数
@@ -101,100 +110,339 @@ def get_base64_from_image(image_path: str) -> str:
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
-def react_node(state: State, config: RunnableConfig) -> Dict[str, Any]:
-    # Increment iteration count
-    current_iteration = int(state.iteration_count) + 1
-    logger.info(f"--- Iteration {current_iteration}/{state.max_iterations} ---")
+# 並列実行時の同時実行数制御用セマフォ（実行ごとに作成し、その実行のブランチがすべて終了したら破棄）
+# 実行キー -> [セマフォ, 使用中のブランチ数]
+_sample_semaphores: Dict[str, list] = {}
+_sample_semaphores_lock = threading.Lock()
 
-    if state.sample_data_path:
-        data_path = os.path.join("C:\\Users\\nyham\\work\\sampletest_3\\agent-inbox-langgraph-example\\data\\sample",state.sample_data_path)
-        sample_num = len(os.listdir(data_path))
+@contextmanager
+def _sample_slot(run_key: str, limit: int) -> Iterator[None]:
+    """
+    実行ごとの同時実行数の上限で1サンプル分の枠を確保するコンテキストマネージャー
 
-    image_data = []
-    txt_data = []
-    if state.sample_data_path:
-        sample_data = os.listdir(data_path)[current_iteration-1]
-        logger.info(f"sample_data: {sample_data}")
-        for file in os.listdir(os.path.join(data_path, sample_data)):
-            file_path = os.path.join(data_path, sample_data, file)
-            logger.info(f"file_path: {file_path}")
-            if file.endswith(".pdf"):
-                # PyMuPDFでPDFをページごとに画像化
-                doc = fitz.open(file_path)
-                logger.info(f"doc_length: {len(doc)}")
-                for page in doc[:5]:
-                    pix = page.get_pixmap()
-                    # メモリ上でPNGバイト列に変換
-                    image_bytes = pix.tobytes("png")
-                    # base64エンコード
-                    image_data.append(base64.b64encode(image_bytes).decode("utf-8"))
-                doc.close()
-            elif file.endswith(".jpg") or file.endswith(".png"):
-                image_data.append(get_base64_from_image(file_path))
-            else:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    txt_data.append(f.read())
-                
-    # analyze_image_tool を react_node のスコープ内で定義し、image_data をクロージャでキャプチャ
-    @tool
-    def analyze_image_tool(image_data_num: int, query: str) -> str:
-        """
-        画像データを分析する。何枚目の画像について、何を確認したいか明確に伝えることが必要。
-        arg:
-            image_data_num: 何枚目の画像について知りたいか数字で指定 (1-indexed)
-            query: 確認したい内容
-        return:
-            str: 分析結果
-        """
-        nonlocal image_data # react_node スコープの image_data を参照
-        if not image_data or not (0 < image_data_num <= len(image_data)):
-            return "指定された番号の画像データが見つからないか、番号が範囲外です。"
-        
-        image_data_base64 = image_data[image_data_num-1]
-        
-        llm_for_tool = ChatOpenAI(model="gpt-4.1-mini") 
-        tool_message_content = HumanMessage(
-            content=[
-                {"type": "text", "text": query},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data_base64}"}}
-            ]
-        )
-        result = llm_for_tool.invoke([tool_message_content])
-        # print(f"analyze_image_tool result: {result.content}") # デバッグ用
-        return result.content
-
-    agent = create_react_agent(
-        model="gpt-4.1-mini",
-        tools=[query_to_human, analyze_image_tool],
-        prompt="必ず日本語で回答してください。監査人として手続きを実施してください。情報不備がある場合や複数の解釈が考えられる場合は自分の力で考えず、**必ず**query_to_humanツールで人間に問い合わせてください。",
-        state_schema=AgentState_custom,
-        response_format=Result
+    Args:
+        run_key (str): 実行ごとのキー（同じ実行のブランチは同じキーを使用する）
+        limit (int): 同時実行数の上限
+    """
+    with _sample_semaphores_lock:
+        entry = _sample_semaphores.get(run_key)
+        if entry is None:
+            entry = _sample_semaphores[run_key] = [threading.BoundedSemaphore(max(1, int(limit))), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _sample_semaphores_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                _sample_semaphores.pop(run_key, None)
+
+# 非同期実行時の同時実行数制御用セマフォ（イベントループ・実行キーごとに作成し、同様に破棄）
+_async_sample_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, list]]" = weakref.WeakKeyDictionary()
+
+@asynccontextmanager
+async def _async_sample_slot(run_key: str, limit: int) -> AsyncIterator[None]:
+    """_sample_slot の非同期版（実行中のイベントループごと）"""
+    semaphores = _async_sample_semaphores.setdefault(asyncio.get_running_loop(), {})
+    entry = semaphores.get(run_key)
+    if entry is None:
+        entry = semaphores[run_key] = [asyncio.Semaphore(max(1, int(limit))), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            semaphores.pop(run_key, None)
+
+def get_sample_root(state: State) -> str:
+    """
+    Stateからサンプルデータのフォルダパスを取得する関数
+
+    Args:
+        state (State): 現在の状態
+
+    Returns:
+        str: テスト単位のサンプルフォルダパス
+    """
+    return os.path.join(state.sample_root, state.sample_data_path)
+
+def get_page_cache_dir(state: State) -> str:
+    """
+    StateからPDFページ画像キャッシュのディレクトリを取得する関数（無効の場合は空文字）
+    """
+    if not state.page_cache_enabled:
+        return ""
+    if state.page_cache_dir:
+        return state.page_cache_dir
+    return os.path.join(state.output_dir, "page_cache")
+
+def get_results_log_path(state: State) -> str:
+    """
+    Stateから判定結果ログのパスを取得する関数（未作成の場合は出力ディレクトリ配下に新しく作成する）
+    """
+    return state.results_log_path or new_results_log_path(state.output_dir)
+
+def _record_result(results_log_path: str, iter_id: int, sample_data: str, result: Any) -> Dict[str, Any]:
+    """
+    判定結果をログに追記し、State の更新（ログのパス・件数）を返す関数
+    """
+    get_results_log(results_log_path).append(iter_id, sample_data, result)
+    return {"results_log_path": results_log_path, "results_count": 1}
+
+def _load_evidence(
+    data_path: str,
+    sample_data: str,
+    page_cache: Optional[PageRenderCache],
+    memory_limit_bytes: int,
+    pdf_mode: str = "auto",
+    procedure: str = "",
+    pdf_top_k: int = 5,
+) -> SampleEvidence:
+    """1サンプル分の証跡を読み込む（データなしの場合は空、PDFページは監査手続きとの関連度で選択）"""
+    if not data_path:
+        return SampleEvidence()
+    logger.info(f"sample_data: {sample_data}")
+    return load_sample_evidence(
+        os.path.join(data_path, sample_data),
+        memory_limit_bytes,
+        page_cache,
+        pdf_mode=pdf_mode,
+        query=procedure,
+        pdf_top_k=pdf_top_k,
+    )
+
+# 1サンプル分の証跡・PDFページ画像のキャッシュは、エージェントの実行時に config["configurable"] で渡す
+SAMPLE_EVIDENCE_KEY = "sample_evidence"
+PAGE_CACHE_KEY = "sample_page_cache"
+
+def _image_message(config: RunnableConfig, image_data_num: int, query: str) -> Optional[HumanMessage]:
+    configurable = config.get("configurable") or {}
+    evidence: Optional[SampleEvidence] = configurable.get(SAMPLE_EVIDENCE_KEY)
+    if evidence is None or not evidence.images or not (0 < image_data_num <= len(evidence.images)):
+        return None
+    # 画像はツールが呼ばれた時点で読み込み・エンコードする
+    image = evidence.images[image_data_num-1].prepare(configurable.get(PAGE_CACHE_KEY))
+    return HumanMessage(
+        content=[
+            {"type": "text", "text": query},
+            {"type": "image_url", "image_url": {"url": image.data_url()}}
+        ]
     )
 
-    procedure = state.procedure
+def analyze_image_tool(image_data_num: int, query: str, config: RunnableConfig) -> str:
+    """
+    画像データを分析する。何枚目の画像について、何を確認したいか明確に伝えることが必要。
+    arg:
+        image_data_num: 何枚目の画像について知りたいか数字で指定 (1-indexed)
+        query: 確認したい内容
+    return:
+        str: 分析結果
+    """
+    tool_message_content = _image_message(config, image_data_num, query)
+    if tool_message_content is None:
+        return "指定された番号の画像データが見つからないか、番号が範囲外です。"
+    result = get_chat_model("gpt-4.1-mini").invoke([tool_message_content])
+    return result.content
+
+async def aanalyze_image_tool(image_data_num: int, query: str, config: RunnableConfig) -> str:
+    """analyze_image_tool の非同期版"""
+    tool_message_content = await asyncio.to_thread(_image_message, config, image_data_num, query)
+    if tool_message_content is None:
+        return "指定された番号の画像データが見つからないか、番号が範囲外です。"
+    result = await get_chat_model("gpt-4.1-mini").ainvoke([tool_message_content])
+    return result.content
+
+# 対象の画像はクロージャではなく実行時の config から参照するため、ツールはプロセス内で共有できる
+analyze_image_structured_tool = StructuredTool.from_function(func=analyze_image_tool, coroutine=aanalyze_image_tool)
+
+_sample_agent = None
+_sample_agent_lock = threading.Lock()
+
+def get_sample_agent():
+    """
+    サンプルごとの監査手続きを実施するReActエージェントを取得する（プロセス内で1回だけコンパイルして共有）
+    """
+    global _sample_agent
+    with _sample_agent_lock:
+        if _sample_agent is None:
+            from langgraph.prebuilt import create_react_agent
+
+            _sample_agent = create_react_agent(
+                model=get_chat_model("gpt-4.1-mini"),
+                tools=[query_to_human_tool, analyze_image_structured_tool],
+                prompt="必ず日本語で回答してください。監査人として手続きを実施してください。情報不備がある場合や複数の解釈が考えられる場合は自分の力で考えず、**必ず**query_to_humanツールで人間に問い合わせてください。",
+                state_schema=AgentState_custom,
+                response_format=Result
+            )
+        return _sample_agent
+
+def _sample_agent_config(evidence: SampleEvidence, page_cache: Optional[PageRenderCache]) -> RunnableConfig:
+    """
+    エージェントの実行用の設定を作成する（実行中のグラフの設定を引き継ぎ、証跡を configurable に追加する）
+    """
+    # configurable は引き継がれずに置き換えられるため、親グラフの値（thread_id・checkpointerなど）とマージする
+    config = ensure_config()
+    config["configurable"] = {
+        **(config.get("configurable") or {}),
+        SAMPLE_EVIDENCE_KEY: evidence,
+        PAGE_CACHE_KEY: page_cache,
+    }
+    return config
+
+def _image_ref(image: PreparedImage) -> str:
+    """画像をアーティファクトストアに保存し、モデルの呼び出し時にdata URLへ変換される参照を返す"""
+    return get_artifact_store().put(image.data, image.mime_type)
+
+def _build_sample_message(evidence: SampleEvidence, procedure: str) -> HumanMessage:
+    """監査手続きと証跡からエージェントへの入力メッセージを作成する"""
+    txt_data = evidence.texts
     format = "以下のフォーマットに従って回答してください。"
-    # Run the agent
-    if image_data:
+    if evidence.images:
         procedure_with_txtdata = "以下の手続きを実施し、結果と根拠を明確に示してください。監査人として手続きを実施してください。情報不備がある場合や複数の解釈が考えられる場合は自分の力で考えず、**必ず**query_to_humanツールで人間に問い合わせてください。\n" + procedure + "\n" + format + "\n" + "以下はこの手続きに使用するテキストデータです。\n" + "\n".join(txt_data)
-        message = HumanMessage(
+        if evidence.deferred_images or evidence.text_pages or evidence.unselected_pages:
+            procedure_with_txtdata += "\n以下はこの手続きに使用する画像の一覧です。\n" + describe_images(evidence)
+        return HumanMessage(
             content=[
                 {"type":"text","text":procedure_with_txtdata},
-                *[{"type":"image_url","image_url": {"url": f"data:image/jpeg;base64,{image}"}} for image in image_data]
-            ]
-        )
-    else:
-        procedure_with_txtdata = "以下の手続きを実施し、結果と根拠を明確に示してください。\n" + procedure + "\n" + format + "\n" + "以下はこの手続きに使用するテキストデータです。\n" + "\n".join(txt_data)
-        message = HumanMessage(
-            content=[
-                {"type":"text","text":procedure_with_txtdata}
+                # 画像はアーティファクトストアに保存し、メッセージ（State.messages）には参照のみを入れる
+                *[{"type":"image_url","image_url": {"url": _image_ref(image)}} for image in evidence.inline_images]
             ]
         )
+    procedure_with_txtdata = "以下の手続きを実施し、結果と根拠を明確に示してください。\n" + procedure + "\n" + format + "\n" + "以下はこの手続きに使用するテキストデータです。\n" + "\n".join(txt_data)
+    return HumanMessage(
+        content=[
+            {"type":"text","text":procedure_with_txtdata}
+        ]
+    )
 
-    inputs = {"messages": [message]}
-    result = agent.invoke(inputs)
+def run_sample_agent(
+    data_path: str,
+    sample_data: str,
+    procedure: str,
+    page_cache: Optional[PageRenderCache] = None,
+    memory_limit_bytes: int = 0,
+    pdf_mode: str = "auto",
+    pdf_top_k: int = 5,
+) -> Dict[str, Any]:
+    """
+    1サンプル分のデータを読み込み、ReActエージェントで監査手続きを実施する関数
+
+    Args:
+        data_path (str): テスト単位のサンプルフォルダパス（空文字の場合はデータなし）
+        sample_data (str): サンプルフォルダ名
+        procedure (str): 監査手続き
+        page_cache (Optional[PageRenderCache]): PDFページ画像のキャッシュ（未指定の場合はキャッシュしない）
+        memory_limit_bytes (int): 1サンプルでメッセージに含める証跡の合計バイト数の上限（0以下の場合は無制限）
+        pdf_mode (str): PDFページの送信方法（auto / image / text）
+        pdf_top_k (int): PDF1ファイルあたりの最初のメッセージに含めるページ数（0以下の場合は全ページ）
+
+    Returns:
+        Dict[str, Any]: エージェントの実行結果（messages, structured_response）
+    """
+    evidence = _load_evidence(data_path, sample_data, page_cache, memory_limit_bytes, pdf_mode, procedure, pdf_top_k)
+    message = _build_sample_message(evidence, procedure)
+    # 添付した画像はアーティファクトストアに保存済みのため、エージェントの実行中はバイト列を保持しない
+    evidence.inline_images.clear()
+    return get_sample_agent().invoke({"messages": [message]}, _sample_agent_config(evidence, page_cache))
+
+async def arun_sample_agent(
+    data_path: str,
+    sample_data: str,
+    procedure: str,
+    page_cache: Optional[PageRenderCache] = None,
+    memory_limit_bytes: int = 0,
+    pdf_mode: str = "auto",
+    pdf_top_k: int = 5,
+) -> Dict[str, Any]:
+    """
+    run_sample_agent の非同期版。ファイル読み込みはスレッドで行い、モデル呼び出しは ainvoke で行う。
+    """
+    evidence = await asyncio.to_thread(
+        _load_evidence, data_path, sample_data, page_cache, memory_limit_bytes, pdf_mode, procedure, pdf_top_k
+    )
+    message = await asyncio.to_thread(_build_sample_message, evidence, procedure)
+    evidence.inline_images.clear()
+    return await get_sample_agent().ainvoke({"messages": [message]}, _sample_agent_config(evidence, page_cache))
+
+def _prepare_iteration(state: State) -> Tuple[int, str, str, int, Optional[PageRenderCache]]:
+    """逐次実行の1反復分の入力（反復番号・フォルダ・サンプル名・サンプル数・キャッシュ）を決定する"""
+    # Increment iteration count
+    current_iteration = int(state.iteration_count) + 1
+    logger.info(f"--- Iteration {current_iteration}/{state.max_iterations} ---")
+
+    data_path = ""
+    sample_data = ""
+    sample_num = state.max_iterations
+    if state.sample_data_path:
+        data_path = get_sample_root(state)
+        sample_folders = os.listdir(data_path)
+        sample_num = len(sample_folders)
+        sample_data = sample_folders[current_iteration-1]
+
+    page_cache_dir = get_page_cache_dir(state)
+    page_cache = get_page_cache(page_cache_dir, state.page_cache_max_bytes) if page_cache_dir else None
+    return current_iteration, data_path, sample_data, sample_num, page_cache
+
+@timed_node("react_node")
+def react_node(state: State, config: RunnableConfig) -> Dict[str, Any]:
+    current_iteration, data_path, sample_data, sample_num, page_cache = _prepare_iteration(state)
+    result = run_sample_agent(data_path, sample_data, state.procedure, page_cache, state.sample_memory_limit_bytes, state.pdf_evidence_mode, state.pdf_top_k_pages)
 
     # eval_prompt = "以下は監査結果が論理的に妥当な内容か評価してください。\n" + f"監査手続き:{procedure}\n" + "以下は監査結果です。\n" + str(result["structured_response"])
     # eval_result = agent.invoke({"messages": [("human", eval_prompt)]})
 
     # Update state with new messages and incremented count
-    return {"messages": result["messages"], "iteration_count": current_iteration, "max_iterations": sample_num, "iter_data": {"iter_id":current_iteration, "result": result["structured_response"]}}
\ No newline at end of file
+    record = _record_result(get_results_log_path(state), current_iteration, sample_data, result["structured_response"])
+    return {"messages": result["messages"], "iteration_count": current_iteration, "max_iterations": sample_num, **record}
+
+@timed_node("react_node")
+async def areact_node(state: State, config: RunnableConfig) -> Dict[str, Any]:
+    """react_node の非同期版（LangGraphサーバーなど非同期で実行される場合に使用）"""
+    current_iteration, data_path, sample_data, sample_num, page_cache = await asyncio.to_thread(_prepare_iteration, state)
+    result = await arun_sample_agent(data_path, sample_data, state.procedure, page_cache, state.sample_memory_limit_bytes, state.pdf_evidence_mode, state.pdf_top_k_pages)
+    record = await asyncio.to_thread(_record_result, get_results_log_path(state), current_iteration, sample_data, result["structured_response"])
+    return {"messages": result["messages"], "iteration_count": current_iteration, "max_iterations": sample_num, **record}
+
+class SampleTask(TypedDict):
+    """並列実行時に1サンプル分のブランチへ渡す入力"""
+
+    sample_root: str
+    sample_data_path: str
+    sample_data: str
+    iter_id: int
+    procedure: str
+    run_key: str
+    max_concurrency: int
+    page_cache_dir: str
+    page_cache_max_bytes: int
+    sample_memory_limit_bytes: int
+    pdf_evidence_mode: str
+    pdf_top_k_pages: int
+    results_log_path: str
+
+@timed_node("sample_worker_node")
+def sample_worker_node(task: SampleTask) -> Dict[str, Any]:
+    """
+    並列実行モードで1サンプル分の監査手続きを実施するノード。
+    同時実行数は max_concurrency で制限し、結果は判定結果ログに追記する。
+    """
+    data_path = os.path.join(task["sample_root"], task["sample_data_path"])
+    page_cache = get_page_cache(task["page_cache_dir"], task["page_cache_max_bytes"]) if task["page_cache_dir"] else None
+    with _sample_slot(task["run_key"], task["max_concurrency"]):
+        logger.info(f"--- Sample {task['iter_id']}: {task['sample_data']} ---")
+        result = run_sample_agent(data_path, task["sample_data"], task["procedure"], page_cache, task["sample_memory_limit_bytes"], task["pdf_evidence_mode"], task["pdf_top_k_pages"])
+    # 並列ブランチから messages / iteration_count を書き込むと競合するため、ログのパス・件数のみ返す
+    return _record_result(task["results_log_path"], task["iter_id"], task["sample_data"], result["structured_response"])
+
+@timed_node("sample_worker_node")
+async def asample_worker_node(task: SampleTask) -> Dict[str, Any]:
+    """sample_worker_node の非同期版"""
+    data_path = os.path.join(task["sample_root"], task["sample_data_path"])
+    page_cache = get_page_cache(task["page_cache_dir"], task["page_cache_max_bytes"]) if task["page_cache_dir"] else None
+    async with _async_sample_slot(task["run_key"], task["max_concurrency"]):
+        logger.info(f"--- Sample {task['iter_id']}: {task['sample_data']} ---")
+        result = await arun_sample_agent(data_path, task["sample_data"], task["procedure"], page_cache, task["sample_memory_limit_bytes"], task["pdf_evidence_mode"], task["pdf_top_k_pages"])
+    return await asyncio.to_thread(_record_result, task["results_log_path"], task["iter_id"], task["sample_data"], result["structured_response"])
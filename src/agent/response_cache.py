@@ -0,0 +1,180 @@
+"""
+モデル応答の永続キャッシュ（SQLite）
+
+LangChainの BaseCache として実装し、get_chat_model で生成する全てのChatOpenAIに設定する。
+キーはモデル・パラメータ（bind したツールや構造化出力のスキーマを含む llm_string）と、
+メッセージ（テキスト・画像のdata URL）を直列化した文字列のSHA-256。
+監査の再実行時やクラッシュ後の再開時に、同じ入力に対するモデル呼び出しを省略できる。
+キャッシュは同じ入力に対して前回の判定をそのまま返す（サンプリングによる判定のばらつきも固定される）ため、
+デフォルトは無効とし、再実行・再現が目的の場合に RESPONSE_CACHE_MODE で明示的に有効にする。
+
+環境変数:
+    RESPONSE_CACHE_MODE: off（無効、デフォルト） / readwrite / replay（キャッシュにない呼び出しはエラー）
+    RESPONSE_CACHE_PATH: SQLiteファイルのパス（デフォルト: .cache/llm_responses.sqlite）
+    RESPONSE_CACHE_TTL: 有効期限の秒数（デフォルト: 604800 = 7日、0以下の場合は無期限）
+    RESPONSE_CACHE_MAX_BYTES: キャッシュ全体の合計バイト数の上限（デフォルト: 500MB、0以下の場合は無制限）
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+from pydantic import BaseModel
+
+from agent.metrics import RESPONSE_CACHE_HIT_KEY
+
+logger = logging.getLogger(__name__)
+
+class ResponseCacheMiss(RuntimeError):
+    """replay モードでキャッシュにない呼び出しが行われた場合の例外"""
+
+def make_cache_key(prompt: str, llm_string: str) -> str:
+    """キャッシュキー（llm_string とメッセージのSHA-256）"""
+    return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+def _dump_generations(generations: Sequence[Generation]) -> str:
+    items = []
+    for generation in generations:
+        if isinstance(generation, ChatGeneration):
+            message = generation.message
+            parsed = message.additional_kwargs.get("parsed")
+            if isinstance(parsed, BaseModel):
+                # 構造化出力のパース結果は dict で保存する（読み込み時にスキーマで再構築される）
+                message = message.model_copy(
+                    update={"additional_kwargs": {**message.additional_kwargs, "parsed": parsed.model_dump()}}
+                )
+            items.append({"message": message_to_dict(message), "generation_info": generation.generation_info})
+        else:
+            items.append({"text": generation.text, "generation_info": generation.generation_info})
+    return json.dumps(items, ensure_ascii=False)
+
+def _load_generations(value: str) -> List[Generation]:
+    generations: List[Generation] = []
+    for item in json.loads(value):
+        # キャッシュから返した結果であることを計測（agent.metrics）で判別できるようにする
+        generation_info = {**(item.get("generation_info") or {}), RESPONSE_CACHE_HIT_KEY: True}
+        if "message" in item:
+            message = messages_from_dict([item["message"]])[0]
+            generations.append(ChatGeneration(message=message, generation_info=generation_info))
+        else:
+            generations.append(Generation(text=item["text"], generation_info=generation_info))
+    return generations
+
+class SQLiteResponseCache(BaseCache):
+    """
+    モデル応答をSQLiteに保存するキャッシュ
+
+    Args:
+        database_path (str): SQLiteファイルのパス
+        ttl_seconds (float): 有効期限の秒数（0以下の場合は無期限）
+        max_bytes (int): 保存する応答の合計バイト数の上限（0以下の場合は無制限）
+        replay (bool): True の場合、キャッシュにない呼び出しは ResponseCacheMiss を送出する
+    """
+
+    def __init__(self, database_path: str, ttl_seconds: float = 0, max_bytes: int = 0, replay: bool = False):
+        self.database_path = database_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(database_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(database_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " llm_string TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = make_cache_key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and not self._expired(row[1]):
+                self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+                return _load_generations(row[0])
+            self.misses += 1
+        if self.replay:
+            raise ResponseCacheMiss(f"replay モードでキャッシュにない呼び出しが行われました (key: {key[:12]})")
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = make_cache_key(prompt, llm_string)
+        value = _dump_generations(return_val)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, llm_string, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, llm_string, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """期限切れの応答を削除し、合計サイズが上限を超える場合は最終参照が古いものから削除する"""
+        if self.ttl_seconds > 0:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        if self.max_bytes <= 0:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removed = 0
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        logger.info(f"応答キャッシュから {removed} 件を削除しました")
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット数・ミス数・保存件数・合計バイト数"""
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total, "replay": self.replay}
+
+_cache: Optional[SQLiteResponseCache] = None
+_cache_lock = threading.Lock()
+
+def get_response_cache() -> Optional[SQLiteResponseCache]:
+    """
+    プロセス全体で共有する応答キャッシュを取得する（RESPONSE_CACHE_MODE が未設定または off の場合はNone）
+    """
+    global _cache
+    mode = os.getenv("RESPONSE_CACHE_MODE", "off").lower()
+    if mode == "off":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SQLiteResponseCache(
+                os.getenv("RESPONSE_CACHE_PATH", os.path.join(".cache", "llm_responses.sqlite")),
+                ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600))),
+                max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(500 * 1024 * 1024))),
+                replay=mode == "replay",
+            )
+            logger.info(f"応答キャッシュ: {_cache.database_path} (モード: {mode})")
+        return _cache
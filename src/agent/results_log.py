@@ -0,0 +1,135 @@
+"""
+サンプルの判定結果の追記専用ログ（JSONL）
+
+各サンプルの判定結果（Result）は完了した時点でログに1行ずつ追記し、グラフの State にはログのパスと件数のみを保持する。
+サンプル数が多い場合もチェックポイント・State のコピーが大きくならず、途中で停止しても完了済みの結果はログに残る。
+結果は update_format_node で1行ずつ読み込む。同じ反復番号の結果が複数ある場合（再実行など）は最後のものを使用する。
+
+環境変数:
+    RESULTS_LOG_FSYNC: 追記ごとにディスクへ同期するか（デフォルト: 1）
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def _to_dict(result: Any) -> Dict[str, Any]:
+    if hasattr(result, "model_dump"):
+        return result.model_dump()
+    if hasattr(result, "dict"):
+        return result.dict()
+    return dict(result)
+
+class ResultsLog:
+    """
+    1実行分の判定結果のログ
+
+    Args:
+        path (str): ログファイルのパス
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self._fsync = os.getenv("RESULTS_LOG_FSYNC", "1") not in ("0", "false", "False")
+
+    def append(self, iter_id: int, sample: str, result: Any) -> Dict[str, Any]:
+        """
+        1サンプル分の判定結果を追記する
+
+        Args:
+            iter_id (int): 反復番号（1始まり）
+            sample (str): サンプルフォルダ名
+            result (Any): 判定結果（Result または辞書）
+
+        Returns:
+            Dict[str, Any]: 追記したエントリ
+        """
+        entry = {"iter_id": iter_id, "sample": sample, "result": _to_dict(result), "finished_at": time.time()}
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # 並列実行時は複数のスレッドから追記されるため、1行ずつロック内で書き込む
+        with self._lock:
+            with open(self.path, "a+b") as f:
+                # 停止時に書き込み途中だった行がある場合は改行してから追記する
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.write(line)
+                f.flush()
+                if self._fsync:
+                    os.fsync(f.fileno())
+        return entry
+
+    def read_from(self, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        offset（バイト位置）以降に追記されたエントリを読み込む（進捗の参照など、追記を順に読む場合に使用）
+
+        Returns:
+            Tuple[List[Dict[str, Any]], int]: エントリと次に読み込むバイト位置
+        """
+        entries: List[Dict[str, Any]] = []
+        if not os.path.exists(self.path):
+            return entries, offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                # 書き込み途中の行は次回に読み込む
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                entry = self._parse(line)
+                if entry is not None:
+                    entries.append(entry)
+        return entries, offset
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """エントリを追記順に1行ずつ返す"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                entry = self._parse(line)
+                if entry is not None:
+                    yield entry
+
+    def latest(self) -> List[Dict[str, Any]]:
+        """反復番号ごとの最後のエントリを反復番号順に返す"""
+        entries: Dict[int, Dict[str, Any]] = {}
+        for entry in self:
+            entries[entry.get("iter_id") or 0] = entry
+        return [entries[iter_id] for iter_id in sorted(entries)]
+
+    def _parse(self, line: bytes) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(line)
+        except ValueError:
+            # 停止時に書き込み途中だった行は読み飛ばす
+            logger.warning(f"判定結果ログの不正な行を読み飛ばしました: {self.path}")
+            return None
+
+def new_results_log_path(output_dir: str) -> str:
+    """出力ディレクトリ配下に新しいログファイルのパスを作成する"""
+    name = f"results_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.jsonl"
+    return os.path.join(output_dir, "results", name)
+
+_logs: Dict[str, ResultsLog] = {}
+_logs_lock = threading.Lock()
+
+def get_results_log(path: str) -> ResultsLog:
+    """
+    ログファイルごとに共有するResultsLogを取得する
+    """
+    key = os.path.abspath(path)
+    with _logs_lock:
+        if key not in _logs:
+            _logs[key] = ResultsLog(key)
+        return _logs[key]
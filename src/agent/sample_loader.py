@@ -0,0 +1,289 @@
+"""
+サンプルデータの遅延読み込み
+
+サンプルフォルダ内のファイルを証跡（EvidenceItem）として順に返す。
+画像はファイルパス・ページ番号のみを保持し、モデルや analyze_image_tool が必要とした時点で
+PNGバイト列の読み込み・前処理（切り取り・縮小・再圧縮）を行う。
+1サンプルあたりのメモリ上限を超える画像・テキストはメッセージに含めず、参照のみを残す。
+PDFのページはテキストレイヤーを先に確認し、テキストで十分なページは画像化せずにテキストとして含める（agent.pdf_text）。
+長いPDFは監査手続きとの関連度が高いページのみを含め（agent.page_index）、残りのページは analyze_image_tool で参照する。
+"""
+
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple
+
+from agent.image_prep import PreparedImage, estimate_prepared_bytes, prepare_image
+from agent.metrics import record_pdf_page, record_pdf_selection
+from agent.page_cache import PageRenderCache, pdf_page_texts, render_pdf_page
+from agent.page_index import select_pages
+from agent.pdf_text import BASE_DPI, PageText, estimate_image_tokens, estimate_text_tokens, pick_dpi, select_modality
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".png")
+
+@dataclass
+class EvidenceItem:
+    """
+    サンプルフォルダ内の証跡（画像1枚またはテキストファイル1つ）への参照
+
+    PDFのページは描画解像度（dpi）と、最初のメッセージに含めるか（selected）を持つ。
+    page_text は選択したページのテキストレイヤー。
+    """
+
+    kind: Literal["image", "text"]
+    path: str
+    page_index: Optional[int] = None
+    dpi: Optional[int] = None
+    selected: bool = True
+    page_text: Optional[PageText] = None
+
+    @property
+    def label(self) -> str:
+        name = os.path.basename(self.path)
+        return f"{name} ({self.page_index + 1}ページ目)" if self.page_index is not None else name
+
+    def read_bytes(self, page_cache: Optional[PageRenderCache] = None) -> bytes:
+        """画像のバイト列を読み込む（PDFの場合はページを画像化する）"""
+        if self.page_index is not None:
+            return render_pdf_page(self.path, self.page_index, page_cache, self.dpi)
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def estimate_encoded_bytes(self) -> int:
+        """
+        前処理・base64エンコード後のサイズを、画像を読み込まずに概算する
+        （画像ファイルはファイルサイズ、PDFページはページサイズと描画解像度から見積もる）
+        """
+        if self.page_index is None:
+            size = os.path.getsize(self.path)
+        elif self.page_text is not None:
+            scale = (self.dpi or BASE_DPI) / BASE_DPI
+            size = estimate_prepared_bytes(self.page_text.width * scale, self.page_text.height * scale, "evidence")
+        else:
+            # ページサイズが未取得の場合は描画後のサイズで判定する
+            size = 0
+        return (size + 2) // 3 * 4
+
+    def prepare(self, page_cache: Optional[PageRenderCache] = None) -> PreparedImage:
+        """モデルに送信するために画像を前処理する"""
+        return prepare_image(self.read_bytes(page_cache), "evidence", self.label)
+
+    def read_text(self, max_bytes: Optional[int] = None) -> Tuple[str, bool]:
+        """
+        テキストファイルを読み込む（max_bytes を超える部分は読み込まない）
+
+        Returns:
+            Tuple[str, bool]: 読み込んだテキストと、上限により切り詰めたかどうか
+        """
+        with open(self.path, "r", encoding="utf-8") as f:
+            if max_bytes is None:
+                return f.read(), False
+            # UTF-8の1文字は最大4バイトのため、少しずつ読み込みバイト数を確認する
+            chunks = []
+            used = 0
+            while used < max_bytes:
+                chunk = f.read(max(1, (max_bytes - used) // 4))
+                if not chunk:
+                    return "".join(chunks), False
+                chunks.append(chunk)
+                used += len(chunk.encode("utf-8"))
+            return "".join(chunks), bool(f.read(1))
+
+def iter_sample_evidence(
+    sample_dir: str,
+    query: str = "",
+    pdf_top_k: int = 5,
+    page_cache: Optional[PageRenderCache] = None,
+) -> Iterator[EvidenceItem]:
+    """
+    サンプルフォルダ内の証跡を順に返すジェネレータ（PDFはテキストレイヤーのみ読み込み、画像化しない）
+
+    Args:
+        sample_dir (str): サンプルフォルダのパス
+        query (str): ページの選択に使用する監査手続き
+        pdf_top_k (int): PDF1ファイルあたりの最初のメッセージに含めるページ数（0以下の場合は全ページ）
+        page_cache (Optional[PageRenderCache]): PDFページ画像・テキストレイヤーのキャッシュ
+
+    Yields:
+        EvidenceItem: 証跡への参照
+    """
+    for file in os.listdir(sample_dir):
+        file_path = os.path.join(sample_dir, file)
+        logger.info(f"file_path: {file_path}")
+        if file.endswith(".pdf"):
+            page_texts = pdf_page_texts(file_path, page_cache)
+            logger.info(f"doc_length: {len(page_texts)}")
+            selected = set(select_pages([page_text.text for page_text in page_texts], query, pdf_top_k))
+            record_pdf_selection(len(page_texts), len(selected))
+            if len(selected) < len(page_texts):
+                logger.info(f"関連度の高いページを選択しました: {file} {[idx + 1 for idx in sorted(selected)]}")
+            for page_index, page_text in enumerate(page_texts):
+                is_selected = page_index in selected
+                yield EvidenceItem(
+                    kind="image",
+                    path=file_path,
+                    page_index=page_index,
+                    dpi=pick_dpi(page_text),
+                    selected=is_selected,
+                    page_text=page_text if is_selected else None,
+                )
+        elif file.endswith(IMAGE_EXTENSIONS):
+            yield EvidenceItem(kind="image", path=file_path)
+        else:
+            yield EvidenceItem(kind="text", path=file_path)
+
+@dataclass
+class SampleEvidence:
+    """
+    1サンプル分の証跡
+
+    images は全画像への参照（analyze_image_tool の画像番号に対応）、
+    inline_images はメモリ上限内でメッセージに添付する前処理済みの画像（メッセージの作成後に解放する）。
+    text_pages はテキストとして含めたPDFページの画像番号、page_modalities はPDFページごとの判定結果、
+    unselected_pages は監査手続きとの関連度が低いため含めなかったPDFページの画像番号。
+    """
+
+    images: List[EvidenceItem] = field(default_factory=list)
+    inline_images: List[PreparedImage] = field(default_factory=list)
+    texts: List[str] = field(default_factory=list)
+    deferred_images: List[int] = field(default_factory=list)
+    text_pages: List[int] = field(default_factory=list)
+    unselected_pages: List[int] = field(default_factory=list)
+    page_modalities: List[Dict[str, Any]] = field(default_factory=list)
+    used_bytes: int = 0
+
+def load_sample_evidence(
+    sample_dir: str,
+    memory_limit_bytes: int = 0,
+    page_cache: Optional[PageRenderCache] = None,
+    pdf_mode: str = "auto",
+    query: str = "",
+    pdf_top_k: int = 5,
+) -> SampleEvidence:
+    """
+    サンプルフォルダの証跡を読み込む（メモリ上限を超える分は参照のみ保持）
+
+    Args:
+        sample_dir (str): サンプルフォルダのパス
+        memory_limit_bytes (int): メッセージに含める画像（base64）とテキストの合計バイト数の上限（0以下の場合は無制限）
+        page_cache (Optional[PageRenderCache]): PDFページ画像のキャッシュ
+        pdf_mode (str): PDFページの送信方法（auto: テキストレイヤーで判定 / image: 常に画像 / text: テキストがあれば常にテキスト）
+        query (str): PDFページの選択に使用する監査手続き
+        pdf_top_k (int): PDF1ファイルあたりの最初のメッセージに含めるページ数（0以下の場合は全ページ）
+
+    Returns:
+        SampleEvidence: 1サンプル分の証跡
+    """
+    evidence = SampleEvidence()
+
+    def remaining() -> Optional[int]:
+        if memory_limit_bytes <= 0:
+            return None
+        return max(memory_limit_bytes - evidence.used_bytes, 0)
+
+    for item in iter_sample_evidence(sample_dir, query, pdf_top_k, page_cache):
+        if item.kind == "text":
+            limit = remaining()
+            text, truncated = item.read_text(limit)
+            if truncated:
+                logger.warning(f"メモリ上限のためテキストを切り詰めました: {item.path}")
+                text += "\n（メモリ上限のため以降省略）"
+            evidence.texts.append(text)
+            evidence.used_bytes += len(text.encode("utf-8"))
+            continue
+
+        evidence.images.append(item)
+        if not item.selected:
+            # 最初のメッセージには含めず、analyze_image_tool で必要になった時点で画像化する
+            evidence.unselected_pages.append(len(evidence.images))
+            continue
+        if item.page_text is not None and _add_page_text(evidence, item, pdf_mode, remaining()):
+            continue
+        limit = remaining()
+        # 上限を超える見込みの画像は描画・前処理せず、analyze_image_tool で必要になった時点で読み込む
+        if limit is not None and item.estimate_encoded_bytes() > limit:
+            _defer_image(evidence, item)
+            continue
+        image = item.prepare(page_cache)
+        encoded_size = (len(image.data) + 2) // 3 * 4
+        if limit is not None and encoded_size > limit:
+            _defer_image(evidence, item)
+            continue
+        evidence.inline_images.append(image)
+        evidence.used_bytes += encoded_size
+
+    return evidence
+
+def _defer_image(evidence: SampleEvidence, item: EvidenceItem) -> None:
+    """画像をメッセージに添付せず、参照のみ残す"""
+    evidence.deferred_images.append(len(evidence.images))
+    logger.warning(f"メモリ上限のため画像をメッセージに添付しません: {item.label}")
+
+def _add_page_text(
+    evidence: SampleEvidence,
+    item: EvidenceItem,
+    pdf_mode: str,
+    limit: Optional[int],
+) -> bool:
+    """
+    PDFページのテキストレイヤーで十分な場合、ページをテキストとして証跡に含める
+
+    Returns:
+        bool: テキストとして含めた場合はTrue（画像として含める場合はFalse）
+    """
+    page_text = item.page_text
+    modality, reason = select_modality(page_text, pdf_mode)
+    text = f"[{item.label}]\n{page_text.text}"
+    text_bytes = len(text.encode("utf-8"))
+    if modality == "text" and limit is not None and text_bytes > limit:
+        modality, reason = "image", "メモリ上限"
+    image_tokens = estimate_image_tokens(page_text.width, page_text.height, dpi=item.dpi)
+    text_tokens = estimate_text_tokens(text) if modality == "text" else 0
+    evidence.page_modalities.append({
+        "label": item.label,
+        "modality": modality,
+        "reason": reason,
+        "chars": page_text.chars,
+        "image_coverage": round(page_text.image_coverage, 3),
+        "text_bytes": text_bytes if modality == "text" else 0,
+        "text_tokens_est": text_tokens,
+        "image_tokens_est": image_tokens,
+    })
+    record_pdf_page(modality, text_bytes, text_tokens, image_tokens)
+    logger.info(f"PDFページの送信方法: {item.label} -> {modality}（{reason}）")
+    if modality != "text":
+        return False
+    evidence.texts.append(text)
+    evidence.text_pages.append(len(evidence.images))
+    evidence.used_bytes += text_bytes
+    return True
+
+def describe_images(evidence: SampleEvidence) -> str:
+    """画像番号と証跡ファイルの対応表を作成する（添付していない画像も含む）"""
+    lines = []
+    unselected = set(evidence.unselected_pages)
+    image_num = 0
+    while image_num < len(evidence.images):
+        image_num += 1
+        item = evidence.images[image_num - 1]
+        if image_num in unselected:
+            # 選択しなかった同じPDFの連続するページは1行にまとめる
+            last = image_num
+            while last + 1 in unselected and evidence.images[last].path == item.path:
+                last += 1
+            pages = f"{item.page_index + 1}〜{evidence.images[last - 1].page_index + 1}ページ目" if last > image_num else f"{item.page_index + 1}ページ目"
+            numbers = f"画像{image_num}〜{last}" if last > image_num else f"画像{image_num}"
+            lines.append(f"- {numbers}: {os.path.basename(item.path)} ({pages})（監査手続きとの関連度が低いため未添付。analyze_image_toolで参照可能）")
+            image_num = last
+            continue
+        if image_num in evidence.deferred_images:
+            note = "（メモリ上限のため未添付。analyze_image_toolで参照可能）"
+        elif image_num in evidence.text_pages:
+            note = "（テキストとして添付。レイアウト・印影などはanalyze_image_toolで画像を参照可能）"
+        else:
+            note = ""
+        lines.append(f"- 画像{image_num}: {item.label}{note}")
+    return "\n".join(lines)
@@ -6,7 +6,6 @@ from dataclasses import  field
 from typing import TypedDict, Annotated
 from langgraph.graph.message import add_messages
 from langchain_core.pydantic_v1 import BaseModel, Field
-import pandas as pd
 import os
 from pathlib import Path
 
@@ -23,14 +22,12 @@ from pathlib import Path
 #                 return str(item.resolve())
 #     return ""
 
-def append_iter_data(current, update):
-    # current: 既存のリスト, update: 新しく追加する値
-    if current is None:
-        current = []
-    if isinstance(update, list):
-        return current + update
-    else:
-        return current + [update]
+def keep_results_log_path(current, update):
+    # 並列ブランチから同じパスが書き込まれるため、空でない値を残す
+    return update or current
+
+def add_results_count(current, update):
+    return (current or 0) + (update or 0)
 
 class State(BaseModel):
     interrupt_response: str = Field(default="")
@@ -39,7 +36,17 @@ class State(BaseModel):
     max_iterations: int = Field(default=2)
     procedure: str = Field(default="2025年のデータか確認してください。")
     sample_data_path: str = Field(default="")
-    iter_data: Annotated[list, append_iter_data] = Field(default=[])
+    sample_root: str = Field(default="C:\\Users\\nyham\\work\\sampletest_3\\agent-inbox-langgraph-example\\data\\sample", description="サンプルデータのルートディレクトリ")
+    parallel_samples: bool = Field(default=False, description="サンプルフォルダを並列に処理するか（map/reduceモード）")
+    max_concurrency: int = Field(default=4, description="並列処理時に同時実行するサンプル数の上限")
+    sample_memory_limit_bytes: int = Field(default=64 * 1024 * 1024, description="1サンプルでメッセージに含める証跡（画像base64・テキスト）の合計サイズ上限（バイト、0以下で無制限）")
+    pdf_evidence_mode: str = Field(default="auto", description="PDFページの送信方法（auto: テキストレイヤーが十分なページはテキスト、それ以外は画像 / image: 常に画像 / text: テキストがあれば常にテキスト）")
+    pdf_top_k_pages: int = Field(default=5, description="PDF1ファイルあたり最初のメッセージに含めるページ数（先頭ページと、監査手続きとの関連度の高いページ。0以下で全ページ）")
+    page_cache_enabled: bool = Field(default=True, description="PDFページ画像のキャッシュを使用するか")
+    page_cache_dir: str = Field(default="", description="PDFページ画像キャッシュのディレクトリ（未指定の場合は出力ディレクトリ配下のpage_cache）")
+    page_cache_max_bytes: int = Field(default=500 * 1024 * 1024, description="PDFページ画像キャッシュの合計サイズ上限（バイト、0以下で無制限）")
+    results_log_path: Annotated[str, keep_results_log_path] = Field(default="", description="判定結果ログ（JSONL）のパス（未指定の場合は出力ディレクトリ配下のresultsに作成）")
+    results_count: Annotated[int, add_results_count] = Field(default=0, description="判定結果ログに追記したサンプル数")
     data_info: dict = Field(default_factory=dict)
     format_path: str = Field(default="C:\\\\Users\\\\nyham\\\\work\\\\sampletest_3\\\\agent-inbox-langgraph-example\\\\data\\\\format\\\\サンプルテスト調書フォーマット.xlsx")
     df: list = Field(default=[])
@@ -47,8 +54,16 @@ class State(BaseModel):
     output_dir: str = Field(default="C:\\\\Users\\\\nyham\\\\work\\\\sampletest_3\\\\agent-inbox-langgraph-example\\\\data\\\\format", description="出力ディレクトリ（Excel入力欄特定ワークフロー用）")
     output_excel_path: str = Field(default="", description="出力Excelファイルパス（Excel入力欄特定ワークフロー用）")
     excel_max_iterations: int = Field(default=5, description="Excel入力欄特定ワークフローの最大反復回数")
+    excel_capture_backend: str = Field(default="soffice", description="Excelキャプチャのバックエンド（soffice / soffice_sheets: シートごとに並列変換 / native）")
+    excel_format_model: str = Field(default="gpt-4.1-mini", description="Excel入力欄特定ワークフローで使用するモデル")
+    excel_validation_mode: str = Field(default="concurrent", description="複数シートの検証方法（concurrent: シートごとに並行して問い合わせ / combined: 全シートを1回で問い合わせ）")
     excel_format_result: dict = Field(default_factory=dict, description="Excel入力欄特定ワークフローの最終結果（辞書形式）")
     excel_format_json_path: str = Field(default="", description="Excel入力欄特定ワークフローの最終JSONファイルパス")
+    excel_format_cache_enabled: bool = Field(default=True, description="Excel入力欄特定ワークフローの結果キャッシュを使用するか")
+    excel_format_cache_refresh: bool = Field(default=False, description="キャッシュを無効化してワークフローを再実行するか")
+    excel_format_cache_dir: str = Field(default="", description="結果キャッシュのディレクトリ（未指定の場合は出力ディレクトリ配下のformat_cache）")
+    excel_format_cache_max_bytes: int = Field(default=200 * 1024 * 1024, description="結果キャッシュの合計サイズ上限（バイト、0以下で無制限）")
+    excel_format_cache_max_entries: int = Field(default=20, description="結果キャッシュのエントリ数上限（0以下で無制限）")
     result: dict = Field(default_factory=dict, description="Excel入力欄特定ワークフローの最終結果（辞書形式）")
     highlighted_captures: list = Field(default=[], description="Excel入力欄特定ワークフローの最終結果（画像パス）")
 
@@ -4,7 +4,6 @@ Excel入力欄特定とJSON化
 
 import os
 import json
-import base64
 import logging
 import tempfile
 from pathlib import Path
@@ -13,18 +12,17 @@ from typing import Dict, List, Any, TypedDict, Annotated, Literal, Optional
 # LangChain関連のインポート
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
 from pydantic import BaseModel, Field
 
 # Excel操作関連のインポート
 import openpyxl
-from openpyxl.styles import PatternFill
-import subprocess
-
-# 環境変数の読み込み
-from dotenv import load_dotenv
-load_dotenv()
+from agent.excel_capture import capture_workbook, renders_per_sheet
+from agent.excel_extract import extract_workbook
+from agent.image_prep import prepare_image_file
+from agent.llm_clients import get_chat_model
+from agent.metrics import timed_node
+from agent.highlight_session import close_highlight_session, use_highlight_session
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +50,47 @@ class ValidationResult(BaseModel):
     issues: Optional[List[str]] = Field(None, description="問題点のリスト（ステータスが「修正が必要」の場合）")
     suggestions: Optional[List[str]] = Field(None, description="修正提案のリスト（ステータスが「修正が必要」の場合）")
 
+# 検証のプロンプト（1枚目: 元のExcel, 2枚目以降: ハイライト済みの画像）
+VALIDATION_PROMPT = """
+以下は、Excelフォームの画像と、入力欄として推定されたセルをハイライト（yellow）した画像です。
+
+このハイライトされた箇所について、以下の観点で評価を行ってください。
+- 入力欄として適切なセルがハイライトされているか
+- 入力すべきでない欄がハイライトされていないか
+
+問題がなければステータスを「OK」としてください。
+問題がある場合は、ステータスを「修正が必要」とし、具体的な問題点と修正案を説明してください。
+"""
+
+# シートごとに検証する場合の同時リクエスト数の上限
+VALIDATION_MAX_CONCURRENCY = 4
+
+def merge_validation_results(results: List[ValidationResult], labels: List[str]) -> ValidationResult:
+    """
+    シートごとの検証結果を1つにまとめる
+
+    いずれかのシートが「修正が必要」の場合は「修正が必要」とし、問題点・修正案はシート名を付けて連結する。
+    検証結果が1つもない場合は、未検証の結果をOKとしないよう「修正が必要」とする。
+
+    Args:
+        results (List[ValidationResult]): シートごとの検証結果
+        labels (List[str]): 各検証結果のシート（画像）名
+
+    Returns:
+        ValidationResult: まとめた検証結果
+    """
+    if not results:
+        return ValidationResult(status="修正が必要", issues=["検証したシートがありません"])
+    if len(results) == 1:
+        return results[0]
+    status = "修正が必要" if any(result.status == "修正が必要" for result in results) else "OK"
+    issues: List[str] = []
+    suggestions: List[str] = []
+    for label, result in zip(labels, results):
+        issues.extend(f"[{label}] {issue}" for issue in result.issues or [])
+        suggestions.extend(f"[{label}] {suggestion}" for suggestion in result.suggestions or [])
+    return ValidationResult(status=status, issues=issues or None, suggestions=suggestions or None)
+
 # 状態の型定義
 class ExcelFormState(TypedDict):
     excel_file: str
@@ -71,8 +110,13 @@ class ExcelFormState(TypedDict):
     status: Literal["進行中", "完了", "エラー"]
     error_message: str
     temp_excel_for_capture: str
+    capture_backend: str
+    model: str
+    highlight_session: str
+    validation_mode: Literal["concurrent", "combined"]
 
 # 1. Excelデータのテキスト化と画像キャプチャ
+@timed_node()
 def extract_excel_data_and_capture(state: ExcelFormState) -> ExcelFormState:
     """
     Excelファイルからテキストデータを抽出し、画像キャプチャを取得する
@@ -110,106 +154,21 @@ def extract_excel_data_and_capture(state: ExcelFormState) -> ExcelFormState:
         #     except Exception as e:
         #         logger.warning(f"キャプチャファイルの削除に失敗: {png_file} ({e})")
         
-        # Excelファイルを開く (テキスト抽出用)
-        workbook_orig = openpyxl.load_workbook(state["excel_file"])
-        
-        # キャプチャ用にExcelを準備 (印刷範囲設定)
-        workbook_for_capture = openpyxl.load_workbook(state["excel_file"])
-        
-        try:
-            for sheet_capture in workbook_for_capture:
-                try:
-                    dimension = sheet_capture.calculate_dimension()
-                    if dimension:
-                        sheet_capture.print_area = dimension
-                        # LibreOffice が印刷範囲を確実に認識するよう fitToPage を有効化
-                        sheet_capture.page_setup.fitToPage = True
-                        logger.info(f"シート '{sheet_capture.title}' の印刷範囲を {dimension} に設定しました")
-                except Exception as e_dim:
-                    logger.warning(f"シート '{sheet_capture.title}' の印刷範囲設定エラー: {e_dim}")
-
-            # 印刷範囲設定済みのExcelを一時ファイルに保存
-            # delete=False にして、sofficeがファイルを使用後に手動で削除
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx", prefix="capture_") as tmp_excel_file:
-                workbook_for_capture.save(tmp_excel_file.name)
-                temp_excel_file_for_capture_path = tmp_excel_file.name # finally節で使うためにパスを保存
-            
-            logger.info(f"印刷範囲設定済みのExcelを一時ファイル '{temp_excel_file_for_capture_path}' に保存しました。")
-
-        except Exception as e_save:
-            logger.error(f"一時Excelファイルの保存中にエラーが発生しました: {e_save}")
-            raise 
+        # 一時ファイルのパスを確保（delete=False にして、sofficeがファイルを使用後に手動で削除）
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx", prefix="capture_") as tmp_excel_file:
+            temp_excel_file_for_capture_path = tmp_excel_file.name # finally節で使うためにパスを保存
 
-        # 抽出結果を格納するテキスト
-        extracted_text = ""
-        
-        # 各シートの処理 (workbook_orig を使用)
-        for sheet_name in workbook_orig.sheetnames:
-            sheet = workbook_orig[sheet_name]
-            
-            # シート名の追加
-            extracted_text += f"## シート名: {sheet_name}\n"
-            
-            # 結合セル情報の抽出
-            merged_cells = []
-            for merged_cell_range in sheet.merged_cells.ranges:
-                merged_cells.append(str(merged_cell_range))
-            
-            if merged_cells:
-                extracted_text += "### 結合セル情報:\n"
-                for cell_range in merged_cells:
-                    extracted_text += f"- {cell_range}\n"
-            
-            # セルデータの抽出
-            extracted_text += "### セルデータ:\n"
-            extracted_text += "| セル | 値 | 書式 |\n"
-            extracted_text += "|-----|----|--------|\n"
-            
-            for row in sheet.iter_rows():
-                for cell in row:
-                    # セルが空でない場合のみ処理
-                    if cell.value is not None:
-                        cell_addr = f"{cell.column_letter}{cell.row}"
-                        cell_value = str(cell.value)
-                        
-                        # 書式情報の取得
-                        format_info = []
-                        if cell.font.bold:
-                            format_info.append("太字")
-                        if cell.fill.fill_type == "solid":
-                            fill_color = cell.fill.start_color.index
-                            if fill_color != "00000000":  # デフォルト色でない場合
-                                format_info.append(f"背景色:{fill_color}")
-                        
-                        format_str = ", ".join(format_info) if format_info else "-"
-                        
-                        # テーブルに行を追加
-                        extracted_text += f"| {cell_addr} | {cell_value} | {format_str} |\n"
-        
-        # 抽出結果をファイルに保存
+        # ブックを1回だけ読み込み、テキスト抽出と印刷範囲設定済みのキャプチャ用コピーの保存を行う
         extracted_text_file = final_output_dir / "extracted_excel_text.md"
-        with open(extracted_text_file, "w", encoding="utf-8") as f:
-            f.write(extracted_text)
-        
-        logger.info(f"Excelテキスト抽出完了: {extracted_text_file}")
+        extract_workbook(state["excel_file"], extracted_text_file, temp_excel_file_for_capture_path)
         
         original_capture_path = None
         if temp_excel_file_for_capture_path and os.path.exists(temp_excel_file_for_capture_path):
-            command = f"soffice --headless --convert-to png \"{str(temp_excel_file_for_capture_path)}\" --outdir \"{str(captures_dir)}\""
-            logger.info(f"実行コマンド: {command}")
-            subprocess.run(command, shell=True, check=True)
-            
-            temp_excel_basename = os.path.splitext(os.path.basename(temp_excel_file_for_capture_path))[0]
-            expected_capture_name = f"{temp_excel_basename}.png"
-            generated_capture_path = captures_dir / expected_capture_name
-
-            if not generated_capture_path.exists():
-                png_files_in_captures_dir = list(captures_dir.glob(f"{temp_excel_basename}*.png")) 
-                if png_files_in_captures_dir:
-                    generated_capture_path = png_files_in_captures_dir[0]
-                    logger.info(f"期待された名前 {expected_capture_name} が見つからず、代わりに {generated_capture_path.name} を使用します。")
-                else: 
-                    logger.warning(f"キャプチャファイル {expected_capture_name} または {temp_excel_basename}*.png が見つかりません。captures_dir: {captures_dir}")
+            # キャプチャバックエンド（soffice / native）でPNGに変換し、先頭シートのキャプチャを使用
+            captures = capture_workbook(str(temp_excel_file_for_capture_path), captures_dir, state.get("capture_backend"))
+            generated_capture_path = Path(next(iter(captures.values()))) if captures else None
+            if not generated_capture_path:
+                logger.warning(f"キャプチャファイルが見つかりません。captures_dir: {captures_dir}")
 
             if generated_capture_path and generated_capture_path.exists():
                 final_capture_name = "original_excel.png"
@@ -220,7 +179,7 @@ def extract_excel_data_and_capture(state: ExcelFormState) -> ExcelFormState:
                      os.rename(generated_capture_path, original_capture_path)
                 logger.info(f"元Excelのキャプチャ完了: {original_capture_path}")
             else:
-                logger.error(f"SofficeによるPNG変換後、キャプチャファイルが見つかりませんでした。一時ファイル: {temp_excel_file_for_capture_path}")
+                logger.error(f"PNG変換後、キャプチャファイルが見つかりませんでした。一時ファイル: {temp_excel_file_for_capture_path}")
         else:
             logger.warning("印刷範囲設定済みの一時Excelファイルが見つからないため、キャプチャをスキップします。")
         
@@ -249,6 +208,7 @@ def extract_excel_data_and_capture(state: ExcelFormState) -> ExcelFormState:
                 logger.warning(f"一時ファイル '{temp_excel_file_for_capture_path}' の削除に失敗しました: {e_remove}")
 
 # 2. マルチモーダルLLMによる入力欄の推定（structured_output使用）
+@timed_node()
 def estimate_fields_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
     """
     テキストデータと画像キャプチャを使用してマルチモーダルLLMで入力欄を推定する
@@ -261,15 +221,11 @@ def estimate_fields_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState
         with open(state["extracted_text_file"], "r", encoding="utf-8") as f:
             extracted_text = f.read()
         
-        # 画像をbase64エンコード
-        with open(state["original_excel_capture"], "rb") as img_file:
-            base64_image = base64.b64encode(img_file.read()).decode("utf-8")
+        # 画像を前処理（余白の切り取り・縮小・再圧縮）
+        original_image = prepare_image_file(state["original_excel_capture"], "form")
         
         # マルチモーダルLLMクライアントの初期化（structured_output使用）
-        llm = ChatOpenAI(
-            model="gpt-4.1-mini",
-            temperature=0
-        ).with_structured_output(ExcelFormFields)
+        llm = get_chat_model(state.get("model") or "gpt-4.1-mini", temperature=0).with_structured_output(ExcelFormFields)
         
         # プロンプトの作成
         prompt = f"""
@@ -297,7 +253,7 @@ def estimate_fields_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{base64_image}"
+                        "url": original_image.data_url()
                     }
                 }
             ]),
@@ -350,6 +306,7 @@ def estimate_fields_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState
         }
 
 # 3. 入力欄のハイライト
+@timed_node()
 def highlight_fields(state: ExcelFormState) -> ExcelFormState:
     """
     推定された入力欄をハイライトする
@@ -367,44 +324,24 @@ def highlight_fields(state: ExcelFormState) -> ExcelFormState:
         final_output_dir = base_save_path / "format_data"
         final_output_dir.mkdir(exist_ok=True, parents=True)
         
-        # 元のExcelファイルをコピー
-        workbook = openpyxl.load_workbook(state["excel_file"])
-        
-        # 黄色のハイライト用フィル
-        highlight_fill = PatternFill(
-            start_color="FFFF00",
-            end_color="FFFF00",
-            fill_type="solid"
-        )
-        
-        # 推定された入力欄をハイライト
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            
-            for cell_addr in state["estimated_fields"].keys():
-                try:
-                    # セルアドレスが有効かチェック
-                    if len(cell_addr) >= 2 and cell_addr[0].isalpha() and cell_addr[1:].isdigit():
-                        cell = sheet[cell_addr]
-                        original_value = cell.value # 元の値を取得
-                        cell.fill = highlight_fill
-                        if original_value is not None and str(original_value).strip() != "":
-                            cell.value = f"{cell_addr}:{original_value}" # セルアドレスと元の値を連結
-                        else:
-                            cell.value = cell_addr # 元の値が空ならセルアドレスのみ設定
-                except Exception as cell_error:
-                    logger.warning(f"セル {cell_addr} のハイライトまたは値設定中にエラー: {str(cell_error)}")
-        
-        # ハイライト済みExcelを保存
-        highlighted_excel = final_output_dir / f"highlighted_excel_v{state['current_iteration']}.xlsx"
-        workbook.save(highlighted_excel)
-        
-        logger.info(f"入力欄のハイライト完了: {highlighted_excel}")
+        # ハイライト済みブックはイテレーション間で保持し、前回との差分のみ反映する
+        with use_highlight_session(state.get("highlight_session"), state["excel_file"]) as (session_id, session):
+            changed_sheets = session.apply(state["estimated_fields"].keys())
+
+            if changed_sheets or session.highlighted_excel is None:
+                # ハイライト済みExcelを保存
+                highlighted_excel = final_output_dir / f"highlighted_excel_v{state['current_iteration']}.xlsx"
+                session.save(highlighted_excel)
+                logger.info(f"入力欄のハイライト完了: {highlighted_excel} (変更シート: {changed_sheets})")
+            else:
+                highlighted_excel = session.highlighted_excel
+                logger.info(f"ハイライト対象に変更がないため、前回のハイライト済みExcelを使用します: {highlighted_excel}")
         
         # 状態の更新
         return {
             **state,
             "highlighted_excel": str(highlighted_excel),
+            "highlight_session": session_id,
             "status": "進行中"
         }
         
@@ -417,6 +354,7 @@ def highlight_fields(state: ExcelFormState) -> ExcelFormState:
         }
 
 # 4. ハイライト済みExcelのキャプチャ取得
+@timed_node()
 def capture_highlighted_excel(state: ExcelFormState) -> ExcelFormState:
     """
     ハイライト済みExcelのキャプチャを取得する
@@ -446,91 +384,44 @@ def capture_highlighted_excel(state: ExcelFormState) -> ExcelFormState:
         #     except Exception as e:
         #         logger.warning(f"キャプチャファイルの削除に失敗: {png_file} ({e})")
 
-        # ハイライト済みExcelファイルをロードし、印刷範囲を設定
         highlighted_excel_path_str = state["highlighted_excel"]
-        workbook_hl = openpyxl.load_workbook(highlighted_excel_path_str)
-        sheet_names_for_loop = list(workbook_hl.sheetnames) # PNGループ用にシート名を取得
-
-        for sheet_hl_obj in workbook_hl: # openpyxlのイテレータでシートオブジェクトを取得
-            try:
-                dimension_hl = sheet_hl_obj.calculate_dimension()
-                if dimension_hl:
-                    sheet_hl_obj.print_area = dimension_hl
-                    sheet_hl_obj.page_setup.fitToPage = True
-                    logger.info(f"ハイライト済みシート '{sheet_hl_obj.title}' の印刷範囲を {dimension_hl} に設定しました")
-            except Exception as e_dim_hl:
-                logger.warning(f"ハイライト済みシート '{sheet_hl_obj.title}' の印刷範囲設定エラー: {e_dim_hl}")
-        
-        workbook_hl.save(highlighted_excel_path_str) # 変更をハイライト済みファイルに保存
-        
-        # LibreOfficeを使用してPNGに変換
-        # highlighted_excel = state["highlighted_excel"] # highlighted_excel_path_str を使用
-        command = f"soffice --headless --convert-to png \"{highlighted_excel_path_str}\" --outdir \"{str(captures_dir)}\""
-        
-        logger.info(f"実行コマンド: {command}")
-        subprocess.run(command, shell=True, check=True)
-        
-        # 生成されたPNGファイルのパスを取得
-        excel_filename = os.path.basename(highlighted_excel_path_str)
-        excel_basename = os.path.splitext(excel_filename)[0]
-        
-        highlighted_captures = []
-
-        if len(sheet_names_for_loop) == 1:
-            # シートが1枚の場合
-            capture_path = captures_dir / f"{excel_basename}.png"
-            if capture_path.exists():
-                highlighted_captures.append(str(capture_path))
-                logger.info(f"単一シートのキャプチャファイルを発見: {capture_path}")
-            else:
-                # soffice がシート名を付与する場合も考慮 (例: excel_basename_Sheet1.png)
-                capture_path_with_sheet_name = captures_dir / f"{excel_basename}_{sheet_names_for_loop[0]}.png"
-                capture_path_with_sheet_index = captures_dir / f"{excel_basename}_sheet1.png" # 1ベースのインデックス
-                capture_path_with_sheet_index_0 = captures_dir / f"{excel_basename}_sheet0.png" # 0ベースのインデックス
-                
-                if capture_path_with_sheet_name.exists():
-                    highlighted_captures.append(str(capture_path_with_sheet_name))
-                    logger.info(f"単一シートのキャプチャファイルを発見 (シート名付き): {capture_path_with_sheet_name}")
-                elif capture_path_with_sheet_index.exists():
-                    highlighted_captures.append(str(capture_path_with_sheet_index))
-                    logger.info(f"単一シートのキャプチャファイルを発見 (シートインデックス付き): {capture_path_with_sheet_index}")
-                elif capture_path_with_sheet_index_0.exists():
-                    highlighted_captures.append(str(capture_path_with_sheet_index_0))
-                    logger.info(f"単一シートのキャプチャファイルを発見 (シートインデックス0付き): {capture_path_with_sheet_index_0}")
-                else:
-                    logger.error(f"単一シートのキャプチャファイルが見つかりません。期待されたパス: {capture_path} または {capture_path_with_sheet_name} や {capture_path_with_sheet_index}")
-        else:
-            # シートが複数枚の場合
-            for sheet_idx, sheet_name in enumerate(sheet_names_for_loop, 1):
-                # LibreOfficeが出力する可能性のあるファイル名パターン
-                # パターン1: <basename>_sheet<N>.png (Nは1から始まる)
-                capture_path_p1 = captures_dir / f"{excel_basename}_sheet{sheet_idx}.png"
-                # パターン2: <basename>-<N>.png (Nは1から始まる)
-                capture_path_p2 = captures_dir / f"{excel_basename}-{sheet_idx}.png"
-                # パターン3: <basename>_<シート名>.png
-                capture_path_p3 = captures_dir / f"{excel_basename}_{sheet_name}.png"
-                # パターン4: <basename>.png (LibreOfficeのバージョンによっては最初のシートのみこの名前になる可能性も稀にある)
-                # このパターンは単一シートの場合に主に処理されるが、複数シートの最初のシートで発生する可能性も考慮するなら、ここでチェックも可能
-                # capture_path_p4 = captures_dir / f"{excel_basename}.png"
-
-                actual_capture_path = None
-                if capture_path_p1.exists():
-                    actual_capture_path = capture_path_p1
-                elif capture_path_p2.exists():
-                    actual_capture_path = capture_path_p2
-                elif capture_path_p3.exists():
-                    actual_capture_path = capture_path_p3
-                # elif sheet_idx == 1 and capture_path_p4.exists(): # もし最初のシートがbasename.pngになる場合
-                #     actual_capture_path = capture_path_p4
-
-                if actual_capture_path:
-                    highlighted_captures.append(str(actual_capture_path))
-                    logger.info(f"シート '{sheet_name}' のキャプチャファイルを発見: {actual_capture_path}")
+        with use_highlight_session(state.get("highlight_session")) as (_, session):
+            if session is not None:
+                # 印刷範囲はハイライト時に設定済み。変更があったシートのみ再キャプチャし、他は前回の画像を再利用する
+                # （ブック全体を変換するバックエンドでは描画量が変わらないため、全シートの画像を更新する）
+                sheet_names_for_loop = list(session.workbook.sheetnames)
+                if session.pending_sheets:
+                    capture_sheets = session.pending_sheets if renders_per_sheet(state.get("capture_backend")) else None
+                    capture_map = capture_workbook(
+                        highlighted_excel_path_str, captures_dir, state.get("capture_backend"), sheet_names=capture_sheets
+                    )
+                    session.update_captures(capture_map)
                 else:
-                    logger.warning(f"シート '{sheet_name}' (インデックス {sheet_idx}) のキャプチャファイルが見つかりません。試行したパターン: {capture_path_p1}, {capture_path_p2}, {capture_path_p3}")
+                    logger.info("ハイライト対象に変更がないため、再キャプチャをスキップします")
+                highlighted_captures = session.ordered_captures()
+            else:
+                # ハイライト済みExcelファイルをロードし、印刷範囲を設定
+                workbook_hl = openpyxl.load_workbook(highlighted_excel_path_str)
+                sheet_names_for_loop = list(workbook_hl.sheetnames) # PNGループ用にシート名を取得
+
+                for sheet_hl_obj in workbook_hl: # openpyxlのイテレータでシートオブジェクトを取得
+                    try:
+                        dimension_hl = sheet_hl_obj.calculate_dimension()
+                        if dimension_hl:
+                            sheet_hl_obj.print_area = dimension_hl
+                            sheet_hl_obj.page_setup.fitToPage = True
+                            logger.info(f"ハイライト済みシート '{sheet_hl_obj.title}' の印刷範囲を {dimension_hl} に設定しました")
+                    except Exception as e_dim_hl:
+                        logger.warning(f"ハイライト済みシート '{sheet_hl_obj.title}' の印刷範囲設定エラー: {e_dim_hl}")
+
+                workbook_hl.save(highlighted_excel_path_str) # 変更をハイライト済みファイルに保存
+
+                # キャプチャバックエンド（soffice / native）を使用してPNGに変換
+                capture_map = capture_workbook(highlighted_excel_path_str, captures_dir, state.get("capture_backend"))
+                highlighted_captures = [capture_map[sheet_name] for sheet_name in sheet_names_for_loop if sheet_name in capture_map]
 
         if not highlighted_captures and sheet_names_for_loop:
-            logger.error(f"ハイライト済みExcelのキャプチャファイルが一つも生成されませんでした。Sofficeのコマンド出力を確認してください。コマンド: {command}")
+            raise RuntimeError(f"ハイライト済みExcelのキャプチャファイルが一つも生成されませんでした。キャプチャバックエンドの出力を確認してください。ファイル: {highlighted_excel_path_str}")
             
         logger.info(f"ハイライト済みExcelキャプチャ完了: {highlighted_captures}")
         
@@ -550,6 +441,7 @@ def capture_highlighted_excel(state: ExcelFormState) -> ExcelFormState:
         }
 
 # 5. マルチモーダルLLMによる検証（structured_output使用）
+@timed_node()
 def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
     """
     マルチモーダルLLMを使用してハイライト済み入力欄の検証を行う
@@ -558,6 +450,10 @@ def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
     logger.info(f"マルチモーダルLLMによる検証開始 (v{state['current_iteration']})")
     
     try:
+        # キャプチャがない場合は未検証のまま完了しないようエラーにする
+        if not state["highlighted_captures"]:
+            raise ValueError("ハイライト済みExcelのキャプチャがないため検証できません")
+
         # 実際の保存先ベースディレクトリを決定
         user_defined_output_dir = state.get("output_dir")
         if user_defined_output_dir and str(user_defined_output_dir).strip():
@@ -572,70 +468,58 @@ def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
         structured_fields = state["structured_fields"]
         
         # マルチモーダルLLMクライアントの初期化（structured_output使用）
-        llm = ChatOpenAI(
-            model="gpt-4.1-mini",
-            temperature=0
-        ).with_structured_output(ValidationResult)
-        
-        validation_results = []
-        structured_validations = []
-        
-        for capture_path in state["highlighted_captures"]:
-            # 画像をbase64エンコード
-            with open(capture_path, "rb") as img_file:
-                base64_image = base64.b64encode(img_file.read()).decode("utf-8")
-            
-            # 画像をbase64エンコード
-            with open(state["original_excel_capture"], "rb") as img_file_original:
-                base64_image_original = base64.b64encode(img_file_original.read()).decode("utf-8")
-
-            # プロンプトの作成
-            prompt = f"""
-以下は、Excelフォームの画像と、入力欄として推定されたセルをハイライト（yellow）した画像です。
-
-このハイライトされた箇所について、以下の観点で評価を行ってください。
-- 入力欄として適切なセルがハイライトされているか
-- 入力すべきでない欄がハイライトされていないか
-
-問題がなければステータスを「OK」としてください。
-問題がある場合は、ステータスを「修正が必要」とし、具体的な問題点と修正案を説明してください。
-"""
-            
-            # マルチモーダルLLMに問い合わせ
+        llm = get_chat_model(state.get("model") or "gpt-4.1-mini", temperature=0).with_structured_output(ValidationResult)
+        
+        # 元のExcelの画像は全シートで共通のため1回だけ前処理・エンコードする
+        original_url = prepare_image_file(state["original_excel_capture"], "form").data_url()
+        capture_paths = list(state["highlighted_captures"])
+        capture_urls = [prepare_image_file(capture_path, "form").data_url() for capture_path in capture_paths]
+        capture_labels = [os.path.basename(capture_path) for capture_path in capture_paths]
+
+        mode = state.get("validation_mode") or "concurrent"
+        if mode == "combined" and len(capture_paths) > 1:
+            # 全シートを1回のリクエストで検証する
+            prompt = VALIDATION_PROMPT + "\n2枚目以降の画像はシートごとのハイライト画像です（" + "、".join(
+                f"{idx}枚目: {label}" for idx, label in enumerate(capture_labels, 2)
+            ) + "）。問題点・修正案にはどのシートの指摘か画像名を含めてください。\n"
             response = llm.invoke([
                 HumanMessage(content=[
                     {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{base64_image_original}"
-                        }
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}"
-                        }
-                    }
+                    {"type": "image_url", "image_url": {"url": original_url}},
+                    *[{"type": "image_url", "image_url": {"url": url}} for url in capture_urls],
                 ])
             ])
-            
-            # 構造化された検証結果を取得
-            structured_validation = response
-            structured_validations.append(structured_validation)
-            
+            structured_validations = [response]
+            validation_labels = ["全シート"]
+        else:
+            # シートごとのリクエストを並行して送信する
+            messages = [
+                [
+                    HumanMessage(content=[
+                        {"type": "text", "text": VALIDATION_PROMPT},
+                        {"type": "image_url", "image_url": {"url": original_url}},
+                        {"type": "image_url", "image_url": {"url": capture_url}},
+                    ])
+                ]
+                for capture_url in capture_urls
+            ]
+            structured_validations = llm.batch(messages, config={"max_concurrency": VALIDATION_MAX_CONCURRENCY}) if messages else []
+            validation_labels = capture_labels
+
+        validation_results = []
+        for label, structured_validation in zip(validation_labels, structured_validations):
             # 従来の形式のテキスト応答も生成（互換性のため）
             validation_text = f"検証結果: {structured_validation.status}\n"
             if structured_validation.issues:
                 validation_text += "問題点:\n" + "\n".join([f"- {issue}" for issue in structured_validation.issues]) + "\n"
             if structured_validation.suggestions:
                 validation_text += "修正案:\n" + "\n".join([f"- {suggestion}" for suggestion in structured_validation.suggestions]) + "\n"
-            
             validation_results.append(validation_text)
             
             # 検証結果をログに記録
-            capture_filename = os.path.basename(capture_path)
-            logger.info(f"検証結果 ({capture_filename}): {structured_validation.status}")
+            logger.info(f"検証結果 ({label}): {structured_validation.status}")
+
+        merged_validation = merge_validation_results(structured_validations, validation_labels)
         
         # 検証結果をファイルに保存
         validation_result_file = final_output_dir / f"validation_result_v{state['current_iteration']}.txt"
@@ -647,14 +531,12 @@ def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
         # 構造化された検証結果を保存
         structured_validation_file = final_output_dir / f"structured_validation_v{state['current_iteration']}.json"
         with open(structured_validation_file, "w", encoding="utf-8") as f:
-            # 複数の検証結果がある場合は最初のものを使用
-            f.write(structured_validations[0].model_dump_json(indent=2))
+            # 複数の検証結果がある場合はマージした結果を保存
+            f.write(merged_validation.model_dump_json(indent=2))
         logger.info(f"構造化検証結果ファイル保存: {structured_validation_file}")
         
         # 検証結果の分析
-        validation_status = "OK"
-        if any(validation.status == "修正が必要" for validation in structured_validations):
-            validation_status = "修正が必要"
+        validation_status = merged_validation.status
         
         logger.info(f"検証完了: 結果={validation_status}")
         
@@ -662,7 +544,7 @@ def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
         return {
             **state,
             "validation_result": "\n\n".join(validation_results),
-            "structured_validation": structured_validations[0],  # 複数ある場合は最初のものを使用
+            "structured_validation": merged_validation,  # 複数ある場合はマージした結果
             "validation_status": validation_status,
             "status": "進行中"
         }
@@ -676,6 +558,7 @@ def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
         }
 
 # 6. 入力欄情報の修正（structured_output使用）
+@timed_node()
 def correct_fields_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
     """
     検証結果に基づいて入力欄情報を修正する
@@ -701,18 +584,13 @@ def correct_fields_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
         structured_validation = state["structured_validation"]
         
         # ハイライトされたExcel画像
-        with open(state["highlighted_captures"][0], "rb") as img_file:
-            base64_image = base64.b64encode(img_file.read()).decode("utf-8")
+        highlighted_image = prepare_image_file(state["highlighted_captures"][0], "form")
         
         # 元のExcelフォームの画像
-        with open(state["original_excel_capture"], "rb") as img_file_original:
-            base64_image_original = base64.b64encode(img_file_original.read()).decode("utf-8")
+        original_image = prepare_image_file(state["original_excel_capture"], "form")
 
         # マルチモーダルLLMクライアントの初期化（structured_output使用）
-        llm = ChatOpenAI(
-            model="gpt-4.1-mini",
-            temperature=0
-        ).with_structured_output(CollectExcelFormFields)
+        llm = get_chat_model(state.get("model") or "gpt-4.1-mini", temperature=0).with_structured_output(CollectExcelFormFields)
         
         # プロンプトの作成
         prompt = f"""
@@ -737,13 +615,13 @@ STEP2:検証結果と画像に基づいて、修正すべき箇所を回答し
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{base64_image_original}"
+                        "url": original_image.data_url()
                     }
                 },
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{base64_image}"
+                        "url": highlighted_image.data_url()
                     }
                 }
             ])
@@ -809,6 +687,7 @@ STEP2:検証結果と画像に基づいて、修正すべき箇所を回答し
         }
 
 # 7. 最終結果の生成
+@timed_node()
 def generate_final_json(state: ExcelFormState) -> ExcelFormState:
     """
     最終的な入力欄情報JSONを生成する
@@ -841,6 +720,7 @@ def generate_final_json(state: ExcelFormState) -> ExcelFormState:
             f.write(final_structured_fields.model_dump_json(indent=2))
         
         logger.info(f"処理が完了しました。最終結果: {final_json_file}")
+        close_highlight_session(state.get("highlight_session"))
         
         # 状態の更新
         return {
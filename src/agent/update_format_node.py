@@ -1,19 +1,19 @@
 import logging
-from langgraph.prebuilt import create_react_agent
 from agent.state import State
+from agent.image_prep import prepare_image_file
+from agent.llm_clients import get_chat_model
+from agent.metrics import timed_node
+from agent.results_log import get_results_log
 from langchain_core.runnables import RunnableConfig
 from typing import Any, Dict, List
 from langgraph.types import Command
 from langchain_core.messages import ToolMessage, HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field, RootModel
 import json
 import shutil # shutil をインポート
 from datetime import datetime # datetime をインポート
 
-import base64
 import os
-import pandas as pd
 
 logger = logging.getLogger(__name__)
 
@@ -24,50 +24,32 @@ class CellValue(BaseModel):
 class CellValueList(BaseModel):
     items: List[CellValue]
 
+@timed_node()
 def update_format_node(state: State) -> dict:
     """
-    Extracts iteration data from the state and converts it into a Pandas DataFrame.
+    Reads the per-sample results from the results log and converts them into a Pandas DataFrame.
     Currently, it prints the DataFrame for verification.
     """
     logger.info("--- Updating Format ---")
-    iter_data = state.iter_data
-    
-    if not iter_data:
+    # 判定結果はログから1行ずつ読み込む（同じ反復番号の結果が複数ある場合は最後のもの）
+    entries = get_results_log(state.results_log_path).latest() if state.results_log_path else []
+
+    if not entries:
         logger.info("No iteration data found.")
         return {} # 状態は変更しない
 
     # Prepare data for DataFrame
     data_for_df = []
-    for item in iter_data:
-        iter_id = item.get("iter_id")
-        result = item.get("result")
-        # messages = item.get("messages", [])
-        
-        # # Extract content from messages (assuming the last message is most relevant, or adjust as needed)
-        # last_message = messages[-1] if messages else None
-        # content = ""
-        # if isinstance(last_message, AIMessage):
-        #     content = last_message.content
-        # elif isinstance(last_message, HumanMessage):
-        #     # HumanMessage can have complex content (text, image_url list)
-        #     if isinstance(last_message.content, str):
-        #         content = last_message.content
-        #     elif isinstance(last_message.content, list):
-        #          # Extract text part if available
-        #          text_parts = [part.get("text") for part in last_message.content if isinstance(part, dict) and part.get("type") == "text"]
-        #          content = "\\n".join(filter(None, text_parts))
-        # elif isinstance(last_message, ToolMessage):
-        #     content = f"Tool Call: {last_message.tool_call_id}, Output: {last_message.content}"
-            
-        # Add other relevant message info if needed
-            
+    for entry in entries:
+        result = entry["result"]
         data_for_df.append({
-            "sample_data": iter_id,
-            "result": result.result,
-            "reason": result.reason,
-            "support_data": result.support_data
+            "sample_data": entry.get("iter_id"),
+            "result": result.get("result"),
+            "reason": result.get("reason"),
+            "support_data": result.get("support_data")
         })
 
+    import pandas as pd
     df = pd.DataFrame(data_for_df)
     # format_file = state.excel_format_json_path # 旧JSONパスの使用をコメントアウト
     
@@ -102,11 +84,10 @@ def update_format_node(state: State) -> dict:
     with open(json_path, "r", encoding="utf-8") as f:  # これはLLMへの入力なので元のまま
         format_json_for_llm = f.read()
     
-    with open(state.highlighted_captures[-1], "rb") as img_file:
-        base64_image = base64.b64encode(img_file.read()).decode("utf-8")
+    form_image = prepare_image_file(state.highlighted_captures[-1], "form")
     
     # LLMに、各セルにどのようなデータを記入するか回答させる
-    llm = ChatOpenAI(model="gpt-4.1")
+    llm = get_chat_model("gpt-4.1")
     prompt = f"""
     あなたは内部監査のデータ入力担当者です。監査結果データをよく読み、
     以下の形式で、各セル番号（cell_id）と記入すべき値（value）のペアをリストで出力してください。
@@ -138,7 +119,7 @@ def update_format_node(state: State) -> dict:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}"
+                            "url": form_image.data_url()
                         }
                     }
                 ])
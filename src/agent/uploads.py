@@ -0,0 +1,337 @@
+"""
+アップロードされたファイルの保存（チャンク単位の書き込み・アーカイブの展開）
+
+ファイル全体をメモリに読み込まず、固定サイズのチャンクごとに一時ファイル（.part）へ書き込み、
+完了後にリネームする（証跡ストアを指定した場合は書き込みながらSHA-256を計算し、ストアに登録してリンクする）。複数ファイルの書き込みは同時実行数を制限して並行に行う。
+zip / tar のアーカイブはメンバーごとにストリームで展開し、1リクエストで書き込むバイト数（展開後のサイズを含む）と
+メンバー数に上限を設ける。上限を超えた場合、そのリクエストで作成したファイルは削除し、置き換えた既存のファイルは元に戻す。
+
+環境変数:
+    UPLOAD_CHUNK_SIZE: 読み込み・書き込みのチャンクサイズ（デフォルト: 1MiB）
+    UPLOAD_MAX_CONCURRENCY: 同時に書き込むファイル数（デフォルト: 4）
+    UPLOAD_MAX_REQUEST_BYTES: 1リクエストで書き込む合計バイト数の上限（デフォルト: 2GiB）
+    UPLOAD_MAX_ARCHIVE_MEMBERS: 1リクエストで展開するアーカイブのメンバー数の上限（デフォルト: 10000）
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import uuid
+import weakref
+import zipfile
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import UploadFile
+
+from agent.evidence_store import EvidenceStore
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+class UploadLimitError(ValueError):
+    """1リクエストのアップロードの上限を超えた場合の例外"""
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+def chunk_size() -> int:
+    return max(1, _env_int("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+
+@dataclass
+class UploadBudget:
+    """1リクエストで書き込めるバイト数・アーカイブのメンバー数の残り"""
+
+    max_bytes: int = field(default_factory=lambda: _env_int("UPLOAD_MAX_REQUEST_BYTES", 2 * 1024 ** 3))
+    max_members: int = field(default_factory=lambda: _env_int("UPLOAD_MAX_ARCHIVE_MEMBERS", 10000))
+    written_bytes: int = 0
+    members: int = 0
+    # 複数ファイルの書き込みスレッドから同時に加算される
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def consume(self, size: int) -> None:
+        """書き込むバイト数を加算する（上限を超えた場合は UploadLimitError）"""
+        with self._lock:
+            self.written_bytes += size
+        if self.max_bytes > 0 and self.written_bytes > self.max_bytes:
+            raise UploadLimitError(f"アップロードの合計サイズが上限（{self.max_bytes}バイト）を超えました")
+
+    def add_member(self) -> None:
+        """展開するメンバー数を加算する（上限を超えた場合は UploadLimitError）"""
+        with self._lock:
+            self.members += 1
+        if self.max_members > 0 and self.members > self.max_members:
+            raise UploadLimitError(f"アーカイブのメンバー数が上限（{self.max_members}）を超えました")
+
+def safe_join(root: str, rel_path: str) -> str:
+    """
+    アップロード時のファイル名（相対パス）を保存先ディレクトリ配下のパスに変換する
+
+    Raises:
+        ValueError: 保存先ディレクトリの外を指す場合・ファイル名が空の場合
+    """
+    rel_path = rel_path.replace("\\", "/").replace("..", "_").lstrip("/")
+    if not rel_path or rel_path.endswith("/"):
+        raise ValueError(f"不正なファイル名です: {rel_path!r}")
+    root = os.path.abspath(root)
+    save_path = os.path.abspath(os.path.join(root, rel_path))
+    if os.path.commonpath([root, save_path]) != root:
+        raise ValueError(f"保存先ディレクトリの外を指すファイル名です: {rel_path!r}")
+    return save_path
+
+@dataclass
+class UploadJournal:
+    """
+    1リクエストで作成・置き換えたファイルの記録（中止した場合に元に戻すために使用する）
+
+    既存のファイルを置き換える前に、元のファイルを退避（.bak へのハードリンクまたはコピー）しておく。
+    """
+
+    # (保存先, 退避したファイル。新規に作成した場合はNone)
+    entries: List[Tuple[str, Optional[str]]] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def backup(self, save_path: str) -> None:
+        """保存先に書き込む直前に呼び出し、既存のファイルがあれば退避する"""
+        backup_path = None
+        if os.path.exists(save_path):
+            backup_path = f"{save_path}.{uuid.uuid4().hex[:8]}.bak"
+            try:
+                os.link(save_path, backup_path)
+            except OSError:
+                shutil.copy2(save_path, backup_path)
+        with self._lock:
+            self.entries.append((save_path, backup_path))
+
+    def rollback(self, store: Optional[EvidenceStore] = None) -> None:
+        """作成したファイルを削除し、置き換えたファイルを元に戻す（後に書き込んだものから順に戻す）"""
+        with self._lock:
+            entries, self.entries = self.entries, []
+        for save_path, backup_path in reversed(entries):
+            try:
+                if backup_path is None:
+                    if store is not None:
+                        store.remove(save_path)
+                    else:
+                        _remove(save_path)
+                elif store is not None:
+                    store.restore(save_path, backup_path)
+                else:
+                    os.replace(backup_path, save_path)
+            except OSError as e:
+                logger.error(f"アップロードしたファイルを元に戻せませんでした: {save_path} ({e})")
+        if store is not None and entries:
+            # 元に戻したことで参照されなくなった実体を削除する
+            try:
+                store.collect_garbage()
+            except OSError as e:
+                logger.warning(f"証跡ストアの実体を削除できませんでした: {e}")
+
+    def commit(self) -> None:
+        """退避したファイルを削除する"""
+        with self._lock:
+            entries, self.entries = self.entries, []
+        for _, backup_path in entries:
+            if backup_path is not None:
+                _remove(backup_path)
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+def _part_path(save_path: str) -> str:
+    return f"{save_path}.{uuid.uuid4().hex[:8]}.part"
+
+def _copy_stream(
+    source: BinaryIO,
+    save_path: str,
+    root: str,
+    budget: UploadBudget,
+    journal: UploadJournal,
+    store: Optional[EvidenceStore],
+) -> Dict:
+    """
+    ストリームからファイルへチャンク単位でコピーし、完了後に保存先へリネームする（スレッドで実行）
+
+    Returns:
+        Dict: 保存したファイル（saved_path, size。証跡ストアを使用する場合は sha256, deduplicated も含む）
+    """
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    part_path = _part_path(save_path)
+    digest = hashlib.sha256() if store is not None else None
+    size = 0
+    try:
+        with open(part_path, "wb") as out:
+            while chunk := source.read(chunk_size()):
+                budget.consume(len(chunk))
+                out.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                size += len(chunk)
+        entry = {"saved_path": os.path.relpath(save_path, root), "size": size}
+        journal.backup(save_path)
+        if store is None:
+            os.replace(part_path, save_path)
+        else:
+            entry["sha256"] = digest.hexdigest()
+            entry["deduplicated"] = store.put(part_path, entry["sha256"], size, save_path)
+    except BaseException:
+        _remove(part_path)
+        raise
+    return entry
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _iter_zip_members(archive: zipfile.ZipFile) -> Iterator[Tuple[str, int, BinaryIO]]:
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        with archive.open(info) as source:
+            yield info.filename, info.file_size, source
+
+def _iter_tar_members(archive: tarfile.TarFile) -> Iterator[Tuple[str, int, BinaryIO]]:
+    # ストリームモード（r|*）のため、メンバーは先頭から順に1回だけ読み込む
+    for member in archive:
+        if not member.isfile():
+            # ディレクトリ・シンボリックリンク・デバイスファイルなどは展開しない
+            continue
+        source = archive.extractfile(member)
+        if source is not None:
+            yield member.name, member.size, source
+
+def _extract_members(
+    members: Iterator[Tuple[str, int, BinaryIO]],
+    dest_root: str,
+    dest_dir: str,
+    budget: UploadBudget,
+    journal: UploadJournal,
+    store: Optional[EvidenceStore],
+    results: List[Dict],
+) -> None:
+    for member_name, declared_size, member_source in members:
+        budget.add_member()
+        # 宣言サイズで先に判定し、展開中も実際に書き込んだバイト数で判定する（圧縮爆弾対策）
+        if budget.max_bytes > 0 and budget.written_bytes + declared_size > budget.max_bytes:
+            raise UploadLimitError(f"アーカイブの展開後のサイズが上限（{budget.max_bytes}バイト）を超えました")
+        save_path = safe_join(dest_root, os.path.join(dest_dir, member_name))
+        results.append(_copy_stream(member_source, save_path, dest_root, budget, journal, store))
+
+def extract_archive(
+    source: BinaryIO,
+    filename: str,
+    dest_root: str,
+    dest_dir: str,
+    budget: UploadBudget,
+    store: Optional[EvidenceStore] = None,
+    journal: Optional[UploadJournal] = None,
+) -> List[Dict]:
+    """
+    アーカイブ（zip / tar）をメンバーごとにストリームで展開する（スレッドで実行）
+
+    Args:
+        source (BinaryIO): アーカイブのストリーム（zipの場合はシーク可能であること）
+        filename (str): アーカイブのファイル名（形式の判定に使用）
+        dest_root (str): 保存先のルートディレクトリ（展開先はこの配下に限定する）
+        dest_dir (str): 展開先のディレクトリ（dest_root からの相対パス）
+        budget (UploadBudget): リクエストの書き込み上限
+        store (Optional[EvidenceStore]): 証跡ストア（未指定の場合は通常のファイルとして保存する）
+        journal (Optional[UploadJournal]): リクエストの書き込みの記録（指定した場合、中止時に元に戻すのは呼び出し側）
+
+    Returns:
+        List[Dict]: 展開したファイルのリスト
+    """
+    own_journal = journal is None
+    journal = journal or UploadJournal()
+    results: List[Dict] = []
+    try:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(source) as archive:
+                _extract_members(_iter_zip_members(archive), dest_root, dest_dir, budget, journal, store, results)
+        else:
+            with tarfile.open(fileobj=source, mode="r|*") as archive:
+                _extract_members(_iter_tar_members(archive), dest_root, dest_dir, budget, journal, store, results)
+    except BaseException as e:
+        # 途中まで展開したファイルは削除し、置き換えたファイルは元に戻す
+        if own_journal:
+            journal.rollback(store)
+        if isinstance(e, (zipfile.BadZipFile, tarfile.TarError)):
+            raise ValueError(f"アーカイブを展開できません: {filename} ({e})") from e
+        raise
+    if own_journal:
+        journal.commit()
+    logger.info(f"アーカイブを展開しました: {filename} ({len(results)}ファイル)")
+    return results
+
+# 書き込みの同時実行数を制限するセマフォ（イベントループごとにプロセス内で共有）
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(max(1, _env_int("UPLOAD_MAX_CONCURRENCY", 4)))
+    return _semaphores[loop]
+
+async def _save_one(
+    file: UploadFile,
+    root: str,
+    budget: UploadBudget,
+    journal: UploadJournal,
+    extract_archives: bool,
+    store: Optional[EvidenceStore],
+) -> List[Dict]:
+    async with _get_semaphore():
+        if extract_archives and is_archive(file.filename or ""):
+            dest_dir = os.path.dirname(file.filename.replace("\\", "/"))
+            # UploadFile の実体はシーク可能な一時ファイル（SpooledTemporaryFile）のため、zipもそのまま展開できる
+            return await asyncio.to_thread(
+                extract_archive, file.file, file.filename, root, dest_dir, budget, store, journal
+            )
+        save_path = safe_join(root, file.filename or "")
+        return [await asyncio.to_thread(_copy_stream, file.file, save_path, root, budget, journal, store)]
+
+async def save_uploads(
+    files: List[UploadFile],
+    root: str,
+    extract_archives: bool = False,
+    budget: Optional[UploadBudget] = None,
+    store: Optional[EvidenceStore] = None,
+) -> List[Dict]:
+    """
+    アップロードされたファイルを保存先ディレクトリへ保存する
+
+    Args:
+        files (List[UploadFile]): アップロードされたファイル（filename は保存先からの相対パス）
+        root (str): 保存先ディレクトリ
+        extract_archives (bool): zip / tar を展開して保存するか
+        budget (Optional[UploadBudget]): リクエストの書き込み上限（未指定の場合は環境変数の設定値）
+        store (Optional[EvidenceStore]): 証跡ストア（指定した場合は内容ごとに1つの実体を保存してリンクする）
+
+    Returns:
+        List[Dict]: 保存したファイル（saved_path, size。証跡ストアを使用する場合は sha256, deduplicated も含む）のリスト（アップロード順）
+
+    Raises:
+        UploadLimitError: 上限を超えた場合（このリクエストで作成したファイルは削除し、置き換えたファイルは元に戻す）
+        ValueError: ファイル名・アーカイブが不正な場合（同上）
+    """
+    budget = budget or UploadBudget()
+    journal = UploadJournal()
+    outcomes = await asyncio.gather(
+        *[_save_one(file, root, budget, journal, extract_archives, store) for file in files],
+        return_exceptions=True,
+    )
+    errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+    if errors:
+        written = len(journal.entries)
+        await asyncio.to_thread(journal.rollback, store)
+        logger.warning(f"アップロードを中止しました（書き込み済みの {written} ファイルを元に戻しました）: {errors[0]}")
+        raise errors[0]
+    await asyncio.to_thread(journal.commit)
+    return [entry for outcome in outcomes for entry in outcome]
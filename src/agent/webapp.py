@@ -1,51 +1,173 @@
-from typing import List
-from fastapi import FastAPI, File, UploadFile
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
 import os
 import asyncio
 
+from agent.batch_jobs import get_batch_manager
+from agent.metrics import registry
+from agent.evidence_store import get_evidence_store
+from agent.uploads import UploadLimitError, safe_join, save_uploads
+
 app = FastAPI()
 
 UPLOAD_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data", "sample")
 UPLOAD_ROOT_FORMAT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data", "format")
+BATCH_OUTPUT_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data", "batches")
 
-def save_file(save_path: str, content: bytes):
-    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-    with open(save_path, "wb") as f:
-        f.write(content)
+# バッチのジョブごとに指定できる State の設定（パス・共有キャッシュの設定はサーバー側で決める）
+BATCH_JOB_OPTIONS = {
+    "max_iterations",
+    "parallel_samples",
+    "max_concurrency",
+    "sample_memory_limit_bytes",
+    "pdf_evidence_mode",
+    "pdf_top_k_pages",
+    "page_cache_enabled",
+    "excel_max_iterations",
+    "excel_capture_backend",
+    "excel_format_model",
+    "excel_validation_mode",
+    "excel_format_cache_enabled",
+    "excel_format_cache_refresh",
+}
 
-@app.post("/upload-folder/")
-async def upload_folder(files: List[UploadFile] = File(...)):
-    results = []
-    for file in files:
-        content = await file.read()
-        rel_path = file.filename.replace("..", "_").lstrip("/\\")
-        save_path = os.path.join(UPLOAD_ROOT, rel_path)
-        await asyncio.to_thread(save_file, save_path, content)
-        results.append({
-            "saved_path": os.path.relpath(save_path, UPLOAD_ROOT),
-            "size": len(content)
-        })
+class BatchJobRequest(BaseModel):
+    """バッチの1ジョブ（テストフォルダ・監査手続き・Excelフォーマット）"""
+
+    sample_data_path: str = Field(description="テストフォルダ（data/sample からの相対パス）")
+    procedure: str = Field(description="監査手続き")
+    format_path: str = Field(description="Excelフォーマット（data/format からの相対パス）")
+    options: Dict[str, Any] = Field(default_factory=dict, description="グラフの State に渡す追加の設定（BATCH_JOB_OPTIONS のキーのみ。parallel_samples, excel_capture_backend など）")
+
+class BatchRequest(BaseModel):
+    jobs: List[BatchJobRequest] = Field(min_length=1)
+
+class ResumeRequest(BaseModel):
+    response: Any = Field(description="query_to_human への人間の応答")
+
+async def _save_uploads(files: List[UploadFile], root: str, extract_archives: bool, store=None) -> dict:
+    """アップロードされたファイルをチャンク単位で保存する（上限超過は413、不正なファイル名・アーカイブは400）"""
+    try:
+        results = await save_uploads(files, root, extract_archives=extract_archives, store=store)
+    except UploadLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"files": results}
 
+@app.post("/upload-folder/")
+async def upload_folder(files: List[UploadFile] = File(...), extract_archives: bool = False):
+    """サンプルデータをアップロードする（extract_archives=true の場合は zip / tar を展開して保存）"""
+    # 同じ内容のファイルは証跡ストアに1つだけ保存し、サンプルフォルダにはリンクを作成する
+    store = await asyncio.to_thread(get_evidence_store, UPLOAD_ROOT)
+    return await _save_uploads(files, UPLOAD_ROOT, extract_archives, store)
+
 @app.post("/upload-format/")
-async def upload_format(files: List[UploadFile] = File(...)):
-    results = []
-    for file in files:
-        content = await file.read()
-        rel_path = file.filename.replace("..", "_").lstrip("/\\")
-        save_path = os.path.join(UPLOAD_ROOT_FORMAT, rel_path)
-        await asyncio.to_thread(save_file, save_path, content)
-        results.append({
-            "saved_path": os.path.relpath(save_path, UPLOAD_ROOT_FORMAT),
-            "size": len(content)
-        })
-    return {"files": results}
+async def upload_format(files: List[UploadFile] = File(...), extract_archives: bool = False):
+    """Excelフォーマットをアップロードする（extract_archives=true の場合は zip / tar を展開して保存）"""
+    return await _save_uploads(files, UPLOAD_ROOT_FORMAT, extract_archives)
 
 @app.get("/list-folders/")
-async def list_folders():
+async def list_folders(refresh: bool = False):
+    """サンプルフォルダの一覧（証跡ストアのインデックスから取得。refresh=true の場合はフォルダを走査して作り直し、参照されていない実体を削除する）"""
     def get_folders():
-        if not os.path.exists(UPLOAD_ROOT):
-            return []
-        return [entry.name for entry in os.scandir(UPLOAD_ROOT) if entry.is_dir()]
+        store = get_evidence_store(UPLOAD_ROOT)
+        if refresh:
+            store.rebuild_index()
+            store.collect_garbage()
+        return store.list_folders()
     folders = await asyncio.to_thread(get_folders)
-    return {"folders": folders} 
\ No newline at end of file
+    return {"folders": folders}
+
+@app.get("/list-files/")
+async def list_files(folder: Optional[str] = None):
+    """サンプルフォルダ内のファイル（パス・サイズ・SHA-256）の一覧と、重複排除後の使用量"""
+    def get_files():
+        store = get_evidence_store(UPLOAD_ROOT)
+        return {"files": store.list_files(folder), "usage": store.usage()}
+    return await asyncio.to_thread(get_files)
+
+def _batch_job_input(job: BatchJobRequest) -> Dict[str, Any]:
+    """バッチのジョブをグラフの入力に変換する（キャッシュはジョブ間で共有する。不正なパス・設定は400）"""
+    unknown = sorted(set(job.options) - BATCH_JOB_OPTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"指定できない設定です: {', '.join(unknown)}")
+    try:
+        sample_dir = safe_join(UPLOAD_ROOT, job.sample_data_path.rstrip("/\\"))
+        format_path = safe_join(UPLOAD_ROOT_FORMAT, job.format_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.isdir(sample_dir):
+        raise HTTPException(status_code=400, detail=f"テストフォルダがありません: {job.sample_data_path}")
+    if not os.path.isfile(format_path):
+        raise HTTPException(status_code=400, detail=f"Excelフォーマットがありません: {job.format_path}")
+    return {
+        **job.options,
+        "page_cache_dir": os.path.join(BATCH_OUTPUT_ROOT, "page_cache"),
+        "excel_format_cache_dir": os.path.join(BATCH_OUTPUT_ROOT, "format_cache"),
+        "sample_root": UPLOAD_ROOT,
+        "sample_data_path": os.path.relpath(sample_dir, os.path.abspath(UPLOAD_ROOT)),
+        "procedure": job.procedure,
+        "format_path": format_path,
+        "excel_file": format_path,
+    }
+
+@app.post("/batches/")
+async def create_batch(request: BatchRequest):
+    """複数の監査ジョブを1つのバッチとして受け付け、ワーカープールで実行する（進捗は GET /batches/{batch_id} で参照）"""
+    graph_inputs = [_batch_job_input(job) for job in request.jobs]
+    return await asyncio.to_thread(get_batch_manager().submit, graph_inputs, BATCH_OUTPUT_ROOT)
+
+@app.get("/batches/")
+async def list_batches():
+    """バッチの一覧（ジョブ数・状態ごとの件数・所要時間）"""
+    return {"batches": get_batch_manager().list_batches()}
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """バッチの進捗（ジョブごとの状態・サンプルの完了数・所要時間）"""
+    try:
+        return get_batch_manager().get_batch(batch_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"バッチがありません: {batch_id}")
+
+@app.get("/batches/{batch_id}/jobs/{job_id}")
+async def get_batch_job(batch_id: str, job_id: str):
+    """ジョブの進捗（サンプルごとの状態・判定結果・所要時間）"""
+    try:
+        return get_batch_manager().get_job(batch_id, job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"ジョブがありません: {job_id}")
+
+@app.post("/batches/{batch_id}/jobs/{job_id}/resume")
+async def resume_batch_job(batch_id: str, job_id: str, request: ResumeRequest):
+    """query_to_human で中断したジョブを、人間の応答を渡して再開する"""
+    try:
+        return get_batch_manager().resume(batch_id, job_id, request.response)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"ジョブがありません: {job_id}")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str):
+    """バッチのうち、開始前・中断中のジョブを取り消す"""
+    try:
+        return get_batch_manager().cancel(batch_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"バッチがありません: {batch_id}")
+
+@app.get("/metrics/json")
+async def metrics_json(run_id: Optional[str] = None):
+    """実行ごとの計測結果（run_id を指定した場合はその実行のみ）"""
+    snapshot = registry.snapshot(run_id)
+    if run_id is not None and not snapshot:
+        raise HTTPException(status_code=404, detail=f"run_id '{run_id}' の計測結果がありません")
+    return snapshot
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_prometheus():
+    """実行ごとの計測結果（Prometheusのテキスト形式）"""
+    return PlainTextResponse(registry.to_prometheus(), media_type="text/plain; version=0.0.4")
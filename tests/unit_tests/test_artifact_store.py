@@ -0,0 +1,52 @@
+import base64
+import os
+import time
+
+import pytest
+
+from agent.artifact_store import ArtifactNotFoundError, ArtifactStore, parse_artifact_ref
+
+
+def test_put_deduplicates_and_resolves_to_data_url(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    ref = store.put(b"png-bytes", "image/png")
+
+    assert store.put(b"png-bytes", "image/png") == ref
+    assert os.listdir(store.root) == [parse_artifact_ref(ref)[0]]
+    message = {"content": [{"type": "image_url", "image_url": {"url": ref}}, {"type": "text", "text": "x"}]}
+    resolved = store.resolve(message)
+    assert resolved["content"][0]["image_url"]["url"] == f"data:image/png;base64,{base64.b64encode(b'png-bytes').decode()}"
+    assert message["content"][0]["image_url"]["url"] == ref
+
+
+def test_least_recently_used_artifacts_are_evicted_over_budget(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"), max_bytes=1000)
+    refs = [store.put(bytes([i]) * 100, "image/png") for i in range(10)]
+    assert len(os.listdir(store.root)) == 10
+
+    # 保存順に最終参照時刻を並べ、最初の1つは読み込みで最終参照時刻を更新する
+    base = time.time() - 100
+    for i, ref in enumerate(refs):
+        path = store.path(parse_artifact_ref(ref)[0])
+        os.utime(path, (base + i, base + i))
+    store.get(refs[0])
+
+    store.put(bytes([10]) * 100, "image/png")
+
+    assert store.get(refs[0]) == bytes([0]) * 100
+    for ref in refs[1:3]:
+        with pytest.raises(ArtifactNotFoundError):
+            store.get(ref)
+    assert len(os.listdir(store.root)) == 9
+
+
+def test_get_reads_artifacts_saved_in_subdirectories(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    ref = store.put(b"legacy", "image/png")
+    sha256, _ = parse_artifact_ref(ref)
+    os.makedirs(os.path.join(store.root, sha256[:2]))
+    os.replace(store.path(sha256), os.path.join(store.root, sha256[:2], sha256))
+
+    assert store.get(ref) == b"legacy"
+    with pytest.raises(ArtifactNotFoundError):
+        store.get("artifact://missing?type=image/png")
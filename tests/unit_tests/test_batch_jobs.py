@@ -0,0 +1,92 @@
+from typing import Any, Optional, TypedDict
+
+import pytest
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import interrupt
+
+from agent.batch_jobs import COMPLETED, FAILED, INTERRUPTED, BatchJobManager
+from agent.checkpointer import SqliteCheckpointSaver
+
+
+class _State(TypedDict, total=False):
+    procedure: str
+    output_dir: str
+    output_excel_path: Optional[str]
+
+
+def _query_to_human(state: _State) -> dict:
+    # agent.graph の query_to_human と同じく HumanResponse のリストを受け取る
+    responses: Any = interrupt({"question": f"{state['procedure']} の確認"})
+    return {"output_excel_path": f"{state['output_dir']}/{responses[0]['args']}.xlsx"}
+
+
+def _manager(path: str) -> BatchJobManager:
+    checkpointer = SqliteCheckpointSaver(path)
+    manager = BatchJobManager(max_workers=1, checkpointer=checkpointer)
+    builder = StateGraph(_State)
+    builder.add_node("query_to_human", _query_to_human)
+    builder.add_edge(START, "query_to_human")
+    builder.add_edge("query_to_human", END)
+    manager._graph = builder.compile(checkpointer=checkpointer)
+    return manager
+
+
+def _wait(manager: BatchJobManager, batch_id: str, job_id: str) -> dict:
+    manager._get_job(batch_id, job_id).future.result(timeout=10)
+    return manager.get_job(batch_id, job_id)
+
+
+@pytest.fixture
+def db_path(tmp_path) -> str:
+    return str(tmp_path / "checkpoints.sqlite")
+
+
+def _submit(manager: BatchJobManager, tmp_path) -> tuple:
+    batch = manager.submit([{"procedure": "手続き"}], str(tmp_path / "batches"))
+    batch_id, job_id = batch["batch_id"], batch["jobs"][0]["job_id"]
+    job = _wait(manager, batch_id, job_id)
+    assert job["status"] == INTERRUPTED
+    assert job["interrupts"] == [{"question": "手続き の確認"}]
+    return batch_id, job_id
+
+
+def test_interrupted_job_resumes_with_human_response(db_path, tmp_path):
+    manager = _manager(db_path)
+    batch_id, job_id = _submit(manager, tmp_path)
+
+    manager.resume(batch_id, job_id, "approved")
+    job = _wait(manager, batch_id, job_id)
+
+    assert job["status"] == COMPLETED
+    assert job["output_excel_path"].endswith("/approved.xlsx")
+    assert job["interrupts"] == []
+    # 完了したジョブのチェックポイントは削除する
+    assert manager.checkpointer.get_tuple(manager._get_job(batch_id, job_id).config) is None
+    with pytest.raises(ValueError):
+        manager.resume(batch_id, job_id, "again")
+
+
+def test_interrupted_job_resumes_after_restart(db_path, tmp_path):
+    batch_id, job_id = _submit(_manager(db_path), tmp_path)
+
+    restarted = _manager(db_path)
+    assert restarted.get_job(batch_id, job_id)["status"] == INTERRUPTED
+    restarted.resume(batch_id, job_id, "after-restart")
+    job = _wait(restarted, batch_id, job_id)
+
+    assert job["status"] == COMPLETED
+    assert job["output_excel_path"].endswith("/after-restart.xlsx")
+
+
+def test_running_job_is_failed_after_restart(db_path, tmp_path):
+    manager = _manager(db_path)
+    batch_id, job_id = _submit(manager, tmp_path)
+    job = manager._get_job(batch_id, job_id)
+    job.status = "running"
+    manager._save(job)
+
+    restarted = _manager(db_path)
+    job = restarted.get_job(batch_id, job_id)
+    assert job["status"] == FAILED
+    assert job["finished_at"] is not None
+    assert restarted.checkpointer.get_tuple(restarted._get_job(batch_id, job_id).config) is None
@@ -0,0 +1,121 @@
+import operator
+from typing import Annotated, List, TypedDict
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.types import TASKS
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import Command, Send, interrupt
+
+from agent.checkpointer import SqliteCheckpointSaver
+
+
+@pytest.fixture
+def saver(tmp_path) -> SqliteCheckpointSaver:
+    return SqliteCheckpointSaver(str(tmp_path / "checkpoints.sqlite"))
+
+
+def _config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+
+
+def _checkpoint(values: dict, versions: dict) -> dict:
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = values
+    checkpoint["channel_versions"] = versions
+    return checkpoint
+
+
+def _rows(saver: SqliteCheckpointSaver, channel: str) -> int:
+    return saver._conn.execute("SELECT COUNT(*) FROM channel_values WHERE channel = ?", (channel,)).fetchone()[0]
+
+
+def test_put_writes_only_updated_channels(saver):
+    evidence = "証跡" * 5000
+    first = saver.put(
+        _config("t1"),
+        _checkpoint({"evidence": evidence, "count": 1}, {"evidence": "1", "count": "1"}),
+        {"step": 0},
+        {"evidence": "1", "count": "1"},
+    )
+    second = saver.put(
+        first,
+        _checkpoint({"evidence": evidence, "count": 2}, {"evidence": "1", "count": "2"}),
+        {"step": 1},
+        {"count": "2"},
+    )
+
+    # 更新されていないチャネルは以前のバージョンを参照し、書き込まない
+    assert (_rows(saver, "evidence"), _rows(saver, "count")) == (1, 2)
+    assert saver.get_tuple(second).checkpoint["channel_values"] == {"evidence": evidence, "count": 2}
+    assert saver.get_tuple(first).checkpoint["channel_values"] == {"evidence": evidence, "count": 1}
+    assert saver.get_tuple(_config("t1")).parent_config["configurable"]["checkpoint_id"] == first["configurable"]["checkpoint_id"]
+
+
+def test_pending_sends_are_rebuilt_from_parent_task_writes(saver):
+    parent = saver.put(_config("t1"), _checkpoint({}, {}), {"step": 0}, {})
+    sends = [Send("sample_worker_node", {"sample_data": "サンプル1"}), Send("sample_worker_node", {"sample_data": "サンプル2"})]
+    saver.put_writes(parent, [(TASKS, send) for send in sends], task_id="route", task_path="~__pregel_pull, route")
+    child = saver.put(parent, _checkpoint({}, {}), {"step": 1}, {})
+
+    assert saver.get_tuple(child).checkpoint["pending_sends"] == sends
+    assert saver.get_tuple(parent).checkpoint["pending_sends"] == []
+    assert [write[1] for write in saver.get_tuple(parent).pending_writes] == [TASKS, TASKS]
+
+
+def test_delete_thread_keeps_values_shared_with_other_threads(saver):
+    shared = "同じ証跡" * 1000
+    for thread_id in ("t1", "t2"):
+        saver.put(_config(thread_id), _checkpoint({"evidence": shared}, {"evidence": "1"}), {}, {"evidence": "1"})
+    assert saver.usage()["blobs"] == 1
+
+    saver.delete_thread("t1")
+    assert saver.get_tuple(_config("t1")) is None
+    assert saver.get_tuple(_config("t2")).checkpoint["channel_values"] == {"evidence": shared}
+
+    saver.delete_thread("t2")
+    assert saver.usage() == {"checkpoints": 0, "blobs": 0, "blob_bytes": 0}
+
+
+def test_job_records_are_listed_in_creation_order(saver):
+    saver.put_job("job-2", "batch-b", 2.0, {"job_id": "job-2", "status": "queued"})
+    saver.put_job("job-1", "batch-a", 1.0, {"job_id": "job-1", "status": "queued"})
+    saver.put_job("job-1", "batch-a", 1.0, {"job_id": "job-1", "status": "completed"})
+
+    assert saver.list_jobs() == [{"job_id": "job-1", "status": "completed"}, {"job_id": "job-2", "status": "queued"}]
+    saver.delete_batch("batch-a")
+    assert [record["job_id"] for record in saver.list_jobs()] == ["job-2"]
+
+
+class _State(TypedDict, total=False):
+    samples: List[str]
+    results: Annotated[List[str], operator.add]
+
+
+def _worker(state: dict) -> dict:
+    # query_to_human と同じく、サンプルごとに人間の応答で中断する
+    answer = interrupt({"sample": state["sample"]})
+    return {"results": [f"{state['sample']}:{answer}"]}
+
+
+def _build(checkpointer):
+    builder = StateGraph(_State)
+    builder.add_node("worker", _worker)
+    builder.add_conditional_edges(START, lambda state: [Send("worker", {"sample": s}) for s in state["samples"]], ["worker"])
+    builder.add_edge("worker", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def test_fan_out_with_interrupts_matches_in_memory_saver(saver):
+    outputs = []
+    for checkpointer in (InMemorySaver(), saver):
+        graph = _build(checkpointer)
+        config = {"configurable": {"thread_id": "run"}}
+        graph.invoke({"samples": ["サンプル1", "サンプル2"]}, config)
+        interrupts = graph.get_state(config).tasks
+        resume = {task.interrupts[0].interrupt_id: "OK" for task in interrupts}
+        outputs.append(graph.invoke(Command(resume=resume), config))
+
+    assert outputs[0] == outputs[1]
+    assert sorted(outputs[1]["results"]) == ["サンプル1:OK", "サンプル2:OK"]
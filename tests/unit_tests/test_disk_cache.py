@@ -0,0 +1,71 @@
+import os
+from pathlib import Path
+
+from agent import disk_cache
+from agent.disk_cache import evict_lru
+
+
+def _write_entry(cache_dir: Path, name: str, size: int, mtime: float) -> Path:
+    path = cache_dir / name
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evict_lru_removes_oldest_entries_until_under_max_bytes(tmp_path):
+    old = _write_entry(tmp_path, "old", 100, 1000)
+    middle = _write_entry(tmp_path, "middle", 100, 2000)
+    new = _write_entry(tmp_path, "new", 100, 3000)
+
+    assert evict_lru(tmp_path, max_bytes=250) == 1
+    assert not old.exists()
+    assert middle.exists() and new.exists()
+
+
+def test_evict_lru_limits_entries_and_keeps_protected_entries(tmp_path):
+    old = _write_entry(tmp_path, "old", 10, 1000)
+    middle = _write_entry(tmp_path, "middle", 10, 2000)
+    new = _write_entry(tmp_path, "new", 10, 3000)
+
+    assert evict_lru(tmp_path, max_entries=1, keep=[old]) == 2
+    assert old.exists()
+    assert not middle.exists() and not new.exists()
+
+
+def test_evict_lru_counts_directory_entries_and_skips_temporary_entries(tmp_path):
+    entry_dir = tmp_path / "entry"
+    (entry_dir / "captures").mkdir(parents=True)
+    (entry_dir / "captures" / "capture_1.png").write_bytes(b"x" * 300)
+    os.utime(entry_dir, (1000, 1000))
+    tmp_entry = _write_entry(tmp_path, ".tmp_writing", 1000, 500)
+    new = _write_entry(tmp_path, "new", 10, 3000)
+
+    assert evict_lru(tmp_path, max_bytes=100) == 1
+    assert not entry_dir.exists()
+    assert tmp_entry.exists() and new.exists()
+
+
+def test_evict_lru_tolerates_entries_removed_concurrently(tmp_path, monkeypatch):
+    vanished_on_scan = _write_entry(tmp_path, "vanished_on_scan", 100, 1000)
+    vanished_on_delete = _write_entry(tmp_path, "vanished_on_delete", 100, 2000)
+    new = _write_entry(tmp_path, "new", 100, 3000)
+    original_entry_size = disk_cache.entry_size
+
+    def entry_size(path: Path) -> int:
+        if path == vanished_on_scan:
+            # 走査中に他のワーカーが削除した
+            path.unlink()
+        size = original_entry_size(path)
+        if path == vanished_on_delete:
+            # 走査後、削除前に他のワーカーが削除した
+            path.unlink()
+        return size
+
+    monkeypatch.setattr(disk_cache, "entry_size", entry_size)
+
+    assert evict_lru(tmp_path, max_bytes=100) == 0
+    assert new.exists()
+
+
+def test_evict_lru_ignores_missing_cache_dir(tmp_path):
+    assert evict_lru(tmp_path / "missing", max_bytes=1) == 0
@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import io
+import os
+import stat
+
+import pytest
+from fastapi import UploadFile
+
+from agent.evidence_store import EvidenceStore
+from agent.uploads import save_uploads
+
+
+@pytest.fixture
+def store(tmp_path) -> EvidenceStore:
+    return EvidenceStore(str(tmp_path / "sample"), store_dir=str(tmp_path / "store"))
+
+
+def _put(store: EvidenceStore, rel_path: str, data: bytes) -> bool:
+    dest_path = os.path.join(store.root, rel_path)
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    part_path = f"{dest_path}.part"
+    with open(part_path, "wb") as f:
+        f.write(data)
+    return store.put(part_path, hashlib.sha256(data).hexdigest(), len(data), dest_path)
+
+
+def _blobs(store: EvidenceStore) -> list:
+    return sorted(name for _, _, filenames in os.walk(store.blobs_dir) for name in filenames)
+
+
+def test_same_content_is_stored_once(store):
+    assert _put(store, "テスト1/a.pdf", b"same") is False
+    assert _put(store, "テスト2/a.pdf", b"same") is True
+
+    assert _blobs(store) == [hashlib.sha256(b"same").hexdigest()]
+    assert store.list_folders() == ["テスト1", "テスト2"]
+    assert store.usage() == {"files": 2, "logical_bytes": 8, "stored_bytes": 4}
+
+
+def test_linked_files_stay_writable_and_can_be_replaced(store):
+    _put(store, "テスト1/a.pdf", b"old")
+    dest_path = os.path.join(store.root, "テスト1", "a.pdf")
+    # 読み取り専用にすると Windows では置き換え・削除ができないため、書き込み可能のままにする
+    assert os.stat(dest_path).st_mode & stat.S_IWUSR
+
+    _put(store, "テスト1/a.pdf", b"new")
+    with open(dest_path, "rb") as f:
+        assert f.read() == b"new"
+    store.remove(dest_path)
+    assert store.list_files() == []
+
+
+def test_collect_garbage_removes_only_unreferenced_blobs(store):
+    _put(store, "テスト1/a.pdf", b"kept")
+    _put(store, "テスト1/b.pdf", b"dropped")
+    store.remove(os.path.join(store.root, "テスト1", "b.pdf"))
+
+    assert store.collect_garbage() == 1
+    assert _blobs(store) == [hashlib.sha256(b"kept").hexdigest()]
+
+
+def test_rollback_collects_blobs_of_the_aborted_upload(store):
+    files = [
+        UploadFile(file=io.BytesIO(b"orphan"), filename="テスト1/a.pdf"),
+        UploadFile(file=io.BytesIO(b""), filename="テスト1/"),
+    ]
+    with pytest.raises(ValueError):
+        asyncio.run(save_uploads(files, store.root, store=store))
+
+    assert _blobs(store) == []
+    assert store.list_files() == []
@@ -0,0 +1,82 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from agent import format_cache
+from agent.format_cache import load_format_result, make_cache_key, store_format_result
+
+BASE_SETTINGS = ("soffice", "gpt-4.1-mini", 5, "concurrent")
+
+
+@pytest.fixture
+def template(tmp_path) -> str:
+    path = tmp_path / "template.xlsx"
+    path.write_bytes(b"template")
+    return str(path)
+
+
+def test_make_cache_key_depends_on_template_content_not_path(tmp_path, template):
+    copy = tmp_path / "copy.xlsx"
+    copy.write_bytes(b"template")
+    other = tmp_path / "other.xlsx"
+    other.write_bytes(b"other template")
+
+    assert make_cache_key(template, *BASE_SETTINGS) == make_cache_key(str(copy), *BASE_SETTINGS)
+    assert make_cache_key(template, *BASE_SETTINGS) != make_cache_key(str(other), *BASE_SETTINGS)
+
+
+@pytest.mark.parametrize("index, value", [(0, "native"), (1, "gpt-4.1"), (2, 3), (3, "combined")])
+def test_make_cache_key_changes_with_each_setting(template, index, value):
+    settings = list(BASE_SETTINGS)
+    settings[index] = value
+    assert make_cache_key(template, *settings) != make_cache_key(template, *BASE_SETTINGS)
+
+
+def _write_result(output_dir: Path) -> tuple:
+    output_dir.mkdir(parents=True)
+    final_json = output_dir / format_cache.FINAL_JSON_FILE
+    final_json.write_text(json.dumps({"A1": "氏名"}, ensure_ascii=False), encoding="utf-8")
+    capture = output_dir / "highlighted.png"
+    capture.write_bytes(b"png")
+    return str(final_json), [str(capture)]
+
+
+def test_store_and_load_copies_the_entry_into_the_run_output(tmp_path, template):
+    cache_dir = str(tmp_path / "cache")
+    key = make_cache_key(template, *BASE_SETTINGS)
+    final_json, captures = _write_result(tmp_path / "run1")
+    assert store_format_result(cache_dir, key, final_json, captures) is not None
+
+    dest_dir = tmp_path / "run2" / "format_data"
+    cached = load_format_result(cache_dir, key, str(dest_dir))
+
+    assert cached["estimated_fields"] == {"A1": "氏名"}
+    assert Path(cached["final_json"]).parent == dest_dir
+    assert [Path(path).parent for path in cached["highlighted_captures"]] == [dest_dir / format_cache.CAPTURES_DIR]
+    assert Path(cached["highlighted_captures"][0]).read_bytes() == b"png"
+
+
+def test_load_format_result_misses_when_capture_is_missing(tmp_path, template):
+    cache_dir = str(tmp_path / "cache")
+    key = make_cache_key(template, *BASE_SETTINGS)
+    final_json, captures = _write_result(tmp_path / "run1")
+    store_format_result(cache_dir, key, final_json, captures)
+    for capture in (Path(cache_dir) / key / format_cache.CAPTURES_DIR).iterdir():
+        capture.unlink()
+
+    assert load_format_result(cache_dir, key) is None
+
+
+def test_store_format_result_survives_eviction_failure(tmp_path, template, monkeypatch):
+    def failing_evict_lru(*args, **kwargs):
+        raise OSError("disk error")
+
+    monkeypatch.setattr(format_cache, "evict_lru", failing_evict_lru)
+    key = make_cache_key(template, *BASE_SETTINGS)
+    final_json, captures = _write_result(tmp_path / "run1")
+
+    stored = store_format_result(str(tmp_path / "cache"), key, final_json, captures)
+
+    assert stored is not None
+    assert stored["estimated_fields"] == {"A1": "氏名"}
@@ -0,0 +1,77 @@
+import openpyxl
+import pytest
+
+from agent import highlight_session
+from agent.highlight_session import HighlightSession, close_highlight_session, use_highlight_session
+
+
+@pytest.fixture
+def excel_file(tmp_path) -> str:
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Sheet1"
+    sheet["A1"] = "氏名"
+    sheet.merge_cells("C1:D1")
+    workbook.create_sheet("Sheet2")["A1"] = "住所"
+    path = tmp_path / "template.xlsx"
+    workbook.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def closed(monkeypatch) -> list:
+    closed_sessions = []
+    monkeypatch.setattr(HighlightSession, "close", lambda self: closed_sessions.append(self))
+    monkeypatch.setattr(highlight_session, "_sessions", highlight_session.OrderedDict())
+    return closed_sessions
+
+
+def test_apply_highlights_and_restores_only_the_difference(excel_file):
+    session = HighlightSession(excel_file)
+    sheet = session.workbook["Sheet1"]
+
+    assert session.apply(["A1", "B2", "D1"]) == ["Sheet1", "Sheet2"]
+    assert sheet["A1"].value == "A1:氏名"
+    assert sheet["B2"].value == "B2"
+    # 結合セルの左上以外は書き換えずにスキップする
+    assert "D1" not in session.highlighted["Sheet1"]
+
+    assert session.apply(["B2"]) == ["Sheet1", "Sheet2"]
+    assert sheet["A1"].value == "氏名"
+    assert sheet["A1"].fill.fill_type is None
+    assert session.apply(["B2"]) == []
+
+
+def test_sessions_in_use_are_not_evicted(excel_file, closed, monkeypatch):
+    monkeypatch.setattr(highlight_session, "MAX_SESSIONS", 1)
+
+    with use_highlight_session(None, excel_file) as (first_id, first):
+        with use_highlight_session(None, excel_file) as (second_id, second):
+            assert closed == []
+        # 2つ目は使用中でなくなったが、1つ目が使用中のため上限を超えたまま保持する
+        assert set(highlight_session._sessions) == {first_id, second_id}
+
+        with use_highlight_session(None, excel_file) as (third_id, _):
+            pass
+    # 使用中でない古いセッションから破棄する
+    assert closed == [second]
+    assert set(highlight_session._sessions) == {first_id, third_id}
+    assert first not in closed
+
+
+def test_close_while_in_use_is_deferred_until_release(excel_file, closed):
+    with use_highlight_session("owned", excel_file) as (_, session):
+        close_highlight_session("owned")
+        assert closed == []
+        with use_highlight_session("owned") as (_, missing):
+            assert missing is None
+    assert closed == [session]
+
+
+def test_close_idle_session_closes_immediately(excel_file, closed):
+    with use_highlight_session("owned", excel_file) as (_, session):
+        pass
+    close_highlight_session("owned")
+    assert closed == [session]
+    close_highlight_session("owned")
+    assert closed == [session]
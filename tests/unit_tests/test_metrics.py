@@ -0,0 +1,29 @@
+import uuid
+
+from langchain_core.runnables.config import var_child_runnable_config
+
+from agent.metrics import DEFAULT_RUN_ID, current_run_id
+
+
+def _run_id_under(config: dict) -> str:
+    token = var_child_runnable_config.set(config)
+    try:
+        return current_run_id()
+    finally:
+        var_child_runnable_config.reset(token)
+
+
+def test_run_id_prefers_top_level_run_id_over_thread_id():
+    run_id = uuid.uuid4()
+    assert _run_id_under({"run_id": run_id, "configurable": {"thread_id": "thread-1"}}) == str(run_id)
+
+
+def test_run_id_falls_back_to_thread_id():
+    assert _run_id_under({"configurable": {"thread_id": "thread-1"}}) == "thread-1"
+    # configurable 内の run_id は LangChain の設定ではないため参照しない
+    assert _run_id_under({"configurable": {"run_id": "ignored", "thread_id": "thread-1"}}) == "thread-1"
+    assert _run_id_under({"configurable": {}}) == DEFAULT_RUN_ID
+
+
+def test_run_id_outside_graph_is_default():
+    assert current_run_id() == DEFAULT_RUN_ID
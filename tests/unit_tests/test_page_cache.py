@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from agent import page_cache
+from agent.disk_cache import cache_size
+from agent.page_cache import PageRenderCache
+
+
+@pytest.fixture
+def pdf_path(tmp_path) -> str:
+    # PyMuPDFでは開かない（描画は差し替える）ため、内容はハッシュの計算に使うだけ
+    path = tmp_path / "evidence.pdf"
+    path.write_bytes(b"%PDF-1.4 dummy")
+    return str(path)
+
+
+@pytest.fixture
+def renders(monkeypatch) -> list:
+    calls = []
+
+    def fake_render_page(pdf_path, page_index, dpi=None):
+        calls.append(page_index)
+        return bytes([page_index % 256]) * 100
+
+    monkeypatch.setattr(page_cache, "_render_page", fake_render_page)
+    return calls
+
+
+def test_render_page_returns_cached_bytes(tmp_path, pdf_path, renders):
+    cache = PageRenderCache(str(tmp_path / "cache"))
+
+    first = cache.render_page(pdf_path, 0)
+    second = cache.render_page(pdf_path, 0)
+
+    assert first == second
+    assert renders == [0]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_render_page_rerenders_when_entry_was_evicted(tmp_path, pdf_path, renders):
+    cache = PageRenderCache(str(tmp_path / "cache"))
+    cache.render_page(pdf_path, 0)
+    for entry in cache.cache_dir.iterdir():
+        entry.unlink()
+
+    assert cache.render_page(pdf_path, 0) == bytes([0]) * 100
+    assert renders == [0, 0]
+
+
+def test_eviction_runs_only_when_over_budget(tmp_path, pdf_path, renders, monkeypatch):
+    evictions = []
+    original_evict_lru = page_cache.evict_lru
+
+    def counting_evict_lru(*args, **kwargs):
+        evictions.append(kwargs.get("max_bytes"))
+        return original_evict_lru(*args, **kwargs)
+
+    monkeypatch.setattr(page_cache, "evict_lru", counting_evict_lru)
+    cache = PageRenderCache(str(tmp_path / "cache"), max_bytes=1000)
+
+    for page_index in range(10):
+        cache.render_page(pdf_path, page_index)
+    assert evictions == []
+
+    cache.render_page(pdf_path, 10)
+    assert evictions == [900]
+    assert cache_size(cache.cache_dir) <= 900
+
+
+def test_counters_are_consistent_under_concurrency(tmp_path, pdf_path, renders):
+    cache = PageRenderCache(str(tmp_path / "cache"))
+    cache.render_page(pdf_path, 0)
+
+    def worker():
+        for _ in range(200):
+            cache.render_page(pdf_path, 0)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert (cache.hits, cache.misses) == (1600, 1)
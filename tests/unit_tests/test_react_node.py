@@ -0,0 +1,37 @@
+import threading
+import time
+
+from agent import react_node
+
+
+def test_sample_slot_limits_each_run_separately():
+    lock = threading.Lock()
+    active = {"run-a": 0, "run-b": 0}
+    peaks = {"run-a": 0, "run-b": 0, "total": 0}
+    both_started = threading.Barrier(4, timeout=5)
+
+    def branch(run_key: str) -> None:
+        with react_node._sample_slot(run_key, 2):
+            with lock:
+                active[run_key] += 1
+                peaks[run_key] = max(peaks[run_key], active[run_key])
+                peaks["total"] = max(peaks["total"], sum(active.values()))
+            # 2つの実行の枠が同時に埋まるまで待つ（上限を共有していると4つ目が入れずタイムアウトする）
+            try:
+                both_started.wait()
+            except threading.BrokenBarrierError:
+                pass
+            time.sleep(0.01)
+            with lock:
+                active[run_key] -= 1
+
+    threads = [threading.Thread(target=branch, args=(run_key,)) for run_key in ("run-a", "run-b") for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peaks == {"run-a": 2, "run-b": 2, "total": 4}
+    # 全ブランチの終了後はセマフォを破棄する
+    assert "run-a" not in react_node._sample_semaphores
+    assert "run-b" not in react_node._sample_semaphores
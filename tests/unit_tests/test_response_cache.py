@@ -0,0 +1,40 @@
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from agent import response_cache
+from agent.metrics import RESPONSE_CACHE_HIT_KEY
+from agent.response_cache import ResponseCacheMiss, SQLiteResponseCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(response_cache, "_cache", None)
+    monkeypatch.setenv("RESPONSE_CACHE_PATH", str(tmp_path / "responses.sqlite"))
+    monkeypatch.delenv("RESPONSE_CACHE_MODE", raising=False)
+
+
+def test_cache_is_off_unless_enabled(monkeypatch):
+    assert response_cache.get_response_cache() is None
+
+    monkeypatch.setenv("RESPONSE_CACHE_MODE", "readwrite")
+    cache = response_cache.get_response_cache()
+    assert cache is not None and not cache.replay
+
+
+def test_lookup_returns_stored_generations(tmp_path):
+    cache = SQLiteResponseCache(str(tmp_path / "responses.sqlite"))
+    assert cache.lookup("prompt", "llm") is None
+
+    cache.update("prompt", "llm", [ChatGeneration(message=AIMessage(content="OK"))])
+    generations = cache.lookup("prompt", "llm")
+    assert generations[0].message.content == "OK"
+    assert generations[0].generation_info[RESPONSE_CACHE_HIT_KEY] is True
+    # モデル・パラメータが異なる呼び出しにはヒットしない
+    assert cache.lookup("prompt", "other-llm") is None
+
+
+def test_replay_mode_rejects_uncached_calls(tmp_path):
+    cache = SQLiteResponseCache(str(tmp_path / "responses.sqlite"), replay=True)
+    with pytest.raises(ResponseCacheMiss):
+        cache.lookup("prompt", "llm")
@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+from agent.results_log import ResultsLog
+
+
+@pytest.fixture
+def log(tmp_path, monkeypatch) -> ResultsLog:
+    monkeypatch.setenv("RESULTS_LOG_FSYNC", "0")
+    return ResultsLog(str(tmp_path / "results" / "results.jsonl"))
+
+
+def test_latest_keeps_last_entry_per_iteration(log):
+    assert list(log) == []
+    log.append(2, "サンプル2", {"judgment": "NG"})
+    log.append(1, "サンプル1", {"judgment": "OK"})
+    log.append(2, "サンプル2", {"judgment": "OK"})
+
+    assert [(entry["iter_id"], entry["result"]["judgment"]) for entry in log.latest()] == [(1, "OK"), (2, "OK")]
+
+
+def test_read_from_returns_only_new_complete_lines(log):
+    log.append(1, "サンプル1", {"judgment": "OK"})
+    entries, offset = log.read_from(0)
+    assert [entry["sample"] for entry in entries] == ["サンプル1"]
+
+    # 書き込み途中の行は読み込まず、位置も進めない
+    with open(log.path, "ab") as f:
+        f.write(b'{"iter_id": 2, "sam')
+    assert log.read_from(offset) == ([], offset)
+
+    log.append(3, "サンプル3", {"judgment": "OK"})
+    entries, next_offset = log.read_from(offset)
+    # 停止時に途切れた行は読み飛ばし、その後の追記は別の行として読み込む
+    assert [entry["sample"] for entry in entries] == ["サンプル3"]
+    assert log.read_from(next_offset) == ([], next_offset)
+    assert [entry["iter_id"] for entry in log] == [1, 3]
+
+
+def test_concurrent_appends_write_whole_lines(log):
+    threads = [
+        threading.Thread(target=log.append, args=(i, f"サンプル{i}", {"judgment": "OK", "reason": "x" * 1000}))
+        for i in range(1, 21)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(entry["iter_id"] for entry in log) == list(range(1, 21))
@@ -0,0 +1,67 @@
+import asyncio
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+
+from agent.evidence_store import EvidenceStore
+from agent.uploads import UploadBudget, UploadLimitError, safe_join, save_uploads
+
+
+def _upload(filename: str, data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename=filename)
+
+
+def _read(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _leftovers(root) -> list:
+    return [
+        name for _, _, filenames in os.walk(root)
+        for name in filenames if name.endswith((".part", ".link", ".bak"))
+    ]
+
+
+def test_safe_join_keeps_paths_under_root(tmp_path):
+    root = str(tmp_path)
+    assert safe_join(root, "テスト1/a.pdf") == os.path.join(root, "テスト1", "a.pdf")
+    assert safe_join(root, "テスト1\\sub\\a.pdf") == os.path.join(root, "テスト1", "sub", "a.pdf")
+    # 絶対パス・親ディレクトリへの参照は保存先の配下に閉じ込める
+    assert safe_join(root, "/etc/passwd") == os.path.join(root, "etc", "passwd")
+    assert safe_join(root, "../../etc/passwd").startswith(root + os.sep)
+    for invalid in ("", "/", "テスト1/"):
+        with pytest.raises(ValueError):
+            safe_join(root, invalid)
+
+
+def test_failed_upload_restores_replaced_files(tmp_path):
+    root = tmp_path / "sample"
+    (root / "テスト1").mkdir(parents=True)
+    (root / "テスト1" / "a.pdf").write_bytes(b"old")
+
+    files = [_upload("テスト1/a.pdf", b"new-a"), _upload("テスト1/b.pdf", b"new-b" * 4)]
+    with pytest.raises(UploadLimitError):
+        asyncio.run(save_uploads(files, str(root), budget=UploadBudget(max_bytes=12)))
+
+    assert _read(root / "テスト1" / "a.pdf") == b"old"
+    assert not (root / "テスト1" / "b.pdf").exists()
+    assert _leftovers(root) == []
+
+
+def test_failed_upload_restores_store_links_and_index(tmp_path):
+    root = tmp_path / "sample"
+    store = EvidenceStore(str(root), store_dir=str(tmp_path / "store"))
+    asyncio.run(save_uploads([_upload("テスト1/a.pdf", b"old")], str(root), store=store))
+    before = store.list_files()
+
+    files = [_upload("テスト1/a.pdf", b"new-a"), _upload("テスト2/a.pdf", b"x"), _upload("テスト2/bad/", b"")]
+    with pytest.raises(ValueError):
+        asyncio.run(save_uploads(files, str(root), store=store))
+
+    assert _read(root / "テスト1" / "a.pdf") == b"old"
+    assert not (root / "テスト2" / "a.pdf").exists()
+    assert store.list_files() == before
+    assert _leftovers(root) == []
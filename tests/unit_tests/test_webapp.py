@@ -0,0 +1,51 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from agent import webapp
+from agent.webapp import BatchJobRequest, _batch_job_input
+
+
+@pytest.fixture
+def roots(tmp_path, monkeypatch):
+    sample_root = tmp_path / "sample"
+    format_root = tmp_path / "format"
+    (sample_root / "テスト1").mkdir(parents=True)
+    format_root.mkdir()
+    (format_root / "調書.xlsx").write_bytes(b"")
+    monkeypatch.setattr(webapp, "UPLOAD_ROOT", str(sample_root))
+    monkeypatch.setattr(webapp, "UPLOAD_ROOT_FORMAT", str(format_root))
+    monkeypatch.setattr(webapp, "BATCH_OUTPUT_ROOT", str(tmp_path / "batches"))
+    return tmp_path
+
+
+def _job(**kwargs) -> BatchJobRequest:
+    return BatchJobRequest(**{"sample_data_path": "テスト1", "procedure": "手続き", "format_path": "調書.xlsx", **kwargs})
+
+
+def test_batch_job_input_uses_server_side_paths(roots):
+    graph_input = _batch_job_input(_job(options={"parallel_samples": True, "excel_capture_backend": "native"}))
+
+    assert graph_input["parallel_samples"] is True
+    assert graph_input["sample_data_path"] == "テスト1"
+    assert graph_input["excel_file"] == os.path.join(str(roots), "format", "調書.xlsx")
+    assert graph_input["page_cache_dir"] == os.path.join(str(roots), "batches", "page_cache")
+
+
+@pytest.mark.parametrize("option", ["page_cache_dir", "sample_root", "output_dir", "excel_file"])
+def test_batch_job_input_rejects_options_outside_whitelist(roots, option):
+    with pytest.raises(HTTPException) as error:
+        _batch_job_input(_job(options={option: "/tmp"}))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("paths", [
+    {"sample_data_path": "../../etc"},
+    {"sample_data_path": "テスト2"},
+    {"format_path": "../sample/テスト1"},
+])
+def test_batch_job_input_rejects_missing_or_outside_paths(roots, paths):
+    with pytest.raises(HTTPException) as error:
+        _batch_job_input(_job(**paths))
+    assert error.value.status_code == 400